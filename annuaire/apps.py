@@ -22,3 +22,6 @@ from django.apps import AppConfig
 
 class AnnuaireConfig(AppConfig):
     name = "annuaire"
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,326 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import QuerySet
+
+from core.models import StudentModel, ResponsibleModel, TeachingModel, normalize_name
+
+# Incremented each time people change, other processes then rebuild their snapshot.
+DIRECTORY_VERSION_KEY = "annuaire_directory_version"
+# Delay (in seconds) between two checks of the shared version.
+VERSION_CHECK_DELAY = 1
+
+
+def use_directory_snapshot() -> bool:
+    return getattr(settings, "ANNUAIRE_DIRECTORY_SNAPSHOT", False)
+
+
+class DirectoryPerson:
+    """A student or a responsible as kept in the directory snapshot."""
+
+    __slots__ = (
+        "is_student",
+        "id",
+        "first_name",
+        "last_name",
+        "classe_id",
+        "teaching_ids",
+        "inactive",
+        "is_teacher",
+        "is_educator",
+    )
+
+    def __init__(
+        self,
+        is_student: bool,
+        id: int,
+        first_name: str,
+        last_name: str,
+        classe_id: int,
+        teaching_ids: tuple,
+        inactive: bool,
+        is_teacher: bool = False,
+        is_educator: bool = False,
+    ) -> None:
+        self.is_student = is_student
+        # The matricule for students, the primary key for responsibles.
+        self.id = id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.classe_id = classe_id
+        self.teaching_ids = teaching_ids
+        self.inactive = inactive
+        self.is_teacher = is_teacher
+        self.is_educator = is_educator
+
+    @classmethod
+    def from_student(cls, student: StudentModel):
+        return cls(
+            True,
+            student.matricule,
+            student.first_name_search,
+            student.last_name_search,
+            student.classe_id,
+            (student.teaching_id,),
+            student.inactive_from is not None,
+        )
+
+    @classmethod
+    def from_responsible(cls, responsible: ResponsibleModel, teaching_ids: tuple):
+        return cls(
+            False,
+            responsible.id,
+            responsible.first_name_search,
+            responsible.last_name_search,
+            None,
+            teaching_ids,
+            responsible.inactive_from is not None,
+            responsible.is_teacher,
+            responsible.is_educator,
+        )
+
+    def rank(self, tokens: list) -> int:
+        """Rank a name match the way core.people.search_by_name does."""
+        if len(tokens) > 1:
+            if self.last_name.startswith(" ".join(tokens[:2])) or self.last_name.startswith(
+                " ".join(tokens[-2:])
+            ):
+                return 3
+            if (self.first_name == tokens[0] and self.last_name.startswith(tokens[1])) or (
+                self.first_name.startswith(tokens[1]) and self.last_name == tokens[0]
+            ):
+                return 2
+        return 1
+
+
+class NameIndex:
+    """First and last names kept sorted for prefix searches."""
+
+    def __init__(self, people: list) -> None:
+        entries = sorted(
+            [((p.first_name, p.id), p) for p in people]
+            + [((p.last_name, p.id), p) for p in people],
+            key=lambda e: e[0],
+        )
+        self.keys = [e[0] for e in entries]
+        self.people = [e[1] for e in entries]
+
+    def add(self, person: DirectoryPerson) -> None:
+        for name in (person.first_name, person.last_name):
+            i = bisect_left(self.keys, (name, person.id))
+            self.keys.insert(i, (name, person.id))
+            self.people.insert(i, person)
+
+    def remove(self, person: DirectoryPerson) -> None:
+        for name in (person.first_name, person.last_name):
+            i = bisect_left(self.keys, (name, person.id))
+            if i < len(self.keys) and self.keys[i] == (name, person.id):
+                del self.keys[i]
+                del self.people[i]
+
+    def startswith(self, prefix: str) -> list:
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + "\uffff",), lo=start)
+        return self.people[start:end]
+
+
+class DirectorySnapshot:
+    """In-memory copy of people's names, searched without hitting the database."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.teaching_ids_by_name = dict(TeachingModel.objects.values_list("name", "id"))
+
+        self.people = {}
+        for student in StudentModel.objects.only(
+            "matricule",
+            "first_name_search",
+            "last_name_search",
+            "classe",
+            "teaching",
+            "inactive_from",
+        ):
+            self.people[(True, student.matricule)] = DirectoryPerson.from_student(student)
+
+        teachings = {}
+        for resp_id, teaching_id in ResponsibleModel.teaching.through.objects.values_list(
+            "responsiblemodel_id", "teachingmodel_id"
+        ):
+            teachings.setdefault(resp_id, []).append(teaching_id)
+        for resp in ResponsibleModel.objects.only(
+            "first_name_search", "last_name_search", "inactive_from", "is_teacher", "is_educator"
+        ):
+            self.people[(False, resp.id)] = DirectoryPerson.from_responsible(
+                resp, tuple(teachings.get(resp.id, ()))
+            )
+
+        self.indexes = {
+            is_student: NameIndex([p for p in self.people.values() if p.is_student == is_student])
+            for is_student in (True, False)
+        }
+
+    def update(self, person: DirectoryPerson) -> None:
+        with self.lock:
+            self._remove(person.is_student, person.id)
+            self.people[(person.is_student, person.id)] = person
+            self.indexes[person.is_student].add(person)
+
+    def remove(self, is_student: bool, id: int) -> None:
+        with self.lock:
+            self._remove(is_student, id)
+
+    def _remove(self, is_student: bool, id: int) -> None:
+        person = self.people.pop((is_student, id), None)
+        if person:
+            self.indexes[is_student].remove(person)
+
+    def get_teaching_ids(self, teachings) -> set:
+        """Get teaching ids from teaching names or models, None if all teachings."""
+        if not teachings:
+            return None
+        if isinstance(teachings, QuerySet):
+            return set(t.id for t in teachings)
+        if "all" in teachings:
+            return None
+        return set(
+            t.id if isinstance(t, TeachingModel) else self.teaching_ids_by_name.get(t)
+            for t in teachings
+        )
+
+    def search(
+        self,
+        name: str,
+        is_student: bool,
+        teaching_ids: set = None,
+        classe_ids: set = None,
+        active: bool = True,
+        is_teacher: bool = False,
+        is_educator: bool = False,
+        limit: int = 50,
+    ) -> tuple:
+        """Search people like core.people.People name lookups.
+
+        The best rank is found among all the students or responsibles before filtering.
+        :return: The best rank and the ids (matricules for students) of the best people.
+        """
+        tokens = normalize_name(name).split(" ")
+        if not tokens[0]:
+            return 0, []
+
+        with self.lock:
+            candidates = {}
+            for token in tokens:
+                for person in self.indexes[is_student].startswith(token):
+                    candidates[person.id] = person
+        candidates = candidates.values()
+        best_rank = 1 if candidates else 0
+        if len(tokens) > 1:
+            ranks = [(person.rank(tokens), person) for person in candidates]
+            best_rank = max((rank for rank, _ in ranks), default=0)
+            candidates = [person for rank, person in ranks if rank == best_rank]
+
+        people = [
+            p
+            for p in candidates
+            if not (active and p.inactive)
+            and (teaching_ids is None or not teaching_ids.isdisjoint(p.teaching_ids))
+            and (classe_ids is None or p.classe_id in classe_ids)
+            and (p.is_teacher or not is_teacher)
+            and (p.is_educator or not is_educator)
+        ]
+        people = heapq.nsmallest(limit, people, key=lambda p: (p.last_name, p.first_name))
+        # Like a database search, the rank of an empty result is 0.
+        return best_rank if people else 0, [p.id for p in people]
+
+
+_snapshot = None
+_version = None
+_checked_at = 0
+_rebuilding = threading.Lock()
+
+
+def get_directory() -> DirectorySnapshot:
+    """Get the directory snapshot of this process.
+
+    It is built on first use. Once people changed elsewhere, the current snapshot is
+    used while a new one is built in the background.
+    """
+    global _snapshot, _version, _checked_at
+
+    if _snapshot is None:
+        with _rebuilding:
+            if _snapshot is None:
+                _version = cache.get_or_set(DIRECTORY_VERSION_KEY, 1, None)
+                _snapshot = DirectorySnapshot()
+                _checked_at = time.monotonic()
+        return _snapshot
+
+    if time.monotonic() - _checked_at > VERSION_CHECK_DELAY:
+        _checked_at = time.monotonic()
+        version = cache.get_or_set(DIRECTORY_VERSION_KEY, 1, None)
+        if version != _version and _rebuilding.acquire(blocking=False):
+            threading.Thread(target=_rebuild, args=(version,), daemon=True).start()
+    return _snapshot
+
+
+def _rebuild(version: int) -> None:
+    global _snapshot, _version
+    try:
+        _snapshot = DirectorySnapshot()
+        _version = version
+    finally:
+        connection.close()
+        _rebuilding.release()
+
+
+def directory_changed(person: DirectoryPerson = None, is_student: bool = True, id: int = None):
+    """Update this process' snapshot and tell other processes to rebuild theirs.
+
+    :param person: The updated person, None if removed or if many people changed.
+    :param is_student: The type of the removed person.
+    :param id: The removed person's id, None if many people changed.
+    """
+    global _version
+
+    try:
+        version = cache.incr(DIRECTORY_VERSION_KEY)
+    except ValueError:
+        version = None
+        cache.set(DIRECTORY_VERSION_KEY, 1, None)
+
+    if _snapshot is None:
+        return
+    if person:
+        _snapshot.update(person)
+    elif id is not None:
+        _snapshot.remove(is_student, id)
+    else:
+        # Many people changed, rebuild.
+        return
+    if version is not None and version == _version + 1:
+        # Nothing else changed, the snapshot is up to date.
+        _version = version
@@ -0,0 +1,71 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.models import StudentModel, ResponsibleModel, ClasseModel, TeachingModel
+from core.signals import people_bulk_changed
+
+from .directory import DirectoryPerson, directory_changed, use_directory_snapshot
+
+
+@receiver(post_save, sender=StudentModel)
+def student_saved(sender, instance, **kwargs):
+    if use_directory_snapshot():
+        person = DirectoryPerson.from_student(instance)
+        transaction.on_commit(lambda: directory_changed(person))
+
+
+@receiver(post_save, sender=ResponsibleModel)
+def responsible_saved(sender, instance, **kwargs):
+    if use_directory_snapshot():
+        person = DirectoryPerson.from_responsible(
+            instance, tuple(instance.teaching.values_list("id", flat=True))
+        )
+        transaction.on_commit(lambda: directory_changed(person))
+
+
+@receiver(m2m_changed, sender=ResponsibleModel.teaching.through)
+def responsible_teachings_changed(sender, instance, action, reverse, **kwargs):
+    if not use_directory_snapshot() or not action.startswith("post"):
+        return
+    if reverse:
+        # Responsibles of a teaching changed.
+        transaction.on_commit(lambda: directory_changed())
+    else:
+        responsible_saved(sender, instance)
+
+
+@receiver(post_delete, sender=StudentModel)
+@receiver(post_delete, sender=ResponsibleModel)
+def person_deleted(sender, instance, **kwargs):
+    if use_directory_snapshot():
+        is_student, person_id = sender == StudentModel, instance.pk
+        transaction.on_commit(lambda: directory_changed(is_student=is_student, id=person_id))
+
+
+@receiver(post_delete, sender=ClasseModel)
+@receiver([post_save, post_delete], sender=TeachingModel)
+@receiver(people_bulk_changed)
+def people_changed(sender, **kwargs):
+    # Deleting a classe removes it from its students without signals.
+    if use_directory_snapshot():
+        transaction.on_commit(lambda: directory_changed())
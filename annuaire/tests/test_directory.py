@@ -0,0 +1,84 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from core.models import StudentModel, ClasseModel, TeachingModel
+
+from annuaire import directory
+from annuaire.views import search_people
+
+
+@override_settings(ANNUAIRE_DIRECTORY_SNAPSHOT=True)
+class DirectorySnapshotTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        directory._snapshot = None
+        self.dir_user = User.objects.get(username="director")
+        self.teacher_user = User.objects.get(username="teacher")
+
+    def _search(self, use_snapshot, **kwargs):
+        with self.settings(ANNUAIRE_DIRECTORY_SNAPSHOT=use_snapshot):
+            return search_people(**kwargs)
+
+    def test_same_results_as_database(self):
+        secondaire = TeachingModel.objects.filter(name="secondaire")
+        for query in ["jacquel", "jacqueline d", "Adelaï", "barre ad", "jean", "zz"]:
+            for people_type in ["all", "student", "responsible", "teacher", "educator"]:
+                for user, check_access, teachings in [
+                    (self.dir_user, False, ["all"]),
+                    (self.teacher_user, True, secondaire),
+                ]:
+                    params = {
+                        "query": query,
+                        "people_type": people_type,
+                        "teachings": teachings,
+                        "check_access": check_access,
+                        "user": user,
+                    }
+                    self.assertCountEqual(
+                        self._search(True, **params),
+                        self._search(False, **params),
+                        msg=str(params),
+                    )
+
+    def test_search_without_queries(self):
+        directory.get_directory()
+        with self.assertNumQueries(0):
+            rank, matricules = directory.get_directory().search("adelai", True)
+        self.assertEqual(rank, 1)
+        self.assertEqual(len(matricules), 4)
+
+    def test_incremental_update(self):
+        directory.get_directory()
+        with self.captureOnCommitCallbacks(execute=True):
+            StudentModel.objects.create(
+                matricule=999999,
+                first_name="Zoé",
+                last_name="Zygmunt",
+                teaching=TeachingModel.objects.get(name="secondaire"),
+                classe=ClasseModel.objects.filter(teaching__name="secondaire").first(),
+            )
+        self.assertEqual(directory.get_directory().search("zygm", True)[1], [999999])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudentModel.objects.get(matricule=999999).delete()
+        self.assertEqual(directory.get_directory().search("zygm", True)[1], [])
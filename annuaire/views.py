@@ -45,7 +45,7 @@ from z3c.rml import rml2pdf
 from unidecode import unidecode
 
 from core.utilities import get_menu, check_student_photo
-from core.people import People, get_classes
+from core.people import People, get_classes, get_access_scope
 from core.models import (
     StudentModel,
     ClasseModel,
@@ -55,7 +55,9 @@ from core.models import (
 )
 from core.serializers import (
     StudentSerializer,
+    StudentLightSerializer,
     ResponsibleSerializer,
+    ResponsibleLightSerializer,
     ClasseSerializer,
     StudentGeneralInfoSerializer,
     StudentContactInfoSerializer,
@@ -67,6 +69,7 @@ from core.serializers import (
 )
 from core.views import get_app_settings
 
+from .directory import get_directory, use_directory_snapshot
 from .models import AnnuaireSettingsModel
 from .serializers import AnnuaireSettingsSerializer
 
@@ -169,6 +172,18 @@ def search_people(
     if len(query) < 1:
         return []
 
+    if use_directory_snapshot() and query != "everybody":
+        return search_people_snapshot(
+            query,
+            people_type,
+            teachings,
+            check_access,
+            user,
+            tenure_class_only=tenure_class_only,
+            educ_by_years=educ_by_years,
+            active=active,
+        )
+
     truncate_limit = 50
 
     people = []
@@ -178,19 +193,21 @@ def search_people(
         )
 
         result = People().get_people_by_name(query, teachings, classes=classe_years, active=active)
-        # Check quality.
-        if result["student"][1] > result["responsible"][1]:
-            people = StudentSerializer(result["student"][0][:truncate_limit], many=True).data
-        elif result["responsible"][1] > result["student"][1]:
-            people = ResponsibleSerializer(
-                result["responsible"][0][:truncate_limit], many=True
-            ).data
+        students = list(StudentSerializer.setup_eager_loading(result["student"])[:truncate_limit])
+        responsibles = list(
+            ResponsibleSerializer.setup_eager_loading(result["responsible"])[:truncate_limit]
+        )
+        # Keep the best ranked people.
+        student_rank = students[0].name_rank if students else 0
+        responsible_rank = responsibles[0].name_rank if responsibles else 0
+        if student_rank > responsible_rank:
+            people = StudentSerializer(students, many=True).data
+        elif responsible_rank > student_rank:
+            people = ResponsibleSerializer(responsibles, many=True).data
         else:
             people = (
-                StudentSerializer(result["student"][0][: truncate_limit / 2], many=True).data
-                + ResponsibleSerializer(
-                    result["responsible"][0][: truncate_limit / 2], many=True
-                ).data
+                StudentSerializer(students[: truncate_limit // 2], many=True).data
+                + ResponsibleSerializer(responsibles[: truncate_limit // 2], many=True).data
             )
 
     if people_type == "student":
@@ -216,35 +233,95 @@ def search_people(
                     students = students.filter(teaching__in=teachings)
                 else:
                     students = students.filter(teaching__name__in=teachings)
-            truncate_limit = len(students)
+            truncate_limit = students.count()
         else:
             students = People().get_students_by_name(
                 query, teachings, classes=classe_years, active=active
-            )[:truncate_limit]
-
-        people = StudentSerializer(students, many=True).data
-
-    if people_type == "responsible":
-        people = ResponsibleSerializer(
-            People().get_responsibles_by_name(query, teachings, active=active)[:truncate_limit],
-            many=True,
-        ).data
+            )
 
-    if people_type == "teacher":
-        people = ResponsibleSerializer(
-            People().get_teachers_by_name(query, teachings, active=active)[:truncate_limit],
-            many=True,
+        people = StudentSerializer(
+            StudentSerializer.setup_eager_loading(students)[:truncate_limit], many=True
         ).data
 
-    if people_type == "educator":
+    if people_type in ["responsible", "teacher", "educator"]:
+        get_by_name = getattr(People(), "get_%ss_by_name" % people_type)
+        responsibles = get_by_name(query, teachings, active=active)
         people = ResponsibleSerializer(
-            People().get_educators_by_name(query, teachings, active=active)[:truncate_limit],
-            many=True,
+            ResponsibleSerializer.setup_eager_loading(responsibles)[:truncate_limit], many=True
         ).data
 
     return people[:truncate_limit]
 
 
+def search_people_snapshot(
+    query,
+    people_type,
+    teachings,
+    check_access,
+    user,
+    tenure_class_only=True,
+    educ_by_years=True,
+    active=True,
+):
+    """Same as search_people but names are searched in the directory snapshot."""
+    truncate_limit = 50
+    directory = get_directory()
+    teaching_ids = directory.get_teaching_ids(teachings)
+
+    students, responsibles = [], []
+    if people_type == "all":
+        student_rank, students = directory.search(
+            query, True, teaching_ids, active=active, limit=truncate_limit
+        )
+        responsible_rank, responsibles = directory.search(
+            query, False, teaching_ids, active=active, limit=truncate_limit
+        )
+        # Keep the best ranked people.
+        if student_rank > responsible_rank:
+            responsibles = []
+        elif responsible_rank > student_rank:
+            students = []
+        else:
+            students = students[: truncate_limit // 2]
+            responsibles = responsibles[: truncate_limit // 2]
+    elif people_type == "student":
+        classe_ids = None
+        if check_access:
+            classe_ids = get_access_scope(
+                user, teachings, tenure_class_only, educ_by_years
+            ).classe_ids
+        students = directory.search(
+            query, True, teaching_ids, classe_ids, active=active, limit=truncate_limit
+        )[1]
+    elif people_type in ["responsible", "teacher", "educator"]:
+        responsibles = directory.search(
+            query,
+            False,
+            teaching_ids,
+            active=active,
+            is_teacher=people_type == "teacher",
+            is_educator=people_type == "educator",
+            limit=truncate_limit,
+        )[1]
+
+    people = []
+    if students:
+        student_models = StudentSerializer.setup_eager_loading(StudentModel.objects).in_bulk(
+            students
+        )
+        people += StudentSerializer(
+            [student_models[m] for m in students if m in student_models], many=True
+        ).data
+    if responsibles:
+        responsible_models = ResponsibleSerializer.setup_eager_loading(
+            ResponsibleModel.objects
+        ).in_bulk(responsibles)
+        people += ResponsibleSerializer(
+            [responsible_models[r] for r in responsibles if r in responsible_models], many=True
+        ).data
+    return people
+
+
 class SearchPeopleAPI(APIView):
     permission_classes = (IsAuthenticated,)
     parser_classes = (JSONParser,)
@@ -403,19 +480,38 @@ class StudentInfoViewSet(ReadOnlyModelViewSet):
     serializer_class = StudentSerializer
     permission_classes = (IsAuthenticated,)
 
+    def get_queryset(self):
+        if self.request.GET.get("light"):
+            return StudentLightSerializer.setup_eager_loading(self.queryset)
+        return StudentSerializer.setup_eager_loading(self.queryset, no_course=False)
+
+    def get_serializer_class(self):
+        if self.request.GET.get("light"):
+            return StudentLightSerializer
+        return super().get_serializer_class()
+
     def get_serializer(self, *args, **kwargs):
         serializer_class = self.get_serializer_class()
         kwargs["context"] = self.get_serializer_context()
-        kwargs["no_course"] = False
+        if serializer_class == StudentSerializer:
+            kwargs["no_course"] = False
         return serializer_class(*args, **kwargs)
 
 
 class ResponsibleInfoViewSet(ReadOnlyModelViewSet):
-    queryset = ResponsibleModel.objects.all()
+    queryset = ResponsibleModel.objects.order_by("id")
     serializer_class = ResponsibleSerializer
     permission_classes = (IsAuthenticated,)
     lookup_field = "matricule"
 
+    def get_queryset(self):
+        return self.get_serializer_class().setup_eager_loading(self.queryset)
+
+    def get_serializer_class(self):
+        if self.request.GET.get("light"):
+            return ResponsibleLightSerializer
+        return super().get_serializer_class()
+
 
 class ResponsibleSensitiveViewSet(ReadOnlyModelViewSet):
     queryset = ResponsibleModel.objects.all()
@@ -428,7 +524,7 @@ class ResponsibleSensitiveViewSet(ReadOnlyModelViewSet):
         if not self.request.user.groups.intersection(allowed_groups).exists():
             return ResponsibleModel.objects.none()
 
-        return super().get_queryset()
+        return ResponsibleSensitiveSerializer.setup_eager_loading(super().get_queryset())
 
 
 class StudentGeneralInfoViewSet(ReadOnlyModelViewSet):
@@ -19,10 +19,12 @@
 
 import csv
 import re
+import time
 from typing import Union, TextIO
 from datetime import date
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User, Group
@@ -35,8 +37,10 @@ from core.models import (
     ResponsibleModel,
     CourseModel,
     GivenCourseModel,
+    normalize_name,
 )
 from core.ldap import get_ldap_connection, get_django_dict_from_ldap
+from core.signals import people_bulk_changed
 from core.utilities import get_scholar_year
 
 
@@ -44,6 +48,9 @@ class ImportBase:
     """Base class to import students and responsible"""
 
     sync_course = True
+    bulk_sync = False
+    # Let the caller set inactive people once all the entries are imported (bulk import only).
+    defer_inactives = False
 
     def __init__(self, teaching: TeachingModel) -> None:
         self.teaching = teaching
@@ -51,6 +58,106 @@ class ImportBase:
     def _sync(self, iterable) -> None:
         pass
 
+    def bulk_save_classes(self, classes: set) -> tuple:
+        """Get the teaching's classes by (year, letter), creating the missing ones.
+
+        Return the classes and the number of created classes.
+        """
+        existing = {
+            (c.year, c.letter): c for c in ClasseModel.objects.filter(teaching=self.teaching)
+        }
+        new_classes = [
+            ClasseModel(year=year, letter=letter, teaching=self.teaching)
+            for year, letter in classes
+            if (year, letter) not in existing
+        ]
+        for c in ClasseModel.objects.bulk_create(new_classes):
+            existing[(c.year, c.letter)] = c
+        return existing, len(new_classes)
+
+    def bulk_save_courses(self, courses: list) -> tuple:
+        """Create or update courses and their given courses from course entries.
+
+        Return the given courses by (course id, group), the number of created courses and
+        the number of updated courses. Courses unknown when read (id None) are given the id of
+        the teaching's course with the same short name, created if needed.
+        """
+        created = self.bulk_resolve_courses(courses)
+        course_ids = {c["id"] for c in courses}
+        existing = CourseModel.objects.in_bulk(course_ids)
+        given_courses = {}
+        for gc in GivenCourseModel.objects.filter(course__in=course_ids).order_by("-id"):
+            given_courses[(gc.course_id, gc.group)] = gc
+
+        new_courses, updated_courses = {}, {}
+        for c in courses:
+            long_name = c["long_name"] if "long_name" in c else ""
+            if c["id"] in existing:
+                course_model = existing[c["id"]]
+                if (course_model.short_name, course_model.long_name) != (
+                    c["short_name"],
+                    long_name,
+                ):
+                    course_model.short_name = c["short_name"]
+                    course_model.long_name = long_name
+                    updated_courses[course_model.id] = course_model
+            else:
+                new_courses[c["id"]] = CourseModel(
+                    id=c["id"],
+                    short_name=c["short_name"],
+                    long_name=long_name,
+                    teaching=self.teaching,
+                )
+        CourseModel.objects.bulk_create(new_courses.values())
+        CourseModel.objects.bulk_update(updated_courses.values(), ["short_name", "long_name"])
+        existing.update(new_courses)
+
+        new_given_courses = [
+            GivenCourseModel(course=existing[c_id], group=group)
+            for c_id, group in {(c["id"], c["group"]) for c in courses}
+            if (c_id, group) not in given_courses
+        ]
+        for gc in GivenCourseModel.objects.bulk_create(new_given_courses):
+            given_courses[(gc.course_id, gc.group)] = gc
+        return given_courses, len(new_courses) + created, len(updated_courses)
+
+    def bulk_resolve_courses(self, courses: list) -> int:
+        """Set the id of courses unknown when read, one course by short name.
+
+        Return the number of created courses.
+        """
+        unknown = {}
+        for c in courses:
+            if c["id"] is None:
+                unknown.setdefault(c["short_name"], c.get("long_name", ""))
+        if not unknown:
+            return 0
+
+        ids = dict(
+            CourseModel.objects.filter(
+                teaching=self.teaching, short_name__in=unknown.keys()
+            ).values_list("short_name", "id")
+        )
+        # The database gives their id to new courses.
+        new_courses = CourseModel.objects.bulk_create(
+            [
+                CourseModel(short_name=short_name, long_name=long_name, teaching=self.teaching)
+                for short_name, long_name in unknown.items()
+                if short_name not in ids
+            ]
+        )
+        ids.update({c.short_name: c.id for c in new_courses})
+        for c in courses:
+            if c["id"] is None:
+                c["id"] = ids[c["short_name"]]
+        return len(new_courses)
+
+    def print_phase(self, phase: str, start: float) -> float:
+        """Print the time spent in an import phase and return the start of the next one."""
+        now = time.perf_counter()
+        self.print_log("%s done in %.2fs." % (phase, now - start))
+        return now
+
     """Get value from an entry."""
 
     def get_value(self, entry: object, column: str) -> Union[int, str, date, None]:
@@ -79,6 +186,8 @@ class ImportResponsible(ImportBase):
     ldap_connection = None
     username_attribute = "username"
     base_dn = None
+    # Look for responsibles with a temporary matricule by their email.
+    match_email = False
 
     def __init__(self, teaching: TeachingModel) -> None:
         super().__init__(teaching)
@@ -96,6 +205,9 @@ class ImportResponsible(ImportBase):
         if not self.teaching:
             self.print_log("teaching is missing, aborting.")
             return
+        if self.bulk_sync:
+            self._bulk_sync(iterable)
+            return
         processed = 0
         resp_synced = set()
         if self.search_login_directory:
@@ -279,10 +391,300 @@ class ImportResponsible(ImportBase):
 
         self.print_log("Import done.")
 
+    def _bulk_sync(self, iterable) -> None:
+        """Import responsibles with a constant number of queries.
+
+        Users, classes, courses and groups are resolved once for all the entries and the
+        relations are written directly in the through tables, in a single transaction.
+        """
+        start = time.perf_counter()
+        if self.search_login_directory:
+            self.ldap_connection = get_ldap_connection()
+            self.base_dn = settings.AUTH_LDAP_USER_SEARCH.base_dn
+        self.print_log("Importing responsibles in bulk…(%s)" % self.teaching.display_name)
+
+        rows = []
+        for entry in iterable:
+            # First check mandatory field.
+            first_name = self.get_value(entry, "first_name")
+            if not first_name:
+                self.print_log("No first name found, skipping responsible.")
+                continue
+            last_name = self.get_value(entry, "last_name")
+            if not last_name:
+                self.print_log("No last name found, skipping responsible.")
+                continue
+            matricule = int(self.get_value(entry, "matricule"))
+            if not matricule:
+                self.print_log("No unique identifier found, skipping responsible.")
+                continue
+            username = self.get_value(entry, self.username_attribute)
+            if self.search_login_directory:
+                self.ldap_connection.search(
+                    self.base_dn, "(%s=%i)" % (self.ldap_unique_attr, matricule), attributes="*"
+                )
+                for r in self.ldap_connection.response:
+                    username = get_django_dict_from_ldap(r)["username"]
+            row = {
+                "matricule": matricule,
+                "first_name": first_name,
+                "last_name": last_name,
+                "username": username.strip(" ") if username else None,
+                "email": self.get_value(entry, "email"),
+                "email_school": self.get_value(entry, "email_school"),
+                "birth_date": self.get_value(entry, "birth_date"),
+                "is_educator": self.get_value(entry, "is_educator"),
+                "is_teacher": self.get_value(entry, "is_teacher"),
+                "classes": [],
+                "tenures": [],
+                "courses": [],
+            }
+            if self.has_inactivity:
+                inactive_from = self.get_value(entry, "inactive_from")
+                row["inactive_from"] = (
+                    timezone.make_aware(
+                        timezone.datetime.combine(inactive_from, timezone.datetime.min.time())
+                    )
+                    if inactive_from
+                    else None
+                )
+            if row["is_teacher"]:
+                classe = self.get_value(entry, "classe")
+                if classe and type(classe) != list:
+                    classe = [classe]
+                row["classes"] = [(int(c[0]), c[1:].lower()) for c in classe or [] if len(c) >= 2]
+                tenure = self.get_value(entry, "tenure")
+                if tenure and type(tenure) == str:
+                    tenure = [tenure]
+                row["tenures"] = [(int(t[0]), t[1:].lower()) for t in tenure or []]
+                courses = self.get_value(entry, "courses") if self.sync_course else None
+                if courses and type(courses) != list:
+                    courses = [courses]
+                row["courses"] = courses or []
+            rows.append(row)
+        start = self.print_phase("Reading %i entries" % len(rows), start)
+
+        with transaction.atomic():
+            # Resolve responsibles and users.
+            responsibles = {
+                r.matricule: r
+                for r in ResponsibleModel.objects.filter(
+                    matricule__in={row["matricule"] for row in rows}
+                )
+            }
+            if self.match_email:
+                emails = {
+                    row["email"]: row["matricule"]
+                    for row in rows
+                    if row["email"] and row["matricule"] not in responsibles
+                }
+                for resp in ResponsibleModel.objects.filter(email__in=emails.keys()):
+                    # Set definitive matricule.
+                    resp.matricule = emails[resp.email]
+                    responsibles[resp.matricule] = resp
+            users = {
+                u.username: u
+                for u in User.objects.filter(
+                    username__in={row["username"] for row in rows if row["username"]}
+                )
+            }
+            educ_group = Group.objects.get(name="educateur")
+            teach_group = Group.objects.get(name="professeur")
+            start = self.print_phase("Loading existing responsibles and users", start)
+
+            # Apply entries in order, a responsible may span several entries.
+            synced = {}
+            teachers = set()
+            new_users, updated_users = {}, {}
+            user_groups = set()
+            for row in rows:
+                resp = responsibles.get(row["matricule"])
+                if not resp:
+                    resp = ResponsibleModel(matricule=row["matricule"])
+                    responsibles[row["matricule"]] = resp
+                if not resp.is_sync:
+                    self.print_log(f"Is not synced, skipping responsible {resp.fullname}.")
+                    continue
+                if row["username"]:
+                    user = users.get(row["username"])
+                    if not user:
+                        user = User(username=row["username"])
+                        user.set_unusable_password()
+                        users[user.username] = user
+                        new_users[user.username] = user
+                    if (user.last_name, user.first_name) != (row["last_name"], row["first_name"]):
+                        user.last_name = row["last_name"]
+                        user.first_name = row["first_name"]
+                        updated_users[user.username] = user
+                    if "email" in self.username_attribute and user.email != user.username:
+                        user.email = user.username
+                        updated_users[user.username] = user
+                    resp.user = user
+
+                resp.first_name = row["first_name"]
+                resp.last_name = row["last_name"]
+                resp.set_search_names()
+                resp.inactive_from = row.get("inactive_from")
+                if row["is_educator"]:
+                    resp.is_educator = True
+                    if resp.user:
+                        user_groups.add((resp.user.username, educ_group.id))
+                if row["is_teacher"]:
+                    resp.is_teacher = True
+                    if resp.user:
+                        user_groups.add((resp.user.username, teach_group.id))
+                    teachers.add(resp.matricule)
+                if row["email"]:
+                    resp.email = row["email"]
+                if row["email_school"]:
+                    resp.email_school = row["email_school"]
+                if row["birth_date"]:
+                    resp.birth_date = row["birth_date"]
+                synced.setdefault(resp.matricule, (resp, []))[1].append(row)
+
+            User.objects.bulk_create(new_users.values())
+            User.objects.bulk_update(
+                [u for name, u in updated_users.items() if name not in new_users],
+                ["last_name", "first_name", "email"],
+            )
+            User.groups.through.objects.bulk_create(
+                [
+                    User.groups.through(user_id=users[username].id, group_id=group_id)
+                    for username, group_id in user_groups
+                ],
+                ignore_conflicts=True,
+            )
+            start = self.print_phase(
+                "Users (%i new, %i updated)" % (len(new_users), len(updated_users)), start
+            )
+
+            resp_fields = [
+                "matricule",
+                "first_name",
+                "last_name",
+                "first_name_search",
+                "last_name_search",
+                "inactive_from",
+                "user",
+                "is_educator",
+                "is_teacher",
+                "email",
+                "email_school",
+                "birth_date",
+            ]
+            new_resps = [resp for resp, _ in synced.values() if not resp.pk]
+            updated_resps = [resp for resp, _ in synced.values() if resp.pk]
+            ResponsibleModel.objects.bulk_create(new_resps)
+            ResponsibleModel.objects.bulk_update(updated_resps, resp_fields, batch_size=200)
+            ResponsibleModel.teaching.through.objects.bulk_create(
+                [
+                    ResponsibleModel.teaching.through(
+                        responsiblemodel_id=resp.id, teachingmodel_id=self.teaching.id
+                    )
+                    for resp, _ in synced.values()
+                ],
+                ignore_conflicts=True,
+            )
+            start = self.print_phase(
+                "Responsibles (%i new, %i updated)" % (len(new_resps), len(updated_resps)), start
+            )
+
+            # Classes, tenures and courses are only updated for teachers.
+            teacher_rows = [row for m in teachers for row in synced[m][1]]
+            classes, new_classes = self.bulk_save_classes(
+                {c for row in teacher_rows for c in row["classes"] + row["tenures"]}
+            )
+            given_courses, new_courses, updated_courses = self.bulk_save_courses(
+                [c for row in teacher_rows for c in row["courses"]]
+            )
+            wanted = {"classe": set(), "tenure": set(), "courses": set()}
+            for m in teachers:
+                resp_id = synced[m][0].id
+                for row in synced[m][1]:
+                    for c in row["classes"] + row["tenures"]:
+                        wanted["classe"].add((resp_id, classes[c].id))
+                    for t in row["tenures"]:
+                        wanted["tenure"].add((resp_id, classes[t].id))
+                    for c in row["courses"]:
+                        wanted["courses"].add((resp_id, given_courses[(c["id"], c["group"])].id))
+            teacher_ids = [synced[m][0].id for m in teachers]
+            current = {
+                "classe": ResponsibleModel.classe.through.objects.filter(
+                    classemodel__teaching=self.teaching
+                ),
+                "tenure": ResponsibleModel.tenure.through.objects.all(),
+                "courses": ResponsibleModel.courses.through.objects.filter(
+                    givencoursemodel__course__teaching=self.teaching
+                ),
+            }
+            links = {}
+            for relation, queryset in current.items():
+                through = getattr(ResponsibleModel, relation).through
+                target = through._meta.get_field(
+                    "givencoursemodel" if relation == "courses" else "classemodel"
+                ).attname
+                current_links = {
+                    (link[1], link[2]): link[0]
+                    for link in queryset.filter(responsiblemodel__in=teacher_ids).values_list(
+                        "id", "responsiblemodel_id", target
+                    )
+                }
+                removed = [i for link, i in current_links.items() if link not in wanted[relation]]
+                through.objects.filter(id__in=removed).delete()
+                added = [
+                    through(**{"responsiblemodel_id": r, target: t})
+                    for r, t in wanted[relation]
+                    if (r, t) not in current_links
+                ]
+                through.objects.bulk_create(added, ignore_conflicts=True)
+                links[relation] = (len(added), len(removed))
+            self.print_phase(
+                "Classes and courses (%i new classes, %i new courses, %i updated courses, "
+                "classes +%i/-%i, tenures +%i/-%i, courses +%i/-%i)"
+                % (
+                    (new_classes, new_courses, updated_courses)
+                    + links["classe"]
+                    + links["tenure"]
+                    + links["courses"]
+                ),
+                start,
+            )
+
+            # Bulk writes do not send model signals.
+            people_bulk_changed.send(sender=self.__class__)
+            if not self.defer_inactives:
+                self.bulk_set_inactives(teachers)
+                self.print_log("Import done.")
+
+    def bulk_set_inactives(self, matricules) -> None:
+        """Set inactive the teachers of the teaching that are not in matricules."""
+        if len(matricules) == 0:
+            return
+        start = time.perf_counter()
+        inactives = ResponsibleModel.objects.filter(
+            teaching=self.teaching, is_teacher=True, is_sync=True
+        ).exclude(matricule__in=matricules)
+        with transaction.atomic():
+            if not self.has_inactivity:
+                inactive_ids = list(inactives.values_list("id", flat=True))
+                ResponsibleModel.objects.filter(id__in=inactive_ids).update(
+                    inactive_from=timezone.make_aware(timezone.datetime.now())
+                )
+                for relation in ["classe", "tenure", "courses"]:
+                    getattr(ResponsibleModel, relation).through.objects.filter(
+                        responsiblemodel__in=inactive_ids
+                    ).delete()
+                inactive_count = len(inactive_ids)
+            else:
+                inactive_count = inactives.delete()[1].get(ResponsibleModel._meta.label, 0)
+            people_bulk_changed.send(sender=self.__class__)
+        self.print_phase("Set %i inactive teachers" % inactive_count, start)
+
 
 class ImportResponsibleLDAP(ImportResponsible):
     search_login_directory = False
     has_inactivity = True
+    match_email = True
 
     def __init__(self, teaching: TeachingModel) -> None:
         super().__init__(teaching=teaching)
@@ -327,10 +729,12 @@ class ImportResponsibleCSV(ImportResponsible):
         column_index: dict = None,
         is_teacher: bool = False,
         is_educator: bool = False,
+        bulk_sync=False,
     ) -> None:
         super().__init__(teaching=teaching)
         self.is_teacher = is_teacher
         self.is_educator = is_educator
+        self.bulk_sync = bulk_sync
         self.column_map = column_map
         if not column_index:
             self.column_to_index = {
@@ -360,7 +764,7 @@ class ImportResponsibleCSV(ImportResponsible):
         super()._sync(reader)
 
     def get_value(self, entry: list, column: str) -> Union[int, str, date, None]:
-        if column == "courses":
+        if column == "courses" and "course_name_short" in self.column_to_index:
             course = {
                 "short_name": entry[self.column_to_index["course_name_short"]],
             }
@@ -373,7 +777,8 @@ class ImportResponsibleCSV(ImportResponsible):
             try:
                 course["id"] = CourseModel.objects.get(short_name=course["short_name"]).id
             except ObjectDoesNotExist:
-                course["id"] = CourseModel.objects.latest("id").id + 1
+                # Rows are saved by chunks in bulk mode, ids are given by bulk_save_courses.
+                course["id"] = None if self.bulk_sync else CourseModel.objects.latest("id").id + 1
             return course
         if column == "is_teacher":
             return self.is_teacher
@@ -393,6 +798,8 @@ class ImportResponsibleFDB(ImportResponsible):
     }
     is_teacher = False
     is_educator = False
+    match_email = True
+    overwrites = {}
 
     def __init__(
         self,
@@ -404,6 +811,7 @@ class ImportResponsibleFDB(ImportResponsible):
         classe_format="%C",
         username_attribute=None,
         sync_course=True,
+        bulk_sync=False,
     ) -> None:
         super().__init__(teaching)
         self.server = fdb_server
@@ -412,9 +820,18 @@ class ImportResponsibleFDB(ImportResponsible):
         self.ldap_unique_attr = ldap_unique_attr
         self.classe_format = classe_format
         self.sync_course = sync_course
+        self.bulk_sync = bulk_sync
         if username_attribute:
             self.username_attribute = username_attribute
 
+        if "proeco" in settings.INSTALLED_APPS:
+            from proeco.models import OverwriteDataModel
+
+            responsibles_overwrite = OverwriteDataModel.objects.filter(
+                people="responsible", uid__isnull=False
+            )
+            self.overwrites = {f"{r.uid}-{r.field}": r.value for r in responsibles_overwrite}
+
     def sync(self) -> None:
         from libreschoolfdb.reader import get_teachers, get_educators
 
@@ -434,16 +851,8 @@ class ImportResponsibleFDB(ImportResponsible):
         self._sync(educators.items())
 
     def get_value(self, entry: dict, column: str) -> Union[int, str, date, None]:
-        if "proeco" in settings.INSTALLED_APPS:
-            from proeco.models import OverwriteDataModel
-
-            try:
-                overwrite = OverwriteDataModel.objects.get(
-                    people="responsible", uid=entry[0], field=column
-                )
-                return overwrite.value
-            except ObjectDoesNotExist:
-                pass
+        if f"{entry[0]}-{column}" in self.overwrites:
+            return self.overwrites[f"{entry[0]}-{column}"]
 
         if column == "courses":
             return [c for c in entry[1][column] if "classes" in c and len(c["classes"]) > 0]
@@ -528,9 +937,12 @@ class ImportStudent(ImportBase):
     ldap_connection = None
     base_dn = None
 
-    def __init__(self, teaching: TeachingModel, search_login_directory: bool = False) -> None:
+    def __init__(
+        self, teaching: TeachingModel, search_login_directory: bool = False, bulk_sync=False
+    ) -> None:
         super().__init__(teaching)
         self.search_login_directory = search_login_directory
+        self.bulk_sync = bulk_sync
 
     def format_value(self, value: Union[int, str], column: str) -> Union[int, str, date, None]:
         if type(value) == str and len(value) == 0:
@@ -568,6 +980,9 @@ class ImportStudent(ImportBase):
         if not self.teaching:
             self.print_log("teaching is missing, aborting.")
             return
+        if self.bulk_sync:
+            self._bulk_sync(iterable)
+            return
         processed = 0
         student_synced = set()
         if self.search_login_directory:
@@ -693,12 +1108,213 @@ class ImportStudent(ImportBase):
 
         self.print_log("Import done.")
 
+    def _bulk_sync(self, iterable) -> None:
+        """Import students with a constant number of queries.
+
+        Existing classes, courses, students and additional infos are loaded once, incoming rows
+        are compared against them and only the differences are written, in a single transaction.
+        """
+        start = time.perf_counter()
+        if self.search_login_directory:
+            self.ldap_connection = get_ldap_connection()
+            self.base_dn = settings.AUTH_LDAP_USER_SEARCH.base_dn
+        self.print_log("Importing students in bulk…(%s)" % self.teaching.display_name)
+
+        rows = {}
+        for entry in iterable:
+            # First check mandatory field.
+            matricule = int(self.get_value(entry, "matricule"))
+            if not matricule:
+                self.print_log("No matricule found, skipping student.")
+                continue
+            first_name = self.get_value(entry, "first_name")
+            if not first_name:
+                self.print_log("No first name found, skipping student.")
+                continue
+            last_name = self.get_value(entry, "last_name")
+            if not last_name:
+                self.print_log("No last name found, skipping student.")
+                continue
+            year = self.get_value(entry, "year")
+            if not year:
+                self.print_log("No year found, skipping student (%s %s)." % (last_name, first_name))
+                continue
+            classe_letter = self.get_value(entry, "classe_letter")
+            if not classe_letter:
+                self.print_log(
+                    "No classe letter found, skipping student (%s %s)." % (last_name, first_name)
+                )
+                continue
+
+            # A student may span several rows (one per course), the last row wins.
+            row = rows.setdefault(matricule, {"courses": {}})
+            row["first_name"] = first_name
+            row["last_name"] = last_name
+            row["classe"] = (year, classe_letter)
+
+            courses = self.get_value(entry, "courses") if self.sync_course else None
+            if courses and type(courses) != list:
+                courses = [courses]
+            for c in courses or []:
+                # New courses have no id yet, they are told apart by their short name.
+                row["courses"][(c["id"], c["short_name"], c["group"])] = c
+
+            info = {}
+            for c in self.additional_columns:
+                val = self.get_value(entry, c)
+                if val:
+                    info[c] = val
+                elif c != "birth_date":
+                    info[c] = ""
+            if self.search_login_directory:
+                self.ldap_connection.search(
+                    self.base_dn, "(matricule=%i)" % matricule, attributes="*"
+                )
+                for r in self.ldap_connection.response:
+                    ldap_info = get_django_dict_from_ldap(r)
+                    info["username"] = ldap_info["username"]
+                    info["password"] = ldap_info["password"]
+            row["info"] = info
+        start = self.print_phase("Reading %i students" % len(rows), start)
+
+        with transaction.atomic():
+            classes, new_classes = self.bulk_save_classes({r["classe"] for r in rows.values()})
+            given_courses, new_courses, updated_courses = self.bulk_save_courses(
+                [c for r in rows.values() for c in r["courses"].values()]
+            )
+            start = self.print_phase(
+                "Classes and courses (%i new classes, %i new courses, %i updated courses)"
+                % (new_classes, new_courses, updated_courses),
+                start,
+            )
+
+            students = StudentModel.objects.in_bulk(rows.keys())
+            infos = AdditionalStudentInfo.objects.in_bulk(rows.keys())
+            start = self.print_phase("Loading existing students", start)
+
+            # Students.
+            student_fields = [
+                "first_name",
+                "last_name",
+                "first_name_search",
+                "last_name_search",
+                "teaching",
+                "classe",
+                "inactive_from",
+            ]
+            new_students, updated_students = [], []
+            for matricule, row in rows.items():
+                values = {
+                    "first_name": row["first_name"],
+                    "last_name": row["last_name"],
+                    "first_name_search": normalize_name(row["first_name"]),
+                    "last_name_search": normalize_name(row["last_name"]),
+                    "teaching_id": self.teaching.id,
+                    "classe_id": classes[row["classe"]].id,
+                    "inactive_from": None,
+                }
+                if matricule not in students:
+                    new_students.append(StudentModel(matricule=matricule, **values))
+                    continue
+                student = students[matricule]
+                if any(getattr(student, f) != v for f, v in values.items()):
+                    for f, v in values.items():
+                        setattr(student, f, v)
+                    updated_students.append(student)
+            StudentModel.objects.bulk_create(new_students)
+            StudentModel.objects.bulk_update(updated_students, student_fields, batch_size=500)
+            start = self.print_phase(
+                "Students (%i new, %i updated)" % (len(new_students), len(updated_students)),
+                start,
+            )
+
+            # Courses followed by students, only courses from this teaching are replaced.
+            through = StudentModel.courses.through
+            current_links = {
+                (link[1], link[2]): link[0]
+                for link in through.objects.filter(
+                    studentmodel__in=rows.keys(), givencoursemodel__course__teaching=self.teaching
+                ).values_list("id", "studentmodel_id", "givencoursemodel_id")
+            }
+            wanted_links = {
+                (matricule, given_courses[(c["id"], c["group"])].id)
+                for matricule, row in rows.items()
+                for c in row["courses"].values()
+            }
+            removed_links = [i for link, i in current_links.items() if link not in wanted_links]
+            through.objects.filter(id__in=removed_links).delete()
+            added_links = [
+                through(studentmodel_id=m, givencoursemodel_id=gc)
+                for m, gc in wanted_links
+                if (m, gc) not in current_links
+            ]
+            through.objects.bulk_create(added_links, ignore_conflicts=True, batch_size=1000)
+            start = self.print_phase(
+                "Student courses (%i added, %i removed)" % (len(added_links), len(removed_links)),
+                start,
+            )
+
+            # Additional info.
+            info_fields = {
+                f.name: f
+                for f in AdditionalStudentInfo._meta.concrete_fields
+                if f.name in self.additional_columns
+            }
+            new_infos, updated_infos = [], []
+            for matricule, row in rows.items():
+                info = infos.get(matricule)
+                if not info:
+                    info = AdditionalStudentInfo(student_id=matricule)
+                    new_infos.append(info)
+                changed = False
+                for c, val in row["info"].items():
+                    if c not in info_fields:
+                        continue
+                    val = info_fields[c].to_python(val)
+                    if getattr(info, c) != val:
+                        setattr(info, c, val)
+                        changed = True
+                if changed and matricule in infos:
+                    updated_infos.append(info)
+            AdditionalStudentInfo.objects.bulk_create(new_infos, batch_size=500)
+            AdditionalStudentInfo.objects.bulk_update(
+                updated_infos, info_fields.keys(), batch_size=500
+            )
+            self.print_phase(
+                "Additional info (%i new, %i updated)" % (len(new_infos), len(updated_infos)),
+                start,
+            )
+
+            # Bulk writes do not send model signals.
+            people_bulk_changed.send(sender=self.__class__)
+            if not self.defer_inactives:
+                self.bulk_set_inactives(rows.keys())
+                self.print_log("Import done.")
+
+    def bulk_set_inactives(self, matricules) -> None:
+        """Set inactive the students of the teaching that are not in matricules."""
+        start = time.perf_counter()
+        inactives = StudentModel.objects.filter(teaching=self.teaching).exclude(
+            matricule__in=matricules
+        )
+        with transaction.atomic():
+            inactive_count = inactives.update(
+                inactive_from=timezone.make_aware(timezone.datetime.now()), classe=None
+            )
+            StudentModel.courses.through.objects.filter(studentmodel__in=inactives).delete()
+            people_bulk_changed.send(sender=self.__class__)
+        self.print_phase("Set %i inactive students" % inactive_count, start)
+
 
 class ImportStudentCSV(ImportStudent):
     def __init__(
-        self, teaching: TeachingModel, column_map: dict = None, column_index: dict = None
+        self,
+        teaching: TeachingModel,
+        column_map: dict = None,
+        column_index: dict = None,
+        bulk_sync=False,
     ) -> None:
-        super().__init__(teaching=teaching, search_login_directory=False)
+        super().__init__(teaching=teaching, search_login_directory=False, bulk_sync=bulk_sync)
         self.column_map = column_map
         if not column_index:
             self.column_to_index = {
@@ -743,7 +1359,8 @@ class ImportStudentCSV(ImportStudent):
             try:
                 course["id"] = CourseModel.objects.get(short_name=course["short_name"]).id
             except ObjectDoesNotExist:
-                course["id"] = CourseModel.objects.latest("id").id + 1
+                # Rows are saved by chunks in bulk mode, ids are given by bulk_save_courses.
+                course["id"] = None if self.bulk_sync else CourseModel.objects.latest("id").id + 1
             return course
         try:
             return self.format_value(entry[self.column_to_index[column]], column)
@@ -811,8 +1428,9 @@ class ImportStudentFDB(ImportStudent):
         teaching_type,
         classe_format="%C",
         sync_course=True,
+        bulk_sync=False,
     ) -> None:
-        super().__init__(teaching, search_login_directory)
+        super().__init__(teaching, search_login_directory, bulk_sync)
         self.server = fdb_server
         self.teaching_type = teaching_type
         self.classe_format = classe_format
@@ -25,6 +25,7 @@ import subprocess
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
@@ -32,8 +33,10 @@ from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework import status
 
+from core.metrics import get_metrics, reset_metrics
+from core.models import ImportPeopleModel, TeachingModel
 from core.utilities import get_menu
-from core.tasks import task_import_people, task_update
+from core.tasks import task_import_people_file, task_update
 from io import StringIO
 
 
@@ -79,14 +82,29 @@ class ImportPeopleAPIView(APIView):
         if not self.people:
             return Response(status=status.HTTP_400_BAD_REQUEST, data="No people type has been set.")
 
-        csv_text = request.FILES["file"].read().decode("utf-8-sig")
+        file_obj = request.FILES["file"]
         teaching = request.POST.get("teaching", None)
         columns = request.POST.get("columns", "{}")
         ignore_first_line = json.loads(request.POST.get("ignore_first_line"))
         if not teaching:
             return Response(status=status.HTTP_400_BAD_REQUEST, data="Teaching needed.")
-
-        task = task_import_people.delay(csv_text, teaching, columns, ignore_first_line, self.people)
+        try:
+            teaching_model = TeachingModel.objects.get(id=int(teaching))
+        except ObjectDoesNotExist:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST, data="Teaching model does not exist!"
+            )
+
+        # Store the file once, the task reads it by chunks.
+        import_people = ImportPeopleModel(
+            people=self.people,
+            teaching=teaching_model,
+            columns=columns,
+            ignore_first_line=ignore_first_line,
+        )
+        import_people.csv_file.save(file_obj.name, file_obj)
+
+        task = task_import_people_file.delay(import_people.id)
         return Response(data=json.dumps(str(task)), status=status.HTTP_200_OK)
 
 
@@ -144,3 +162,16 @@ class LogoAPI(APIView):
         with open(img_path, "w+b") as f:
             f.write(file_obj.read())
         return Response(status=status.HTTP_201_CREATED)
+
+
+class MetricsAPIView(APIView):
+    """Queries and latency by view, merged over the server's processes."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(get_metrics())
+
+    def delete(self, request, format=None):
+        reset_metrics()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -22,3 +22,9 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = "core"
+
+    def ready(self):
+        from . import signals, changelog
+        from .settings_registry import settings_registry
+
+        settings_registry.autodiscover()
@@ -0,0 +1,166 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+from icalendar import Calendar
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.models import ImportCalendarModel
+
+logger = logging.getLogger(__name__)
+
+STORE_KEY = "core_calendar_store"
+REFRESH_LOCK_KEY = "core_calendar_refresh_lock"
+# Delay (in seconds) after which the stored events are refreshed in background.
+REFRESH_INTERVAL = 60 * 30
+# Only one refresh is triggered by the API during this delay.
+REFRESH_LOCK_TIMEOUT = 60 * 5
+FETCH_TIMEOUT = 20
+FETCH_WORKERS = 8
+
+
+def _to_datetime(value):
+    """Make an event's date comparable, whole day events stay dates."""
+    if isinstance(value, datetime) and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def _is_upcoming(begin, end, now: datetime) -> bool:
+    """Whether an event is ongoing or upcoming, whole day events are compared with today."""
+    today = now if isinstance(begin, datetime) else timezone.localdate(now)
+    return begin > today or end > today
+
+
+def parse_events(ics: str) -> list:
+    """Parse the upcoming and ongoing events of an ics feed."""
+    now = timezone.now()
+    events = []
+    for event in Calendar.from_ical(ics).walk("VEVENT"):
+        if "DTSTART" not in event:
+            continue
+        begin = _to_datetime(event["DTSTART"].dt)
+        all_day = not isinstance(begin, datetime)
+        if "DTEND" in event:
+            end = _to_datetime(event["DTEND"].dt)
+        else:
+            end = begin + timedelta(days=1) if all_day else begin
+        if not _is_upcoming(begin, end, now):
+            continue
+        events.append(
+            {
+                "name": str(event.get("SUMMARY", "")),
+                "begin": begin.isoformat(),
+                "end": end.isoformat(),
+                "all_day": all_day,
+            }
+        )
+    return events
+
+
+def fetch_feed(session: requests.Session, calendar: ImportCalendarModel, feed: dict) -> dict:
+    """Fetch a calendar with a conditional GET, the previous feed is kept if it did not change."""
+    headers = {}
+    if feed and feed["url"] == calendar.url:
+        if feed.get("etag"):
+            headers["If-None-Match"] = feed["etag"]
+        if feed.get("last_modified"):
+            headers["If-Modified-Since"] = feed["last_modified"]
+
+    try:
+        response = session.get(calendar.url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code == 304 and feed:
+            # Events that ended since then are skipped when serving them.
+            return dict(feed, name=calendar.name)
+        response.raise_for_status()
+        return {
+            "name": calendar.name,
+            "url": calendar.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "events": parse_events(response.text),
+        }
+    except (requests.RequestException, ValueError) as err:
+        logger.warning("Unable to refresh calendar %s: %s", calendar.name, err)
+        # Serve the previous events until the calendar is reachable again.
+        return feed
+
+
+def refresh_calendars(session: requests.Session = None) -> dict:
+    """Fetch every calendar concurrently and store their upcoming events."""
+    session = session or requests.Session()
+    feeds = cache.get(STORE_KEY, {}).get("feeds", {})
+    calendars = list(ImportCalendarModel.objects.all())
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        fetched = executor.map(lambda c: fetch_feed(session, c, feeds.get(c.id)), calendars)
+        feeds = {c.id: feed for c, feed in zip(calendars, fetched) if feed}
+
+    store = {"updated": time.time(), "feeds": feeds}
+    cache.set(STORE_KEY, store, None)
+    cache.delete(REFRESH_LOCK_KEY)
+    return store
+
+
+def _format_date(value: str, all_day: bool, is_end: bool = False) -> str:
+    if not all_day:
+        return datetime.fromisoformat(value).strftime("%H:%M" if is_end else "%d/%m/%Y %H:%M")
+    value = date.fromisoformat(value)
+    if is_end:
+        # Whole day events end the next day.
+        value -= timedelta(days=1)
+    return value.strftime("%d/%m/%Y")
+
+
+def get_events() -> list:
+    """The stored upcoming events, a stale store is refreshed in background (and still served)."""
+    from core.tasks import task_refresh_calendars
+
+    store = cache.get(STORE_KEY)
+    if (not store or time.time() - store["updated"] > REFRESH_INTERVAL) and cache.add(
+        REFRESH_LOCK_KEY, True, REFRESH_LOCK_TIMEOUT
+    ):
+        task_refresh_calendars.delay()
+    if not store:
+        return []
+
+    now = timezone.now()
+    events = []
+    for feed in store["feeds"].values():
+        for event in feed["events"]:
+            parse = date.fromisoformat if event["all_day"] else datetime.fromisoformat
+            if not _is_upcoming(parse(event["begin"]), parse(event["end"]), now):
+                continue
+            events.append(
+                {
+                    "calendar": feed["name"],
+                    "name": event["name"],
+                    "begin": _format_date(event["begin"], event["all_day"]),
+                    "end": _format_date(event["end"], event["all_day"], True),
+                }
+            )
+    # By date then by time, whole day events first.
+    events.sort(key=lambda e: (e["begin"][6:10], e["begin"][3:5], e["begin"][:2], e["begin"][11:]))
+    return events
@@ -0,0 +1,155 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+from core.models import ChangeLogModel
+from core.people import get_core_settings
+from core.sync import SYNC_MODELS, SyncError, get_session, get_sync_name, push_model
+
+# Changes are replayed after this delay (in seconds), to send them together.
+REPLAY_DELAY = 5
+REPLAY_SCHEDULED_KEY = "core_changelog_replay_scheduled"
+# Number of log entries replayed at once.
+REPLAY_BATCH = 5000
+# Replayed entries are kept for this number of days, then removed.
+REPLAYED_RETENTION_DAYS = 7
+
+
+def get_remote() -> tuple:
+    """The remote instance url and a session to it, None if no remote is set."""
+    core_settings = get_core_settings()
+    if not core_settings.remote or not core_settings.remote_token:
+        return None
+    remote_url = core_settings.remote
+    if remote_url[-1] != "/":
+        remote_url += "/"
+    return remote_url, get_session(core_settings.remote_token)
+
+
+def log_changes(model, pks, action: str = ChangeLogModel.SAVE) -> None:
+    """Log changed rows of a synced model, they are sent to the remote after the commit."""
+    name = get_sync_name(model)
+    if not name or not pks:
+        return
+    core_settings = get_core_settings()
+    if not core_settings.remote or not core_settings.remote_token:
+        return
+    ChangeLogModel.objects.bulk_create(
+        [ChangeLogModel(model=name, object_pk=str(pk), action=action) for pk in pks]
+    )
+    transaction.on_commit(schedule_replay)
+
+
+def schedule_replay() -> None:
+    from core.tasks import task_replay_changes
+
+    if cache.add(REPLAY_SCHEDULED_KEY, True, REPLAY_DELAY * 2):
+        task_replay_changes.apply_async(countdown=REPLAY_DELAY)
+
+
+def prune_changes() -> int:
+    """Remove the entries replayed for longer than the retention.
+
+    :return: The number of removed entries.
+    """
+    limit = timezone.now() - datetime.timedelta(days=REPLAYED_RETENTION_DAYS)
+    return ChangeLogModel.objects.filter(is_replayed=True, datetime_creation__lt=limit).delete()[0]
+
+
+def replay_changes(remote_url: str = None, session=None) -> int:
+    """Send the logged changes to the remote instance, by batches.
+
+    :return: The number of replayed log entries.
+    """
+    if not remote_url:
+        remote = get_remote()
+        if not remote:
+            return 0
+        remote_url, session = remote
+
+    replayed = 0
+    while True:
+        entries = list(
+            ChangeLogModel.objects.filter(is_replayed=False)
+            .order_by("id")
+            .values_list("id", "model", "object_pk")[:REPLAY_BATCH]
+        )
+        if not entries:
+            prune_changes()
+            return replayed
+
+        changes = defaultdict(set)
+        for _, name, pk in entries:
+            changes[name].add(pk)
+        # Models are sent in dependency order, models that are not synced anymore are dropped.
+        for name in SYNC_MODELS:
+            if name not in changes:
+                continue
+            _, errors = push_model(session, remote_url, name, pks=changes[name], workers=1)
+            if errors:
+                raise SyncError("; ".join(errors))
+
+        ChangeLogModel.objects.filter(id__in=[e[0] for e in entries]).update(is_replayed=True)
+        replayed += len(entries)
+
+
+def log_save(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Logins only update the last login date, it is not synced.
+    if raw or sender == User and update_fields and set(update_fields) == {"last_login"}:
+        return
+    log_changes(sender, [instance.pk])
+
+
+def log_delete(sender, instance, **kwargs):
+    log_changes(sender, [instance.pk], ChangeLogModel.DELETE)
+
+
+def log_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        log_changes(instance.__class__, [instance.pk])
+    elif pk_set:
+        # The rows of the other side of the relation changed.
+        log_changes(model, pk_set)
+
+
+def watch_model(model) -> None:
+    """Log the changes of a synced model.
+
+    Receivers are only connected to synced models (and their many to many relations) so that
+    bulk deletes of other models keep their fast path.
+    """
+    uid = "changelog_%s" % model._meta.label_lower
+    post_save.connect(log_save, sender=model, dispatch_uid=uid)
+    post_delete.connect(log_delete, sender=model, dispatch_uid=uid)
+    for field in model._meta.many_to_many:
+        m2m_changed.connect(log_m2m_change, sender=field.remote_field.through, dispatch_uid=uid)
+
+
+for sync_model in SYNC_MODELS.values():
+    watch_model(sync_model.model)
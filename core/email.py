@@ -113,10 +113,11 @@ def send_email_with_mg(
     )
 
 
-def send_email_with_sp(
-    recipients, subject, body, from_email="Informatique ISLN <informatique@isln.be>", attachments=()
-):
-    recipients = list(map(lambda r: {"address": r}, recipients))
+SPARKPOST_TRANSMISSIONS_URL = "https://api.sparkpost.com/api/v1/transmissions"
+
+
+def get_sp_content(subject, body, from_email="Informatique ISLN <informatique@isln.be>"):
+    """Content and options of a SparkPost transmission, without its recipients."""
     if "<" in from_email:
         name = from_email.split("<")[0]
         reply_to = from_email.split("<")[1][:-1]  # Remove last chevron.
@@ -124,7 +125,7 @@ def send_email_with_sp(
     else:
         reply_to = from_email
         from_email = from_email.replace("@", "@email.")
-    data = {
+    return {
         "content": {
             "from": from_email,
             "subject": subject,
@@ -137,6 +138,13 @@ def send_email_with_sp(
             "click_tracking": False,
         },
     }
+
+
+def send_email_with_sp(
+    recipients, subject, body, from_email="Informatique ISLN <informatique@isln.be>", attachments=()
+):
+    recipients = list(map(lambda r: {"address": r}, recipients))
+    data = get_sp_content(subject, body, from_email)
     if settings.DEBUG:
         data["recipients"] = [{"address": settings.EMAIL_ADMIN}]
         data["content"]["html"] = data["content"]["html"].replace(
@@ -146,7 +154,7 @@ def send_email_with_sp(
         data["recipients"] = recipients
 
     response = requests.post(
-        "https://api.sparkpost.com/api/v1/transmissions",
+        SPARKPOST_TRANSMISSIONS_URL,
         headers={"Authorization": settings.SPARKPOST_KEY},
         json=data,
     )
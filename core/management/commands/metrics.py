@@ -0,0 +1,66 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+
+from core.metrics import get_metrics, reset_metrics
+
+COLUMNS = (
+    ("count", "count", "%i"),
+    ("avg_queries", "queries", "%.1f"),
+    ("max_queries", "max q.", "%i"),
+    ("avg_sql_time", "sql ms", "%.1f"),
+    ("avg_serializer_time", "ser. ms", "%.1f"),
+    ("avg_total_time", "total ms", "%.1f"),
+    ("p95_total_time", "p95 ms", "%s"),
+)
+
+
+class Command(BaseCommand):
+    help = "Show queries and latency by view, as recorded by QueryMetricsMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--sort",
+            default="avg_queries",
+            choices=[c[0] for c in COLUMNS],
+            help="Sort views by this column, default average queries.",
+        )
+
+        parser.add_argument("-l", "--limit", type=int, default=30, help="Show only n views.")
+
+        parser.add_argument(
+            "--reset", action="store_true", help="Forget the recorded metrics after showing them."
+        )
+
+    def handle(self, *args, **options):
+        metrics = get_metrics()
+        views = sorted(
+            metrics.items(), key=lambda v: v[1][options["sort"]] or float("inf"), reverse=True
+        )[: options["limit"]]
+
+        width = max([len(v[0]) for v in views] + [4])
+        self.stdout.write("view".ljust(width) + "".join(c[1].rjust(10) for c in COLUMNS))
+        for view, stats in views:
+            values = [(c[2] % stats[c[0]]) if stats[c[0]] is not None else "inf" for c in COLUMNS]
+            self.stdout.write(view.ljust(width) + "".join(v.rjust(10) for v in values))
+
+        if options["reset"]:
+            reset_metrics()
@@ -17,35 +17,63 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
-from datetime import date, timedelta
+import logging
+import time
+from collections import defaultdict
+from datetime import date, time as day_time
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.utils import timezone
 
+from core.people import get_core_settings
 from core.utilities import get_scholar_year
 from core.models import TeachingModel, StudentModel
-from student_absence.models import StudentAbsenceModel, JustificationModel
+from student_absence.models import StudentAbsenceModel, JustificationModel, PeriodModel
+
+logger = logging.getLogger(__name__)
+
+# ProEco absences are by half day, periods starting before noon are in the morning.
+NOON = day_time(12, 0)
+PROECO_USERNAME = "ProEco"
+
+
+def _justification_key(just) -> tuple:
+    return (
+        just.date_just_start,
+        just.half_day_start,
+        just.date_just_end,
+        just.half_day_end,
+        just.short_name,
+        just.half_days,
+    )
 
 
 class Command(BaseCommand):
-    help = "Import a ProEco database into HappySchool."
+    help = "Import ProEco absences and justifications into HappySchool."
 
     def handle(self, *args, **options):
         from libreschoolfdb import reader
-        from libreschoolfdb.absences import Absence
 
-        proecos = settings.SYNC_FDB_SERVER
         current_year = get_scholar_year()
+        core_settings = get_core_settings()
+        year_start = date(
+            current_year,
+            core_settings.month_scholar_year_start,
+            core_settings.day_scholar_year_start,
+        )
+        periods = list(PeriodModel.objects.all())
 
-        student_synced = set()
-        for proeco in proecos:
+        for proeco in settings.SYNC_FDB_SERVER:
             try:
                 teaching_model = TeachingModel.objects.get(name=proeco["teaching_name"])
             except ObjectDoesNotExist:
                 print("teaching__name: %s, not found" % proeco["teaching_name"])
                 continue
 
+            start = time.monotonic()
             # ProEco student list.
             proeco_students = reader.get_students(
                 year=current_year,
@@ -54,56 +82,121 @@ class Command(BaseCommand):
                 med_info=False,
                 parents_info=False,
             )
+            fetched = time.monotonic()
             print("%s students found" % len(proeco_students))
-            processed = 0
-            for matricule, s in proeco_students.items():
-                processed += 1
-                if processed % 50 == 1:
-                    print(processed - 1)
-                try:
-                    student = StudentModel.objects.get(matricule=matricule)
-                except ObjectDoesNotExist:
-                    # No student found, ignoring.
-                    continue
-
-                # Import absences.
-                absences = s["absences"] if "absences" in s else None
-                if not absences:
-                    continue
-                absences_processed = set()
-                for a in absences:
-                    try:
-                        absence = StudentAbsenceModel.objects.get(
-                            student=student, date_absence=a.date
-                        )
-                        absence.morning = a.morning
-                        absence.afternoon = a.afternoon
-                        absence.save()
-                    except:
-                        absence = StudentAbsenceModel.objects.create(
-                            student=student,
-                            date_absence=a.date,
-                            morning=a.morning,
-                            afternoon=a.afternoon,
+
+            with transaction.atomic():
+                counts = self.sync_teaching(teaching_model, proeco_students, periods, year_start)
+            logger.info(
+                "%s: absences %i inserted, %i updated, %i deleted; justifications %i inserted,"
+                " %i deleted; fetched in %.1fs, synced in %.1fs",
+                teaching_model.name,
+                *counts,
+                fetched - start,
+                time.monotonic() - fetched,
+            )
+
+    def sync_teaching(self, teaching, proeco_students, periods, year_start) -> tuple:
+        """Apply the differences between ProEco and HappySchool with bulk queries.
+
+        :return: The counts of inserted, updated and deleted absences, and of inserted and
+            deleted justifications.
+        """
+        students = dict(
+            StudentModel.objects.filter(
+                teaching=teaching, matricule__in=proeco_students.keys()
+            ).values_list("matricule", "pk")
+        )
+
+        # Existing absences by (student, date), then by period.
+        existing = defaultdict(dict)
+        for absence in StudentAbsenceModel.objects.filter(
+            student__in=students.values(), date_absence__gte=year_start
+        ).only("id", "student_id", "date_absence", "period_id", "is_absent", "username"):
+            existing[(absence.student_id, absence.date_absence)][absence.period_id] = absence
+
+        to_create, to_update = [], []
+        now = timezone.now()
+        changed_dates = set()
+        for matricule, student in proeco_students.items():
+            if matricule not in students or not student.get("absences"):
+                continue
+            student_id = students[matricule]
+            for a in student["absences"]:
+                rows = existing.get((student_id, a.date), {})
+                for period in periods:
+                    is_absent = bool(a.morning if period.start < NOON else a.afternoon)
+                    absence = rows.pop(period.id, None)
+                    if absence is None:
+                        to_create.append(
+                            StudentAbsenceModel(
+                                student_id=student_id,
+                                date_absence=a.date,
+                                period=period,
+                                is_absent=is_absent,
+                                username=PROECO_USERNAME,
+                            )
                         )
-                    absences_processed.add(absence.pk)
-
-                # Remove deleted absences.
-                StudentAbsenceModel.objects.filter(student=student).exclude(
-                    pk__in=absences_processed
-                ).delete()
-
-                # Import justifications.
-                justifications = s["absences_justifications"]
-                # Clean first.
-                JustificationModel.objects.filter(student=student).delete()
-                for j in justifications:
-                    JustificationModel.objects.create(
-                        student=student,
-                        date_just_start=j["start"][0],
-                        date_just_end=j["end"][0],
-                        half_day_start=j["start"][1],
-                        half_day_end=j["end"][1],
-                        short_name=j["code"],
-                        half_days=j["half_days"],
-                    )
+                    elif absence.is_absent != is_absent:
+                        absence.is_absent = is_absent
+                        absence.datetime_update = now
+                        to_update.append(absence)
+                    else:
+                        continue
+                    changed_dates.add(a.date)
+
+        # Remaining rows imported from ProEco were removed from it (or their period does not
+        # exist anymore). Rows saved in HappySchool are kept, ProEco may not know them yet.
+        to_delete = []
+        for (_, absence_date), rows in existing.items():
+            imported = [a.id for a in rows.values() if a.username == PROECO_USERNAME]
+            if imported:
+                to_delete += imported
+                changed_dates.add(absence_date)
+
+        StudentAbsenceModel.objects.bulk_create(to_create, batch_size=1000)
+        StudentAbsenceModel.objects.bulk_update(
+            to_update, ["is_absent", "datetime_update"], batch_size=1000
+        )
+        StudentAbsenceModel.objects.filter(id__in=to_delete).delete()
+
+        just_created, just_deleted = self.sync_justifications(students, proeco_students)
+
+        if changed_dates and "student_absence_teacher" in settings.INSTALLED_APPS:
+            # Bulk queries do not send signals, cached overviews are invalidated here.
+            from student_absence_teacher.overview import invalidate_overview
+
+            transaction.on_commit(lambda: [invalidate_overview(d) for d in changed_dates])
+
+        return len(to_create), len(to_update), len(to_delete), just_created, just_deleted
+
+    def sync_justifications(self, students, proeco_students) -> tuple:
+        existing = defaultdict(list)
+        for just in JustificationModel.objects.filter(student__in=students.values()):
+            existing[(just.student_id,) + _justification_key(just)].append(just.id)
+
+        to_create = []
+        for matricule, student in proeco_students.items():
+            if matricule not in students:
+                continue
+            for j in student.get("absences_justifications", []):
+                just = JustificationModel(
+                    student_id=students[matricule],
+                    date_just_start=j["start"][0],
+                    date_just_end=j["end"][0],
+                    half_day_start=j["start"][1],
+                    half_day_end=j["end"][1],
+                    short_name=j["code"],
+                    half_days=j["half_days"],
+                )
+                ids = existing.get((just.student_id,) + _justification_key(just))
+                if ids:
+                    # Already imported, kept as is.
+                    ids.pop()
+                else:
+                    to_create.append(just)
+
+        to_delete = [i for ids in existing.values() for i in ids]
+        JustificationModel.objects.filter(id__in=to_delete).delete()
+        JustificationModel.objects.bulk_create(to_create, batch_size=1000)
+        return len(to_create), len(to_delete)
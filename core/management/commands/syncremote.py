@@ -18,84 +18,48 @@
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.core.management.base import BaseCommand
-from django.contrib.auth.models import User, Group
 
-from core.views import get_core_settings
-from core.models import (
-    TeachingModel,
-    ClasseModel,
-    ResponsibleModel,
-    StudentModel,
-    CourseModel,
-    GivenCourseModel,
-)
-from core.serializers import (
-    TeachingSerializer,
-    ClasseSerializer,
-    ResponsibleRemoteSerializer,
-    StudentWriteSerializer,
-    GroupSerializer,
-    UserSerializer,
-    GivenCourseFlatSerializer,
-    CourseSerializer,
-)
+from core.changelog import get_remote, replay_changes
+from core.sync import CHUNK_SIZE, WORKERS, SyncError, get_enabled_models, push_model
 
 
 class Command(BaseCommand):
-    help = "Sync core with a remote instance."
-    remote_url = ""
-    header = {}
+    help = "Sync core with a remote instance, only rows changed since the last sync are sent."
 
-    def handle(self, *args, **options):
-        settings = get_core_settings()
-        if not settings.remote or not settings.remote_token:
-            print("Settings for remote is not set in CoreSettings")
-
-        self.remote_url = settings.remote
-        if self.remote_url[-1] != "/":
-            self.remote_url += "/"
-        remote_token = settings.remote_token
-        self.header = {"Authorization": "Token %s" % remote_token}
-
-        print("Teachings…")
-        self.create_or_update_remote(TeachingModel, "core/api/teaching", TeachingSerializer)
-        print("Classes…")
-        self.create_or_update_remote(ClasseModel, "core/api/classe", ClasseSerializer)
-        print("Groups…")
-        self.create_or_update_remote(Group, "core/api/group", GroupSerializer)
-        print("Users…")
-        self.create_or_update_remote(User, "core/api/user", UserSerializer)
-        print("Courses…")
-        self.create_or_update_remote(CourseModel, "core/api/course", CourseSerializer)
-        self.create_or_update_remote(
-            GivenCourseModel, "core/api/given_course", GivenCourseFlatSerializer
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Send every row, even the unchanged ones."
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=CHUNK_SIZE, help="Number of rows by request."
         )
-        print("Responsibles…")
-        self.create_or_update_remote(
-            ResponsibleModel, "core/api/responsible", ResponsibleRemoteSerializer
+        parser.add_argument(
+            "--workers", type=int, default=WORKERS, help="Number of simultaneous requests."
         )
-        print("Students…")
-        self.create_or_update_remote(StudentModel, "core/api/student", StudentWriteSerializer)
 
-    def create_or_update_remote(self, model, base_url, serializer_class):
-        import requests
+    def handle(self, *args, **options):
+        remote = get_remote()
+        if not remote:
+            print("Settings for remote is not set in CoreSettings")
+            return
+        remote_url, session = remote
 
-        for obj in model.objects.all():
-            url = self.remote_url + "%s/%i/" % (
-                base_url,
-                obj.pk,
-            )
-            result = requests.get(url, headers=self.header)
+        # Logged changes first, deletions included.
+        try:
+            print("%i logged changes replayed." % replay_changes(remote_url, session))
+        except SyncError as err:
+            print("Error: %s" % err)
 
-            serializer = serializer_class(obj)
-            if result.status_code == 200:
-                # Update data.
-                update = requests.put(url, headers=self.header, json=serializer.data)
-                print("Update %s: %s" % (str(obj), update.status_code == 200))
-            elif result.status_code == 404:
-                # Create data
-                url = "/".join(url.split("/")[:-2]) + "/"
-                create = requests.post(url, headers=self.header, json=serializer.data)
-                print("Create %s: %s" % (str(obj), create.status_code == 201))
-                if create.status_code != 201:
-                    print(create.text)
+        # Then rows changed without signals (bulk imports,…).
+        for name in get_enabled_models():
+            sent, errors = push_model(
+                session,
+                remote_url,
+                name,
+                full=options["full"],
+                chunk_size=options["chunk_size"],
+                workers=options["workers"],
+            )
+            print("%s: %i rows sent." % (name, sent))
+            for error in errors:
+                print("Error: %s" % error)
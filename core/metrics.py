@@ -0,0 +1,197 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import socket
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque, namedtuple
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+from rest_framework.serializers import BaseSerializer
+
+# Upper bounds of the histograms' buckets, the last bucket holds everything above.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Number of requests kept by view, older ones are dropped.
+SAMPLES_PER_VIEW = 1000
+# Delay (in seconds) between two writes of this process' metrics in the cache.
+FLUSH_INTERVAL = 10
+# Processes that did not write their metrics since this delay are ignored.
+PROCESS_TIMEOUT = 60 * 10
+PROCESSES_KEY = "core_metrics_processes"
+RESET_KEY = "core_metrics_reset"
+
+# Times are in milliseconds.
+Sample = namedtuple("Sample", ["queries", "sql_time", "serializer_time", "total_time"])
+
+
+class RequestMetrics:
+    """Queries and times of the current request."""
+
+    __slots__ = ("queries", "sql_time", "serializer_time", "serializer_depth")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper counting queries."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_time += (time.perf_counter() - start) * 1000
+
+
+current_request_metrics = ContextVar("current_request_metrics", default=None)
+
+
+def instrument_serializers() -> None:
+    """Time serializations (BaseSerializer.data) of the current request."""
+    data = BaseSerializer.data
+    if getattr(data.fget, "is_timed", False):
+        return
+
+    def timed_data(serializer):
+        metrics = current_request_metrics.get()
+        if metrics is None:
+            return data.fget(serializer)
+        # Nested serializations are already timed.
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            metrics.serializer_depth -= 1
+            if metrics.serializer_depth == 0:
+                metrics.serializer_time += (time.perf_counter() - start) * 1000
+
+    timed_data.is_timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+def histogram(values, buckets: tuple) -> list:
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        counts[bisect_left(buckets, value)] += 1
+    return counts
+
+
+def percentile(counts: list, buckets: tuple, ratio: float):
+    """Estimate a percentile as the upper bound of its bucket, None if above all buckets."""
+    rank = ratio * sum(counts)
+    total = 0
+    for i, count in enumerate(counts):
+        total += count
+        if total >= rank and count:
+            return buckets[i] if i < len(buckets) else None
+    return 0
+
+
+class MetricsRecorder:
+    """Keep the last requests' metrics of each view and share them through the cache."""
+
+    def __init__(self) -> None:
+        self.samples = defaultdict(lambda: deque(maxlen=SAMPLES_PER_VIEW))
+        self.key = "core_metrics_%s_%i" % (socket.gethostname(), os.getpid())
+        self.flushed_at = 0
+        self.reset_at = time.time()
+
+    def add(self, view: str, sample: Sample) -> None:
+        self.samples[view].append(sample)
+        if time.monotonic() - self.flushed_at > FLUSH_INTERVAL:
+            self.flush()
+
+    def summary(self) -> dict:
+        summary = {}
+        for view, samples in list(self.samples.items()):
+            samples = list(samples)
+            summary[view] = {
+                "count": len(samples),
+                "queries": sum(s.queries for s in samples),
+                "sql_time": sum(s.sql_time for s in samples),
+                "serializer_time": sum(s.serializer_time for s in samples),
+                "total_time": sum(s.total_time for s in samples),
+                "max_queries": max(s.queries for s in samples),
+                "max_total_time": max(s.total_time for s in samples),
+                "queries_histogram": histogram((s.queries for s in samples), QUERY_BUCKETS),
+                "latency_histogram": histogram((s.total_time for s in samples), LATENCY_BUCKETS),
+            }
+        return summary
+
+    def flush(self) -> None:
+        self.flushed_at = time.monotonic()
+        reset_at = cache.get(RESET_KEY, 0)
+        if reset_at > self.reset_at:
+            self.samples.clear()
+            self.reset_at = reset_at
+        cache.set(self.key, self.summary(), PROCESS_TIMEOUT)
+        processes = cache.get(PROCESSES_KEY, {})
+        now = time.time()
+        processes = {k: t for k, t in processes.items() if now - t < PROCESS_TIMEOUT}
+        processes[self.key] = now
+        cache.set(PROCESSES_KEY, processes, None)
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.reset_at = time.time()
+        cache.set(RESET_KEY, self.reset_at, None)
+        self.flush()
+
+
+recorder = MetricsRecorder()
+
+
+def get_metrics() -> dict:
+    """Merge the metrics of every process by view, with averages and percentiles."""
+    recorder.flush()
+    merged = {}
+    for summary in cache.get_many(cache.get(PROCESSES_KEY, {}).keys()).values():
+        for view, stats in summary.items():
+            if view not in merged:
+                merged[view] = stats
+                continue
+            current = merged[view]
+            for field in ["count", "queries", "sql_time", "serializer_time", "total_time"]:
+                current[field] += stats[field]
+            for field in ["max_queries", "max_total_time"]:
+                current[field] = max(current[field], stats[field])
+            for field in ["queries_histogram", "latency_histogram"]:
+                current[field] = [a + b for a, b in zip(current[field], stats[field])]
+
+    for stats in merged.values():
+        for field in ["queries", "sql_time", "serializer_time", "total_time"]:
+            stats["avg_" + field] = stats[field] / stats["count"]
+        stats["p50_total_time"] = percentile(stats["latency_histogram"], LATENCY_BUCKETS, 0.5)
+        stats["p95_total_time"] = percentile(stats["latency_histogram"], LATENCY_BUCKETS, 0.95)
+        stats["p95_queries"] = percentile(stats["queries_histogram"], QUERY_BUCKETS, 0.95)
+    return merged
+
+
+def reset_metrics() -> None:
+    """Forget the metrics of every process, other processes forget theirs on next flush."""
+    for key in cache.get(PROCESSES_KEY, {}):
+        cache.delete(key)
+    recorder.reset()
@@ -0,0 +1,64 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from core.metrics import (
+    RequestMetrics,
+    Sample,
+    current_request_metrics,
+    instrument_serializers,
+    recorder,
+)
+
+
+class QueryMetricsMiddleware:
+    """Record queries, SQL time, serialization time and latency of each view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+
+        match = request.resolver_match
+        if match is not None:
+            recorder.add(
+                "%s %s" % (request.method, match.view_name),
+                Sample(
+                    queries=metrics.queries,
+                    sql_time=metrics.sql_time,
+                    serializer_time=metrics.serializer_time,
+                    total_time=(time.perf_counter() - start) * 1000,
+                ),
+            )
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 15:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_auto_20220524_1007"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportPeopleModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("people", models.CharField(default="student", max_length=20)),
+                ("csv_file", models.FileField(upload_to="core/import_people/%Y/%m/%d/")),
+                ("columns", models.TextField(default="[]")),
+                ("ignore_first_line", models.BooleanField(default=False)),
+                ("rows_total", models.PositiveIntegerField(default=0)),
+                ("rows_done", models.PositiveIntegerField(default=0)),
+                ("is_done", models.BooleanField(default=False)),
+                ("datetime_creation", models.DateTimeField(auto_now_add=True)),
+                (
+                    "teaching",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="core.teachingmodel"
+                    ),
+                ),
+            ],
+        ),
+    ]
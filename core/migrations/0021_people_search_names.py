@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2026-10-18 16:10
+
+from unidecode import unidecode
+
+from django.db import migrations, models
+
+
+def normalize_name(name: str) -> str:
+    # Copy of core.models.normalize_name, as it was when this migration was written.
+    return " ".join(unidecode(name).lower().split())
+
+
+def set_search_names(apps, schema_editor):
+    for model_name in ["StudentModel", "ResponsibleModel"]:
+        model = apps.get_model("core", model_name)
+        people = list(model.objects.only("pk", "first_name", "last_name"))
+        for person in people:
+            person.first_name_search = normalize_name(person.first_name)
+            person.last_name_search = normalize_name(person.last_name)
+        model.objects.bulk_update(
+            people, ["first_name_search", "last_name_search"], batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0020_importpeoplemodel"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="responsiblemodel",
+            name="first_name_search",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="responsiblemodel",
+            name="last_name_search",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="studentmodel",
+            name="first_name_search",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name="studentmodel",
+            name="last_name_search",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=200),
+        ),
+        migrations.RunPython(set_search_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 17:36
+
+from django.db import migrations, models
+import django.db.models.functions.datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0021_people_search_names"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="additionalstudentinfo",
+            index=models.Index(
+                django.db.models.functions.datetime.ExtractMonth("birth_date"),
+                django.db.models.functions.datetime.ExtractDay("birth_date"),
+                name="student_birthday_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="responsiblemodel",
+            index=models.Index(
+                django.db.models.functions.datetime.ExtractMonth("birth_date"),
+                django.db.models.functions.datetime.ExtractDay("birth_date"),
+                name="responsible_birthday_idx",
+            ),
+        ),
+    ]
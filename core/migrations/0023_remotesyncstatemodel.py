@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0022_birthday_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemoteSyncStateModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("model", models.CharField(max_length=50, unique=True)),
+                ("digests", models.JSONField(default=dict)),
+                ("datetime_sync", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0023_remotesyncstatemodel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeLogModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("model", models.CharField(max_length=50)),
+                ("object_pk", models.CharField(max_length=50)),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("save", "Enregistrement"), ("delete", "Suppression")],
+                        default="save",
+                        max_length=10,
+                    ),
+                ),
+                ("datetime_creation", models.DateTimeField(auto_now_add=True)),
+                ("is_replayed", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="changelogmodel",
+            index=models.Index(fields=["is_replayed", "id"], name="core_change_is_repl_97c64c_idx"),
+        ),
+    ]
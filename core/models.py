@@ -17,8 +17,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
+from unidecode import unidecode
+
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import ExtractDay, ExtractMonth
 
 from .ldap import get_ldap_connection
 
@@ -112,6 +115,9 @@ class GivenCourseModel(models.Model):
 
     @property
     def classes(self):
+        # Classes are annotated when prefetched (see core.serializers.given_courses_prefetch).
+        if hasattr(self, "classe_names"):
+            return ", ".join(self.classe_names)
         return ", ".join({s.classe.compact_str for s in self.studentmodel_set.distinct("classe")})
 
     @property
@@ -179,7 +185,31 @@ class CourseScheduleModel(models.Model):
         return f"{self.course_name} le {self.day_of_week} à {self.period}"
 
 
-class StudentModel(models.Model):
+def normalize_name(name: str) -> str:
+    """Unaccent and lowercase a name the way it is stored for searches."""
+    return " ".join(unidecode(name).lower().split())
+
+
+class NameSearchModel(models.Model):
+    """Keep normalized names, indexed for prefix searches (see core.people.search_by_name)."""
+
+    first_name_search = models.CharField(max_length=200, default="", editable=False, db_index=True)
+    last_name_search = models.CharField(max_length=200, default="", editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def set_search_names(self) -> None:
+        """Update normalized names.
+
+        It is done on save (fixtures included) but must be called before bulk creations
+        and updates.
+        """
+        self.first_name_search = normalize_name(self.first_name)
+        self.last_name_search = normalize_name(self.last_name)
+
+
+class StudentModel(NameSearchModel):
     first_name = models.CharField(max_length=200)
     last_name = models.CharField(max_length=200)
     matricule = models.PositiveIntegerField(unique=True, primary_key=True)
@@ -261,8 +291,16 @@ class AdditionalStudentInfo(models.Model):
     username = models.CharField(max_length=20, blank=True)
     password = models.CharField(max_length=200, blank=True)
 
+    class Meta:
+        # Birthdays are searched by month and day.
+        indexes = [
+            models.Index(
+                ExtractMonth("birth_date"), ExtractDay("birth_date"), name="student_birthday_idx"
+            )
+        ]
 
-class ResponsibleModel(models.Model):
+
+class ResponsibleModel(NameSearchModel):
     first_name = models.CharField(max_length=200)
     last_name = models.CharField(max_length=200)
     matricule = models.BigIntegerField(null=True, unique=True)
@@ -285,6 +323,15 @@ class ResponsibleModel(models.Model):
     inactive_from = models.DateTimeField(null=True, blank=True, default=None)
     birth_date = models.DateField("birth date", null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                ExtractMonth("birth_date"),
+                ExtractDay("birth_date"),
+                name="responsible_birthday_idx",
+            )
+        ]
+
     def __str__(self):
         """Return the full name with the last name first."""
         return "%s %s" % (self.last_name, self.first_name)
@@ -363,3 +410,65 @@ class MenuEntryModel(models.Model):
 
     def __str__(self) -> str:
         return f"{self.display} ({self.link})"
+
+
+class ImportPeopleModel(models.Model):
+    """A csv file of people, imported by chunks in a celery task.
+
+    Attributes:
+        people The kind of people in the file (student or teacher).
+        columns Json list of the column names, in the file order.
+        rows_done Number of rows already committed, an interrupted import resumes from there.
+    """
+
+    people = models.CharField(max_length=20, default="student")
+    teaching = models.ForeignKey(TeachingModel, on_delete=models.CASCADE)
+    csv_file = models.FileField(upload_to="core/import_people/%Y/%m/%d/")
+    columns = models.TextField(default="[]")
+    ignore_first_line = models.BooleanField(default=False)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_done = models.PositiveIntegerField(default=0)
+    is_done = models.BooleanField(default=False)
+    datetime_creation = models.DateTimeField(auto_now_add=True)
+
+
+class RemoteSyncStateModel(models.Model):
+    """Rows already sent to the remote instance (see core.sync), by synced model.
+
+    Attributes:
+        digests Digest of each row content as last sent, by primary key.
+    """
+
+    model = models.CharField(max_length=50, unique=True)
+    digests = models.JSONField(default=dict)
+    datetime_sync = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.model
+
+
+class ChangeLogModel(models.Model):
+    """Append-only log of the changes of synced models, replayed to the remote instance.
+
+    Replayed entries are removed after core.changelog.REPLAYED_RETENTION_DAYS.
+
+    Attributes:
+        model The synced model name (see core.sync.SYNC_MODELS).
+        is_replayed Whether the change has been sent to the remote instance.
+    """
+
+    SAVE = "save"
+    DELETE = "delete"
+    ACTION_CHOICES = [(SAVE, "Enregistrement"), (DELETE, "Suppression")]
+
+    model = models.CharField(max_length=50)
+    object_pk = models.CharField(max_length=50)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, default=SAVE)
+    datetime_creation = models.DateTimeField(auto_now_add=True)
+    is_replayed = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["is_replayed", "id"])]
+
+    def __str__(self):
+        return "%s %s (%s)" % (self.model, self.object_pk, self.action)
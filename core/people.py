@@ -18,16 +18,26 @@
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
 import itertools
+from collections import namedtuple
 from unidecode import unidecode
 from typing import Union
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.db.models import Q, QuerySet, Model
+from django.db.models import Q, QuerySet, Model, Case, When, Value, IntegerField, Subquery
 from django.db.utils import OperationalError, ProgrammingError
 
-from .models import ResponsibleModel, StudentModel, TeachingModel, ClasseModel, CoreSettingsModel
+from .settings_registry import settings_registry
+from .models import (
+    ResponsibleModel,
+    StudentModel,
+    TeachingModel,
+    ClasseModel,
+    CoreSettingsModel,
+    normalize_name,
+)
 
 # Person type:
 STUDENT = "student"
@@ -37,17 +47,83 @@ RESPONSIBLE = "responsible"
 ALL = "all"
 
 
+def search_by_name(
+    queryset: QuerySet, name: str, field: str = "", ranking_queryset: QuerySet = None
+) -> QuerySet:
+    """Search people by the start of their names in a single query.
+
+    Each match is ranked: a compound last name is better than a first name with a
+    last name, which is better than any word starting a name. Only people having
+    the best rank found in ranking_queryset are kept.
+    :param queryset: The queryset to search in.
+    :param name: Words starting the people's names.
+    :param field: The field leading to the people, empty if queryset holds people.
+    :param ranking_queryset: The queryset giving the best rank, queryset by default.
+    :return: The queryset annotated with each person's name_rank.
+    """
+    tokens = normalize_name(name).split(" ")
+    if not tokens[0]:
+        return queryset.none()
+
+    prefix = f"{field}__" if field else ""
+    first_name, last_name = f"{prefix}first_name_search", f"{prefix}last_name_search"
+
+    any_name = Q()
+    for token in tokens:
+        any_name |= Q(**{f"{first_name}__startswith": token}) | Q(
+            **{f"{last_name}__startswith": token}
+        )
+    ranks = [When(any_name, then=Value(1))]
+    if len(tokens) > 1:
+        ranks = [
+            When(
+                Q(**{f"{last_name}__startswith": " ".join(tokens[:2])})
+                | Q(**{f"{last_name}__startswith": " ".join(tokens[-2:])}),
+                then=Value(3),
+            ),
+            When(
+                Q(**{first_name: tokens[0], f"{last_name}__startswith": tokens[1]})
+                | Q(**{f"{first_name}__startswith": tokens[1], last_name: tokens[0]}),
+                then=Value(2),
+            ),
+        ] + ranks
+    rank = Case(*ranks, default=Value(0), output_field=IntegerField())
+
+    if ranking_queryset is None:
+        ranking_queryset = queryset
+    best_rank = (
+        ranking_queryset.filter(any_name)
+        .annotate(name_rank=rank)
+        .order_by("-name_rank")
+        .values("name_rank")[:1]
+    )
+    return queryset.filter(any_name).annotate(name_rank=rank).filter(name_rank=Subquery(best_rank))
+
+
 def get_all_teachings():
     return list(map(lambda t: t[0], TeachingModel.objects.all().values_list("name")))
 
 
+# Classes a user can access, with its privileged group and responsible (see get_access_scope).
+AccessScope = namedtuple("AccessScope", ["classe_ids", "privileged_group", "responsible_id"])
+
+ACCESS_SCOPE_VERSION_KEY = "core_access_scope_version"
+ACCESS_SCOPE_TIMEOUT = 60 * 5
+
+
 def get_core_settings():
-    settings_model = CoreSettingsModel.objects.first()
-    if not settings_model:
-        # Create default settings.
-        settings_model = CoreSettingsModel()
-        settings_model.save()
-    return settings_model
+    return settings_registry.get(CoreSettingsModel)
+
+
+def invalidate_access_scopes() -> None:
+    """Invalidate every cached access scope.
+
+    It must be called when responsibles, classes, teachings or groups change.
+    """
+    try:
+        cache.incr(ACCESS_SCOPE_VERSION_KEY)
+    except ValueError:
+        cache.set(ACCESS_SCOPE_VERSION_KEY, 1, None)
 
 
 class People:
@@ -181,7 +257,7 @@ class People:
         teaching: list = ("all",),
         active: bool = True,
         additional_filter: dict = {},
-    ) -> (QuerySet, int):
+    ) -> QuerySet:
         """
         Private method where you can get people by their name and specify the
         model object you expect to have.
@@ -189,37 +265,11 @@ class People:
         :param name: String that starts the teachers' name.
         :param active: Filter out inactive people.
         :param teaching: A list of teachers' teachings.
-        :return: A QuerySet of teachers.
+        :return: A QuerySet of teachers, annotated with their name_rank.
         """
-        tokens = name.split(" ")
-        people = model_name.objects.none()
-        quality = 2
-
-        if len(tokens) > 1:
-            # First check compound last name.
-            people = model_name.objects.filter(
-                Q(last_name__unaccent__istartswith=" ".join(tokens[:2]))
-                | Q(last_name__unaccent__istartswith=" ".join(tokens[-2:]))
-            )
-            if len(people) == 0:
-                people = model_name.objects.filter(
-                    Q(
-                        first_name__unaccent__iexact=tokens[0],
-                        last_name__unaccent__istartswith=tokens[1],
-                    )
-                    | Q(
-                        first_name__unaccent__istartswith=tokens[1],
-                        last_name__unaccent__iexact=tokens[0],
-                    )
-                )
-
-        if len(people) == 0:
-            quality = 1
-            for name_part in tokens:
-                people |= model_name.objects.filter(
-                    Q(first_name__unaccent__istartswith=name_part)
-                    | Q(last_name__unaccent__istartswith=name_part)
-                )
+        people = search_by_name(
+            model_name.objects.all(), name, ranking_queryset=model_name.objects.all()
+        ).order_by("last_name", "first_name")
 
         if teaching and "all" not in teaching:
             if type(teaching[0]) == TeachingModel:
@@ -232,7 +282,7 @@ class People:
         if additional_filter:
             people = people.filter(**additional_filter)
 
-        return (people, quality)
+        return people
 
     def get_students_by_name(
         self, name: str, teaching: list = ("all",), classes: list = None, active: bool = True
@@ -247,7 +297,7 @@ class People:
         """
         students = self._get_people_by_name_by_model(
             StudentModel, name=name, teaching=teaching, active=active
-        )[0]
+        )
         if type(classes) == QuerySet:
             students = students.filter(classe__id__in=classes.values_list("id"))
 
@@ -269,7 +319,7 @@ class People:
             teaching=teaching,
             active=active,
             additional_filter={"is_teacher": True},
-        )[0]
+        )
 
     def get_educators_by_name(
         self, name: str, teaching: list = ("all",), active: bool = True
@@ -287,7 +337,7 @@ class People:
             teaching=teaching,
             active=active,
             additional_filter={"is_educator": True},
-        )[0]
+        )
 
     def get_responsibles_by_name(
         self, name: str, teaching: list = ("all",), active: bool = True
@@ -301,7 +351,7 @@ class People:
         """
         return self._get_people_by_name_by_model(
             ResponsibleModel, name=name, teaching=teaching, active=active
-        )[0]
+        )
 
     @staticmethod
     def get_students_by_classe(classe: object, teaching: list = ("all",)) -> QuerySet:
@@ -360,58 +410,129 @@ def get_classes(
     :return: A QuerySet of classes.
     :rtype: QuerySet
     """
-    # First, get teaching models.
+    if check_access and user:
+        scope = get_access_scope(user, teaching, tenure_class_only, educ_by_years)
+        return ClasseModel.objects.filter(id__in=scope.classe_ids)
+
+    return ClasseModel.objects.filter(teaching__in=_get_teaching_models(teaching))
+
+
+def get_access_scope(
+    user: User,
+    teaching: list = ("all",),
+    tenure_class_only: bool = True,
+    educ_by_years: Union[bool, str] = True,
+) -> AccessScope:
+    """Get the classes a user can access (see get_classes) and its privileged group.
+
+    Scopes are kept in the cache until invalidate_access_scopes is called and are memoized on
+    the user object, thus for the current request.
+
+    :param user: The user trying to get the classes.
+    :type user: User
+    :param teaching: A list of students' teachings, defaults to ('all',)
+    :type teaching: list, optional
+    :param tenure_class_only: If a teacher, get classes only by tenure, defaults to True
+    :type tenure_class_only: bool, optional
+    :param educ_by_years: True, False or "both". If true, get classes by year access. Otherwise get it by classes, defaults to True
+    :type educ_by_years: bool or str, optional
+    :return: The access scope of the user.
+    :rtype: AccessScope
+    """
+    if "all" in teaching:
+        teaching_key = "all"
+    else:
+        teaching_key = ",".join(
+            sorted(t.name if isinstance(t, TeachingModel) else str(t) for t in teaching)
+        )
+    version = cache.get_or_set(ACCESS_SCOPE_VERSION_KEY, 1, None)
+    key = "core_access_scope_%s_%s_%s_%s_%s" % (
+        version,
+        user.id,
+        teaching_key,
+        tenure_class_only,
+        educ_by_years,
+    )
+
+    memo = getattr(user, "_access_scopes", None)
+    if memo is None:
+        memo = {}
+        user._access_scopes = memo
+    if key in memo:
+        return memo[key]
+
+    scope = cache.get(key)
+    if scope is None:
+        try:
+            responsible = ResponsibleModel.objects.get(user=user)
+            classes = _get_accessible_classes(
+                responsible, user, teaching, tenure_class_only, educ_by_years
+            )
+            scope = AccessScope(
+                frozenset(classes.values_list("id", flat=True)),
+                get_privileged_group(user),
+                responsible.id,
+            )
+        except ObjectDoesNotExist:
+            # Responsible not found, no classes.
+            scope = AccessScope(frozenset(), get_privileged_group(user), None)
+        cache.set(key, scope, ACCESS_SCOPE_TIMEOUT)
+    memo[key] = scope
+    return scope
+
+
+def _get_teaching_models(teaching: list):
     if "all" not in teaching:
         if len(teaching) > 0 and type(teaching[0]) == TeachingModel:
-            teaching_models = teaching
+            return teaching
         else:
-            teaching_models = TeachingModel.objects.filter(name__in=teaching)
+            return TeachingModel.objects.filter(name__in=teaching)
     else:
-        teaching_models = TeachingModel.objects.all()
+        return TeachingModel.objects.all()
 
-    if check_access and user:
-        try:
-            responsible = ResponsibleModel.objects.get(user=user)
-            teaching_models = list(teaching_models.intersection(responsible.teaching.all()))
-        except ObjectDoesNotExist:
-            # Responsible not found return no classes.
-            return ClasseModel.objects.none()
-        # Sysadmins, direction members, pms have all access.
-        if user.groups.filter(
-            name__in=[settings.SYSADMIN_GROUP, settings.DIRECTION_GROUP, settings.PMS_GROUP]
-        ).exists():
-            return get_classes(teaching_models)
-
-        # Coordonators have by years access.
-        if user.groups.filter(name__istartswith=settings.COORD_GROUP).exists():
-            years = _get_years_by_group(user)
-            return get_classes(teaching_models).filter(year__in=years)
 
-        # Educators have by years or by classes access.
-        if user.groups.filter(name__istartswith=settings.EDUC_GROUP).exists():
-            classes = ClasseModel.objects.none()
-            if educ_by_years:
-                years = _get_years_by_group(user)
-                classes |= get_classes(teaching_models).filter(year__in=years)
-                if educ_by_years == "both":
-                    classes = classes.union(
-                        responsible.classe.all().filter(teaching__in=teaching_models)
-                    )
-            else:
-                classes = responsible.classe.all().filter(teaching__in=teaching_models)
-            return classes
+def _get_accessible_classes(
+    responsible: ResponsibleModel,
+    user: User,
+    teaching: list,
+    tenure_class_only: bool,
+    educ_by_years: Union[bool, str],
+) -> QuerySet:
+    teaching_models = list(_get_teaching_models(teaching).intersection(responsible.teaching.all()))
+    # Sysadmins, direction members, pms have all access.
+    if user.groups.filter(
+        name__in=[settings.SYSADMIN_GROUP, settings.DIRECTION_GROUP, settings.PMS_GROUP]
+    ).exists():
+        return get_classes(teaching_models)
 
-        # It should be a teacher.
-        if tenure_class_only:
-            return responsible.tenure.all().filter(teaching__in=teaching_models)
+    # Coordonators have by years access.
+    if user.groups.filter(name__istartswith=settings.COORD_GROUP).exists():
+        years = _get_years_by_group(user)
+        return get_classes(teaching_models).filter(year__in=years)
+
+    # Educators have by years or by classes access.
+    if user.groups.filter(name__istartswith=settings.EDUC_GROUP).exists():
+        classes = ClasseModel.objects.none()
+        if educ_by_years:
+            years = _get_years_by_group(user)
+            classes |= get_classes(teaching_models).filter(year__in=years)
+            if educ_by_years == "both":
+                classes = classes.union(
+                    responsible.classe.all().filter(teaching__in=teaching_models)
+                )
         else:
-            return (
-                responsible.classe.all()
-                .filter(teaching__in=teaching_models)
-                .union(responsible.tenure.all().filter(teaching__in=teaching_models))
-            )
+            classes = responsible.classe.all().filter(teaching__in=teaching_models)
+        return classes
+
+    # It should be a teacher.
+    if tenure_class_only:
+        return responsible.tenure.all().filter(teaching__in=teaching_models)
     else:
-        return ClasseModel.objects.filter(teaching__in=teaching_models)
+        return (
+            responsible.classe.all()
+            .filter(teaching__in=teaching_models)
+            .union(responsible.tenure.all().filter(teaching__in=teaching_models))
+        )
 
 
 def get_years(
@@ -462,7 +583,9 @@ def check_access_to_student(
     if not user or user.is_anonymous:
         return False
 
-    privileged_group = get_privileged_group(user)
+    privileged_group = get_access_scope(
+        user, tenure_class_only=tenure_class_only, educ_by_years=educ_by_years
+    ).privileged_group
 
     # Sysadmins, direction members, pms have all access.
     if privileged_group in [settings.SYSADMIN_GROUP, settings.DIRECTION_GROUP, settings.PMS_GROUP]:
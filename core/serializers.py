@@ -20,10 +20,60 @@
 from rest_framework import serializers
 
 from django.contrib.auth.models import User, Group
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import CharField, OuterRef, Prefetch, QuerySet
+from django.db.models.functions import Cast, Concat, Upper
 
 from core.models import *
 
 
+class EagerLoadingMixin:
+    """Declare the relations a serializer reads so they are loaded with the queryset.
+
+    Views call setup_eager_loading on their queryset instead of letting each
+    serialized object query its relations.
+    """
+
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def get_prefetches(cls, prefix: str = "") -> list:
+        return [prefix + lookup for lookup in cls.prefetch_related_fields]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset: QuerySet, prefix: str = "") -> QuerySet:
+        """Add the serializer's relations to a queryset.
+
+        :param queryset: The queryset of serialized objects or of objects linked to them.
+        :param prefix: The lookup to the serialized objects, like "student__".
+        """
+        return queryset.select_related(
+            *[prefix + field for field in cls.select_related_fields]
+        ).prefetch_related(*cls.get_prefetches(prefix))
+
+
+def given_courses_prefetch(lookup: str) -> Prefetch:
+    """Prefetch given courses with what GivenCourseSerializer reads, classes included."""
+    classe_names = (
+        StudentModel.objects.filter(courses=OuterRef("pk"), classe__isnull=False)
+        .annotate(
+            classe_name=Concat(
+                Cast("classe__year", CharField()), Upper("classe__letter"), output_field=CharField()
+            )
+        )
+        .values("classe_name")
+        .distinct()
+        .order_by("classe_name")
+    )
+    return Prefetch(
+        lookup,
+        queryset=GivenCourseModel.objects.select_related("course")
+        .prefetch_related("responsiblemodel_set")
+        .annotate(classe_names=ArraySubquery(classe_names)),
+    )
+
+
 class CourseSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(label="ID", read_only=False)
 
@@ -47,7 +97,10 @@ class GivenCourseFlatSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class ResponsibleSensitiveSerializer(serializers.ModelSerializer):
+class ResponsibleSensitiveSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ("user",)
+    prefetch_related_fields = ("teaching", "user__groups", "user__user_permissions")
+
     class Meta:
         model = ResponsibleModel
         fields = (
@@ -64,9 +117,11 @@ class ResponsibleSensitiveSerializer(serializers.ModelSerializer):
         depth = 1
 
 
-class ResponsibleSerializer(serializers.ModelSerializer):
+class ResponsibleSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     courses = GivenCourseSerializer(read_only=True, many=True)
 
+    prefetch_related_fields = ("teaching", "classe__teaching", "tenure__teaching")
+
     class Meta:
         model = ResponsibleModel
         fields = (
@@ -84,6 +139,31 @@ class ResponsibleSerializer(serializers.ModelSerializer):
         )
         depth = 2
 
+    @classmethod
+    def get_prefetches(cls, prefix: str = "") -> list:
+        return super().get_prefetches(prefix) + [given_courses_prefetch(prefix + "courses")]
+
+
+class ResponsibleLightSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    """Responsible without nested relations."""
+
+    class Meta:
+        model = ResponsibleModel
+        fields = (
+            "pk",
+            "matricule",
+            "last_name",
+            "first_name",
+            "is_teacher",
+            "is_educator",
+            "is_secretary",
+            "email_school",
+            "teaching",
+            "display",
+        )
+
+    prefetch_related_fields = ("teaching",)
+
 
 class ResponsibleRemoteSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(label="ID", read_only=False)
@@ -107,10 +187,13 @@ class ResponsibleRemoteSerializer(serializers.ModelSerializer):
         )
 
 
-class StudentSerializer(serializers.ModelSerializer):
+class StudentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     courses = GivenCourseSerializer(read_only=True, many=True)
     group = serializers.CharField(source="additionalstudentinfo.group")
 
+    select_related_fields = ("classe__teaching", "teaching", "user", "additionalstudentinfo")
+    prefetch_related_fields = ("user__groups__permissions", "user__user_permissions")
+
     class Meta:
         model = StudentModel
         fields = (
@@ -134,6 +217,34 @@ class StudentSerializer(serializers.ModelSerializer):
         if no_course:
             self.fields.pop("courses")
 
+    @classmethod
+    def setup_eager_loading(
+        cls, queryset: QuerySet, prefix: str = "", no_course: bool = True
+    ) -> QuerySet:
+        queryset = super().setup_eager_loading(queryset, prefix)
+        if no_course:
+            return queryset
+        return queryset.prefetch_related(given_courses_prefetch(prefix + "courses"))
+
+
+class StudentLightSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    """Student without nested relations, the classe is given by its name."""
+
+    classe = serializers.CharField(source="classe.compact_str", default=None)
+
+    class Meta:
+        model = StudentModel
+        fields = (
+            "matricule",
+            "first_name",
+            "last_name",
+            "display",
+            "classe",
+            "teaching",
+        )
+
+    select_related_fields = ("classe__teaching",)
+
 
 class StudentWriteSerializer(serializers.ModelSerializer):
     class Meta:
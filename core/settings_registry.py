@@ -0,0 +1,163 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer, InMemoryChannelLayer
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+# Channel layer group every process listens to for settings invalidations.
+INVALIDATION_GROUP = "core_settings_invalidation"
+# Settings are reloaded after this delay even if an invalidation is missed.
+SETTINGS_TIMEOUT = 60 * 5
+
+
+class SettingsRegistry:
+    """Load each settings model once per process.
+
+    Settings are kept in memory with their many to many relations prefetched.
+    Saving a settings model or changing one of its relations drops it locally
+    and broadcasts the invalidation to the other processes (daphne and celery
+    workers) through the channel layer.
+    """
+
+    def __init__(self) -> None:
+        self._models = {}
+        self._throughs = {}
+        self._settings = {}
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def autodiscover(self) -> None:
+        """Register every installed settings model, named *SettingsModel by convention."""
+        for model in apps.get_models():
+            if model.__name__.endswith("SettingsModel"):
+                self.register(model)
+
+    def register(self, settings_model) -> None:
+        label = settings_model._meta.label_lower
+        if label in self._models:
+            return
+        self._models[label] = settings_model
+
+        uid = "settings_registry_%s" % label
+        post_save.connect(self._changed, sender=settings_model, dispatch_uid=uid)
+        post_delete.connect(self._changed, sender=settings_model, dispatch_uid=uid)
+        for field in settings_model._meta.many_to_many:
+            self._throughs[field.remote_field.through] = settings_model
+            m2m_changed.connect(
+                self._changed,
+                sender=field.remote_field.through,
+                dispatch_uid="%s_%s" % (uid, field.name),
+            )
+
+    def get(self, settings_model, create_default=None) -> Model:
+        """Get the settings of a model, creating them if they don't exist yet.
+
+        :param settings_model: The settings model class.
+        :param create_default: A callable creating the default settings, by default
+            the model is created with its default values.
+        """
+        self.register(settings_model)
+        self._start_listener()
+
+        label = settings_model._meta.label_lower
+        cached = self._settings.get(label)
+        if cached and time.monotonic() - cached[1] < SETTINGS_TIMEOUT:
+            return cached[0]
+
+        with self._lock:
+            settings_obj = self._load(settings_model)
+            if not settings_obj:
+                # Create default settings.
+                if create_default:
+                    create_default()
+                else:
+                    settings_model.objects.create()
+                settings_obj = self._load(settings_model)
+            self._settings[label] = (settings_obj, time.monotonic())
+        return settings_obj
+
+    def invalidate(self, settings_model, broadcast: bool = True) -> None:
+        label = settings_model._meta.label_lower
+        self._settings.pop(label, None)
+        if broadcast:
+            # Other processes must not reload the settings before they are committed.
+            transaction.on_commit(lambda: self._broadcast(label))
+
+    def clear(self) -> None:
+        self._settings.clear()
+
+    def _load(self, settings_model) -> Model:
+        m2m_fields = [f.name for f in settings_model._meta.many_to_many]
+        return settings_model.objects.prefetch_related(*m2m_fields).order_by("pk").first()
+
+    def _changed(self, sender, **kwargs) -> None:
+        if not kwargs.get("action", "post").startswith("post"):
+            return
+        # For m2m_changed, the sender is the through model.
+        self.invalidate(self._throughs.get(sender, sender))
+
+    def _broadcast(self, label: str) -> None:
+        self._settings.pop(label, None)
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            return
+        async_to_sync(channel_layer.group_send)(
+            INVALIDATION_GROUP, {"type": "core.settings.invalidate", "label": label}
+        )
+
+    def _start_listener(self) -> None:
+        # Listen once per process, a forked (celery) worker starts its own listener.
+        if self._listener_pid == os.getpid():
+            return
+        self._listener_pid = os.getpid()
+
+        channel_layer = get_channel_layer()
+        if not channel_layer or isinstance(channel_layer, InMemoryChannelLayer):
+            # Nothing to listen to outside of the current process.
+            return
+        threading.Thread(target=self._listen, args=(channel_layer,), daemon=True).start()
+
+    def _listen(self, channel_layer) -> None:
+        async def listen():
+            channel_name = await channel_layer.new_channel()
+            while True:
+                # Adding the channel again keeps the group membership from expiring.
+                await channel_layer.group_add(INVALIDATION_GROUP, channel_name)
+                try:
+                    message = await asyncio.wait_for(
+                        channel_layer.receive(channel_name), SETTINGS_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    continue
+                self._settings.pop(message.get("label"), None)
+
+        asyncio.run(listen())
+
+
+settings_registry = SettingsRegistry()
@@ -0,0 +1,48 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver, Signal
+
+from .models import ResponsibleModel, StudentModel, ClasseModel, TeachingModel
+from .people import invalidate_access_scopes
+
+# Sent after people have been imported or changed in bulk, without model signals.
+people_bulk_changed = Signal()
+
+
+@receiver([post_save, post_delete], sender=ResponsibleModel)
+@receiver([post_save, post_delete], sender=ClasseModel)
+@receiver([post_save, post_delete], sender=TeachingModel)
+@receiver([post_save, post_delete], sender=Group)
+@receiver(m2m_changed, sender=ResponsibleModel.teaching.through)
+@receiver(m2m_changed, sender=ResponsibleModel.classe.through)
+@receiver(m2m_changed, sender=ResponsibleModel.tenure.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(people_bulk_changed)
+def access_scope_changed(sender, **kwargs):
+    if kwargs.get("action", "post").startswith("post"):
+        invalidate_access_scopes()
+
+
+@receiver(pre_save, sender=StudentModel)
+@receiver(pre_save, sender=ResponsibleModel)
+def set_search_names(sender, instance, **kwargs):
+    instance.set_search_names()
@@ -0,0 +1,358 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import json
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.contrib.auth.models import Group, User
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.signals import people_bulk_changed
+from core.models import (
+    ClasseModel,
+    CourseModel,
+    GivenCourseModel,
+    NameSearchModel,
+    RemoteSyncStateModel,
+    ResponsibleModel,
+    StudentModel,
+    TeachingModel,
+)
+
+# Number of rows sent by request.
+CHUNK_SIZE = 1000
+# Number of requests sent at the same time.
+WORKERS = 4
+BULK_SYNC_URL = "core/api/bulk_sync/%s/"
+
+# is_enabled, if given, tells whether the model is currently synced.
+SyncModel = namedtuple("SyncModel", ["model", "fields", "is_enabled"], defaults=[None])
+
+# Synced models, in dependency order, with the synced fields (the same as the former
+# per-object API's serializers). Other apps add theirs with register_sync_model.
+SYNC_MODELS = OrderedDict(
+    [
+        ("teaching", SyncModel(TeachingModel, ["id", "name", "display_name"])),
+        ("classe", SyncModel(ClasseModel, ["id", "year", "letter", "teaching"])),
+        ("group", SyncModel(Group, ["id", "name"])),
+        ("user", SyncModel(User, ["id", "username", "last_name", "first_name", "email", "groups"])),
+        ("course", SyncModel(CourseModel, ["id", "short_name", "long_name", "teaching"])),
+        ("given_course", SyncModel(GivenCourseModel, ["id", "course", "group"])),
+        (
+            "responsible",
+            SyncModel(
+                ResponsibleModel,
+                [
+                    "id",
+                    "matricule",
+                    "last_name",
+                    "first_name",
+                    "is_teacher",
+                    "is_educator",
+                    "is_secretary",
+                    "teaching",
+                    "classe",
+                    "tenure",
+                    "email_school",
+                    "courses",
+                    "user",
+                ],
+            ),
+        ),
+        (
+            "student",
+            SyncModel(
+                StudentModel,
+                [
+                    "matricule",
+                    "first_name",
+                    "last_name",
+                    "classe",
+                    "teaching",
+                    "inactive_from",
+                    "courses",
+                ],
+            ),
+        ),
+    ]
+)
+
+
+class SyncError(Exception):
+    pass
+
+
+def register_sync_model(name: str, model, fields: list, is_enabled=None) -> None:
+    """Sync the rows of an app's model, after the core models."""
+    from core.changelog import watch_model
+
+    SYNC_MODELS[name] = SyncModel(model, fields, is_enabled)
+    watch_model(model)
+
+
+def get_sync_name(model) -> str:
+    """The name of a synced model, None if it is not synced (or currently disabled)."""
+    for name, sync_model in SYNC_MODELS.items():
+        if sync_model.model == model:
+            if sync_model.is_enabled and not sync_model.is_enabled():
+                return None
+            return name
+    return None
+
+
+def get_enabled_models() -> list:
+    return [n for n, m in SYNC_MODELS.items() if not m.is_enabled or m.is_enabled()]
+
+
+def _split_fields(sync_model: SyncModel) -> tuple:
+    """Concrete fields (by attname) and many to many fields of a synced model."""
+    meta = sync_model.model._meta
+    concrete = [meta.get_field(f).attname for f in sync_model.fields if not _is_m2m(meta, f)]
+    m2m = [f for f in sync_model.fields if _is_m2m(meta, f)]
+    return concrete, m2m
+
+
+def _is_m2m(meta, field: str) -> bool:
+    return meta.get_field(field).many_to_many
+
+
+def _digest(row: dict) -> str:
+    return hashlib.sha1(json.dumps(row, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def export_rows(name: str, digests: dict = None, pks: list = None) -> list:
+    """Rows of a synced model that changed since the given digests (by primary key).
+
+    Rows are plain dicts of concrete fields (foreign keys by attname) and many to many primary
+    keys, every row is read with one query by model and one by many to many field.
+
+    :param pks: Only export these rows, if given.
+    """
+    sync_model = SYNC_MODELS[name]
+    model = sync_model.model
+    concrete, m2m = _split_fields(sync_model)
+    pk = model._meta.pk.attname
+
+    queryset = model.objects.order_by(pk)
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    rows = OrderedDict((row[pk], row) for row in queryset.values(*concrete).iterator())
+    for field in m2m:
+        for row in rows.values():
+            row[field] = []
+        through = model._meta.get_field(field).remote_field.through
+        source = model._meta.get_field(field).m2m_column_name()
+        target = model._meta.get_field(field).m2m_reverse_name()
+        links = through.objects.order_by(target)
+        if pks is not None:
+            links = links.filter(**{"%s__in" % source: pks})
+        for source_id, target_id in links.values_list(source, target):
+            if source_id in rows:
+                rows[source_id][field].append(target_id)
+
+    digests = digests or {}
+    changed = []
+    for key, row in rows.items():
+        row_digest = _digest(row)
+        if digests.get(str(key)) != row_digest:
+            changed.append((row, row_digest))
+    return changed
+
+
+def chunk_rows(rows: list, chunk_size: int = CHUNK_SIZE):
+    for i in range(0, len(rows), chunk_size):
+        yield rows[i : i + chunk_size]
+
+
+def encode_rows(rows: list, deleted: list = ()) -> bytes:
+    """Compress rows (and primary keys of deleted rows) to be sent."""
+    return gzip.compress(
+        json.dumps({"rows": rows, "deleted": list(deleted)}, cls=DjangoJSONEncoder).encode()
+    )
+
+
+def decode_payload(body: bytes, encoding: str = "") -> dict:
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    payload = json.loads(body)
+    payload.setdefault("deleted", [])
+    return payload
+
+
+def decode_rows(body: bytes, encoding: str = "") -> list:
+    return decode_payload(body, encoding)["rows"]
+
+
+def import_rows(name: str, rows: list) -> int:
+    """Create or update rows of a synced model with bulk queries.
+
+    :return: The number of imported rows.
+    """
+    if name not in SYNC_MODELS:
+        raise SyncError("Unknown model: %s" % name)
+    if not rows:
+        return 0
+    sync_model = SYNC_MODELS[name]
+    model = sync_model.model
+    concrete, m2m = _split_fields(sync_model)
+    pk = model._meta.pk
+
+    objects = []
+    for row in rows:
+        missing = set(concrete + m2m) - set(row)
+        if missing:
+            raise SyncError("Missing fields: %s" % ", ".join(sorted(missing)))
+        obj = model(**{f: row[f] for f in concrete})
+        if isinstance(obj, NameSearchModel):
+            obj.set_search_names()
+        objects.append(obj)
+
+    update_fields = [model._meta.get_field(f).name for f in sync_model.fields if f not in m2m]
+    update_fields.remove(pk.name)
+    if issubclass(model, NameSearchModel):
+        update_fields += ["first_name_search", "last_name_search"]
+
+    with transaction.atomic():
+        model.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=[pk.name],
+            update_fields=update_fields,
+        )
+        pks = [obj.pk for obj in objects]
+        for field in m2m:
+            through = model._meta.get_field(field).remote_field.through
+            source = model._meta.get_field(field).m2m_column_name()
+            target = model._meta.get_field(field).m2m_reverse_name()
+            through.objects.filter(**{"%s__in" % source: pks}).delete()
+            through.objects.bulk_create(
+                [
+                    through(**{source: row[pk.attname], target: target_id})
+                    for row in rows
+                    for target_id in row[field]
+                ]
+            )
+        # Primary keys come from the other instance, sequences must follow.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+    people_bulk_changed.send(sender=model)
+    return len(objects)
+
+
+def delete_rows(name: str, pks: list) -> int:
+    """Delete rows of a synced model.
+
+    :return: The number of deleted rows.
+    """
+    if name not in SYNC_MODELS:
+        raise SyncError("Unknown model: %s" % name)
+    model = SYNC_MODELS[name].model
+    if not pks:
+        return 0
+    deleted, _ = model.objects.filter(pk__in=pks).delete()
+    people_bulk_changed.send(sender=model)
+    return deleted
+
+
+def get_session(remote_token: str, workers: int = WORKERS) -> requests.Session:
+    """A session keeping its connections to the remote instance."""
+    session = requests.Session()
+    session.headers["Authorization"] = "Token %s" % remote_token
+    session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+    session.mount("http://", HTTPAdapter(pool_maxsize=workers))
+    return session
+
+
+def push_model(
+    session: requests.Session,
+    remote_url: str,
+    name: str,
+    full: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = WORKERS,
+    pks: list = None,
+) -> tuple:
+    """Send the changed rows of a synced model to the remote instance, by chunks.
+
+    Digests of the rows are stored once their chunk is imported, an interrupted sync only sends
+    the remaining rows again.
+
+    :param pks: Only send these rows, the ones that do not exist anymore are deleted remotely.
+    :return: The number of sent rows and the errors of the failed chunks.
+    """
+    state, _ = RemoteSyncStateModel.objects.get_or_create(model=name)
+    pk_field = SYNC_MODELS[name].model._meta.pk
+    pk = pk_field.attname
+    if pks is not None:
+        pks = {pk_field.to_python(p) for p in pks}
+    changed = export_rows(name, None if full else state.digests, pks)
+    url = remote_url + BULK_SYNC_URL % name
+
+    deleted = []
+    if pks is not None:
+        existing = SYNC_MODELS[name].model.objects.filter(pk__in=pks).values_list("pk", flat=True)
+        deleted = sorted(pks - set(existing))
+
+    def post(chunk, deleted=()):
+        try:
+            response = session.post(
+                url,
+                data=encode_rows([row for row, _ in chunk], deleted),
+                headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+                timeout=120,
+            )
+        except requests.RequestException as err:
+            return chunk, str(err)
+        if response.status_code != 200:
+            return chunk, "%i: %s" % (response.status_code, response.text[:500])
+        return chunk, None
+
+    sent = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # A single worker sends from the current thread.
+        results = (executor.map if workers > 1 else map)(post, chunk_rows(changed, chunk_size))
+        for chunk, error in results:
+            if error:
+                errors.append(error)
+                continue
+            sent += len(chunk)
+            state.digests.update({str(row[pk]): digest for row, digest in chunk})
+
+    if deleted:
+        _, error = post([], deleted)
+        if error:
+            errors.append(error)
+        else:
+            for key in deleted:
+                state.digests.pop(str(key), None)
+
+    state.datetime_sync = timezone.now()
+    state.save()
+    return sent, errors
@@ -18,8 +18,9 @@
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
 import time
-import io
+import csv
 import json
+import itertools
 import subprocess
 
 from celery import shared_task
@@ -27,10 +28,19 @@ from celery import shared_task
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
 
-from core.adminsettings.importclass import ImportStudentCSV, ImportResponsibleCSV
-from core.models import TeachingModel
+from core.calendars import refresh_calendars
+from core.changelog import REPLAY_SCHEDULED_KEY, replay_changes
+from core.sync import SyncError
+from core.widgets import precompute_widgets
+from core.adminsettings.importclass import ImportBase, ImportStudentCSV, ImportResponsibleCSV
+from core.models import TeachingModel, ImportPeopleModel
+
+# Number of rows committed at once when importing a file.
+IMPORT_CHUNK_SIZE = 500
 
 
 class WSImportStudentCSV(ImportStudentCSV):
@@ -69,30 +79,98 @@ class WSImportTeacherCSV(ImportResponsibleCSV):
         )
 
 
-@shared_task(bind=True)
-def task_import_people(self, csv_file, teaching, columns, ignore_first_line, people="student"):
-    io_text = io.StringIO(csv_file)
-    channel_layer = get_channel_layer()
-    time.sleep(2)
-    try:
-        teaching_model = TeachingModel.objects.get(id=int(teaching))
-    except ObjectDoesNotExist:
-        async_to_sync(channel_layer.group_send)(
-            "core_import_%s_state_%s" % (people, self.request.id),
-            {
-                "type": "core.import.state",
-                "task": self.request.id,
-                "status": "Teaching model does not exist!",
-            },
-        )
+def _read_csv(import_people: ImportPeopleModel) -> tuple:
+    text = open(import_people.csv_file.path, newline="", encoding="utf-8-sig")
+    dialect = csv.Sniffer().sniff(text.readline())
+    text.seek(0)
+    reader = csv.reader(text, dialect)
+    if import_people.ignore_first_line:
+        next(reader, None)
+    return text, reader
+
+
+def _chunk_rows(rows, importation: ImportBase, chunk_size: int):
+    """Group rows by chunks, rows of a same person are kept in the same chunk."""
+    chunk = []
+    for row in rows:
+        if len(chunk) >= chunk_size and importation.get_value(
+            row, "matricule"
+        ) != importation.get_value(chunk[-1], "matricule"):
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def import_people_file(
+    importation: ImportBase, import_people: ImportPeopleModel, chunk_size: int = IMPORT_CHUNK_SIZE
+) -> None:
+    """Import a stored csv file chunk by chunk, each chunk in its own transaction.
+
+    Rows already committed by a previous run are skipped, people missing from the whole file
+    are set inactive once every chunk is imported.
+    """
+    importation.bulk_sync = True
+    importation.defer_inactives = True
+
+    if not import_people.rows_total:
+        text, reader = _read_csv(import_people)
+        with text:
+            import_people.rows_total = sum(1 for _ in reader)
+        import_people.save(update_fields=["rows_total"])
+
+    rows_start = import_people.rows_done
+    start = time.perf_counter()
+    text, reader = _read_csv(import_people)
+    with text:
+        rows = itertools.islice(reader, import_people.rows_done, None)
+        for chunk in _chunk_rows(rows, importation, chunk_size):
+            with transaction.atomic():
+                importation._sync(chunk)
+                ImportPeopleModel.objects.filter(id=import_people.id).update(
+                    rows_done=F("rows_done") + len(chunk)
+                )
+            import_people.rows_done += len(chunk)
+
+            rate = (import_people.rows_done - rows_start) / (time.perf_counter() - start)
+            eta = (import_people.rows_total - import_people.rows_done) / rate
+            importation.print_log(
+                "%i/%i rows imported (%.0f rows/s, ETA %is)"
+                % (import_people.rows_done, import_people.rows_total, rate, eta)
+            )
+
+    text, reader = _read_csv(import_people)
+    with text:
+        matricules = set()
+        for row in reader:
+            matricule = importation.get_value(row, "matricule")
+            if matricule:
+                matricules.add(int(matricule))
+    importation.bulk_set_inactives(matricules)
+
+    # The file holds personal data, it is not kept once imported.
+    import_people.csv_file.delete(save=False)
+    import_people.is_done = True
+    import_people.save(update_fields=["is_done", "csv_file"])
+    importation.print_log("Import done.")
+
+
+@shared_task(bind=True, acks_late=True)
+def task_import_people_file(self, import_people_id):
+    """Import a stored csv file, a redelivered task resumes from the last committed chunk."""
+    import_people = ImportPeopleModel.objects.get(id=import_people_id)
+    if import_people.is_done:
         return
-    column_index = {i: c for c, i in enumerate(json.loads(columns))}
-    import_csv = (
-        WSImportStudentCSV(teaching_model, self.request.id, column_index)
-        if people == "student"
-        else WSImportTeacherCSV(teaching_model, self.request.id, column_index)
+    column_index = {i: c for c, i in enumerate(json.loads(import_people.columns))}
+    importation = (
+        WSImportStudentCSV(import_people.teaching, self.request.id, column_index)
+        if import_people.people == "student"
+        else WSImportTeacherCSV(import_people.teaching, self.request.id, column_index)
     )
-    import_csv.sync(io_text, ignore_first_line=ignore_first_line, has_header=False)
+    # Let the client subscribe to the logs before the first ones are sent.
+    time.sleep(2)
+    import_people_file(importation, import_people)
 
 
 @shared_task(bind=True)
@@ -119,3 +197,25 @@ def task_update(self):
             "status": "\nMise à jour terminé",
         },
     )
+
+
+@shared_task
+def task_refresh_calendars():
+    """Refresh the stored events of the imported calendars."""
+    refresh_calendars()
+
+
+@shared_task
+def task_precompute_widgets():
+    """Compute today's dashboard widgets."""
+    precompute_widgets()
+
+
+@shared_task(bind=True, max_retries=10)
+def task_replay_changes(self):
+    """Send the logged changes to the remote instance, retrying with an increasing delay."""
+    cache.delete(REPLAY_SCHEDULED_KEY)
+    try:
+        replay_changes()
+    except SyncError as err:
+        raise self.retry(exc=err, countdown=min(30 * 2**self.request.retries, 60 * 60))
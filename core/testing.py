@@ -0,0 +1,55 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Fail a test case when an endpoint exceeds its queries budget.
+
+    query_budgets maps urls to their maximum number of queries.
+    """
+
+    query_budgets = {}
+
+    def assertQueryBudget(self, url: str, budget: int = None, method: str = "get", **kwargs):
+        if budget is None:
+            budget = self.query_budgets[url]
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, url)
+        queries = len(context.captured_queries)
+        self.assertLessEqual(
+            queries,
+            budget,
+            "%s made %i queries for a budget of %i:\n%s"
+            % (
+                url,
+                queries,
+                budget,
+                "\n".join(q["sql"] for q in context.captured_queries),
+            ),
+        )
+        return response
+
+    def test_query_budgets(self):
+        for url in self.query_budgets:
+            with self.subTest(url=url):
+                self.assertQueryBudget(url)
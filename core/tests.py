@@ -17,19 +17,78 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.test import TestCase
+import datetime
+import io
+import json
+import sys
+import tempfile
+from collections import namedtuple
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
+from rest_framework.test import APIClient
 from .people import (
     People,
     STUDENT,
     get_years,
     get_classes,
+    get_access_scope,
+    get_core_settings,
+    search_by_name,
     get_all_teachings,
     check_access_to_student,
     get_students_from_teacher,
 )
 
-from .models import TeachingModel, StudentModel, ClasseModel, ResponsibleModel, CoreSettingsModel
+from .models import (
+    TeachingModel,
+    StudentModel,
+    ClasseModel,
+    ResponsibleModel,
+    CoreSettingsModel,
+    CourseModel,
+    ImportPeopleModel,
+    ImportCalendarModel,
+    AdditionalStudentInfo,
+    ChangeLogModel,
+    normalize_name,
+)
+from .serializers import (
+    StudentSerializer,
+    StudentLightSerializer,
+    ResponsibleSerializer,
+    ResponsibleSensitiveSerializer,
+    ResponsibleLightSerializer,
+)
+from .sync import (
+    SYNC_MODELS,
+    SyncError,
+    decode_payload,
+    encode_rows,
+    export_rows,
+    import_rows,
+    push_model,
+)
+from .changelog import REPLAYED_RETENTION_DAYS, replay_changes
+from .management.commands.syncabsences import PROECO_USERNAME
+from .utilities import get_scholar_year
+from .calendars import REFRESH_INTERVAL, STORE_KEY, get_events, refresh_calendars
+from .metrics import get_metrics, reset_metrics
+from .tasks import import_people_file
+from .testing import QueryBudgetMixin
+from .widgets import compute_scholar_calendar
+from .settings_registry import settings_registry, INVALIDATION_GROUP
+from .adminsettings.importclass import ImportStudentCSV, ImportResponsibleCSV
 
 
 class GetAllTeachingTest(TestCase):
@@ -121,40 +180,54 @@ class PeopleTest(TestCase):
 
     def test_get_people_by_name_by_model(self):
         result = People()._get_people_by_name_by_model(StudentModel, "Adelai")
-        self.assertGreater(len(result[0]), 0)
+        self.assertGreater(len(result), 0)
 
-        self.assertEqual(type(result[0][0]), StudentModel)
+        self.assertEqual(type(result[0]), StudentModel)
         result = People()._get_people_by_name_by_model(
             StudentModel, "Adelai", teaching=["secondaire"]
         )
-        self.assertEqual(len(result[0]), 2)
+        self.assertEqual(len(result), 2)
 
         result = People()._get_people_by_name_by_model(
             StudentModel, "Barre Adelai", teaching=["secondaire"]
         )
-        self.assertEqual(len(result[0]), 1)
-        self.assertEqual(type(result[0][0]), StudentModel)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(type(result[0]), StudentModel)
 
         teaching_secondaire = TeachingModel.objects.filter(name="secondaire")
         result = People()._get_people_by_name_by_model(
             StudentModel, "Barre Adelai", teaching=teaching_secondaire
         )
-        self.assertEqual(len(result[0]), 1)
+        self.assertEqual(len(result), 1)
 
     def test_get_people_by_name(self):
         result = People().get_people_by_name(name="jacquel")
-        self.assertEqual(len(result["student"][0]) + len(result["responsible"][0]), 6)
+        self.assertEqual(len(result["student"]) + len(result["responsible"]), 6)
 
         result = People().get_people_by_name(name="jacquel", person_type=STUDENT)
         self.assertEqual(len(result), 5)
 
         result = People().get_people_by_name(name="jacqueline d")
-        self.assertEqual(len(result["student"][0]) + len(result["responsible"][0]), 2)
+        self.assertEqual(len(result["student"]) + len(result["responsible"]), 2)
 
         result = People().get_people_by_name(name="jacquel", teaching=["all"])
-        self.assertEqual(len(result["student"][0]) + len(result["responsible"][0]), 6)
+        self.assertEqual(len(result["student"]) + len(result["responsible"]), 6)
         result = People().get_people_by_name(name="jacquel", teaching=["primaire"])
-        self.assertEqual(len(result["student"][0]) + len(result["responsible"][0]), 1)
+        self.assertEqual(len(result["student"]) + len(result["responsible"]), 1)
+
+    def test_search_by_name(self):
+        self.assertEqual(normalize_name(" Adelaï  Barré"), "adelai barre")
+        with self.assertNumQueries(1):
+            result = list(search_by_name(StudentModel.objects.all(), "Adelaï"))
+        self.assertEqual(len(result), 4)
+        self.assertTrue(all(s.name_rank == 1 for s in result))
+
+        # Only the best matches are kept.
+        result = search_by_name(
+            StudentModel.objects.filter(teaching__name="secondaire"), "barre ad"
+        )
+        self.assertEqual([s.name_rank for s in result], [2])
+        self.assertEqual(search_by_name(StudentModel.objects.all(), " ").count(), 0)
 
     def test_get_students_by_name(self):
         result = People().get_students_by_name("Adelaï")
@@ -244,6 +317,8 @@ class GetClassesTest(TestCase):
     fixtures = ["base_random_people_auth.json", "base_random_people_core"]
 
     def setUp(self):
+        # Access scopes are cached and test rollbacks do not send signals.
+        cache.clear()
         # Get a direction user.
         self.dir_user = User.objects.get(username="director")
         # Get a student user.
@@ -304,6 +379,19 @@ class GetClassesTest(TestCase):
         classes = list(map(lambda c: c.compact_str, classes))
         self.assertListEqual(classes, ["1D"])
 
+    def test_access_scope_cache(self):
+        classes = get_classes(check_access=True, user=self.teacher_user)
+        self.assertListEqual([c.compact_str for c in classes], ["1D"])
+        with self.assertNumQueries(0):
+            scope = get_access_scope(self.teacher_user)
+        self.assertEqual(scope.privileged_group, "professeur")
+
+        # Changing tenures invalidates the scope.
+        responsible = ResponsibleModel.objects.get(user=self.teacher_user)
+        responsible.tenure.add(ClasseModel.objects.get(id=9))
+        classes = get_classes(check_access=True, user=self.teacher_user)
+        self.assertListEqual(sorted(c.compact_str for c in classes), ["1D", "2A"])
+
     def test_educator_access(self):
         classes = get_classes(check_access=True, user=self.educator_user)
         self.assertEqual(classes.count(), 14)
@@ -481,3 +569,766 @@ class CheckStudentTeacherRelationship(TestCase):
         settings.save()
         students = get_students_from_teacher(teacher)
         self.assertEqual(students.count(), 105)
+
+
+class QueriesPerPageTest(TestCase):
+    """Serializing a page must run the same queries whatever its size."""
+
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+
+    def assertQueriesPerPage(
+        self, queries, serializer_class, queryset, page_sizes=(5, 10, 20), **kwargs
+    ):
+        for page_size in page_sizes:
+            with self.subTest(serializer=serializer_class.__name__, page_size=page_size):
+                page = serializer_class.setup_eager_loading(queryset, **kwargs)[:page_size]
+                with self.assertNumQueries(queries):
+                    if kwargs:
+                        serializer_class(page, many=True, **kwargs).data
+                    else:
+                        serializer_class(page, many=True).data
+
+    def test_student_serializers(self):
+        students = (
+            StudentModel.objects.filter(courses__isnull=False).distinct().order_by("matricule")
+        )
+        self.assertQueriesPerPage(1, StudentSerializer, students)
+        # Students, their courses and the courses' teachers.
+        self.assertQueriesPerPage(3, StudentSerializer, students, no_course=False)
+        self.assertQueriesPerPage(1, StudentLightSerializer, students)
+
+    def test_responsible_serializers(self):
+        responsibles = ResponsibleModel.objects.order_by("id")
+        self.assertQueriesPerPage(8, ResponsibleSerializer, responsibles)
+        self.assertQueriesPerPage(4, ResponsibleSensitiveSerializer, responsibles)
+        self.assertQueriesPerPage(2, ResponsibleLightSerializer, responsibles)
+
+    def test_info_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(username="director"))
+        # Count, students, courses and teachers.
+        with self.assertNumQueries(4):
+            response = client.get("/annuaire/api/student/")
+        self.assertEqual(len(response.data["results"]), 20)
+        # Count, responsibles and their relations.
+        with self.assertNumQueries(9):
+            response = client.get("/annuaire/api/responsible/")
+        self.assertEqual(len(response.data["results"]), 20)
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    query_budgets = {
+        "/annuaire/api/student/": 10,
+        "/annuaire/api/responsible/": 15,
+        "/annuaire/api/people/?query=a&people=all": 10,
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.get(username="director"))
+
+
+class MetricsTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        self.client = APIClient()
+
+    def test_recorded(self):
+        self.client.force_authenticate(user=User.objects.get(username="director"))
+        self.client.get("/annuaire/api/student/")
+        self.client.get("/annuaire/api/student/")
+
+        stats = get_metrics()["GET studentmodel-list"]
+        self.assertEqual(stats["count"], 2)
+        self.assertGreater(stats["avg_queries"], 0)
+        self.assertGreater(stats["avg_serializer_time"], 0)
+        self.assertEqual(sum(stats["latency_histogram"]), 2)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(user=User.objects.get(username="director"))
+        self.assertEqual(self.client.get("/core/api/metrics/").status_code, 403)
+
+        self.client.force_authenticate(
+            user=User.objects.create(username="metrics_admin", is_staff=True)
+        )
+        self.client.get("/annuaire/api/student/")
+        response = self.client.get("/core/api/metrics/")
+        self.assertIn("GET studentmodel-list", response.data)
+
+        self.client.delete("/core/api/metrics/")
+        self.assertNotIn("GET studentmodel-list", get_metrics())
+
+
+class FakeCalendarResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeCalendarSession:
+    """Answer with the calendar or with 304 if the ETag matches."""
+
+    def __init__(self, ics):
+        self.ics = ics
+        self.requests = []
+
+    def get(self, url, headers, timeout):
+        self.requests.append((url, headers))
+        if headers.get("If-None-Match") == '"v1"':
+            return FakeCalendarResponse(304)
+        return FakeCalendarResponse(200, self.ics, {"ETag": '"v1"'})
+
+
+class CalendarStoreTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        ImportCalendarModel.objects.create(name="École", url="https://school.be/cal.ics")
+        today = timezone.localdate()
+        events = [
+            ("Passé", today - timedelta(days=3), today - timedelta(days=2)),
+            ("Congé", today, today + timedelta(days=2)),
+            ("Réunion", today + timedelta(days=5), today + timedelta(days=6)),
+        ]
+        self.ics = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:test\r\n"
+        for name, begin, end in events:
+            self.ics += (
+                "BEGIN:VEVENT\r\nUID:%s\r\nSUMMARY:%s\r\n"
+                "DTSTART;VALUE=DATE:%s\r\nDTEND;VALUE=DATE:%s\r\nEND:VEVENT\r\n"
+                % (name, name, begin.strftime("%Y%m%d"), end.strftime("%Y%m%d"))
+            )
+        self.ics += "END:VCALENDAR\r\n"
+        self.today = today
+
+    def test_refresh(self):
+        session = FakeCalendarSession(self.ics)
+        refresh_calendars(session)
+        refresh_calendars(session)
+        # The second fetch is conditional and keeps the stored events.
+        self.assertEqual(session.requests[1][1], {"If-None-Match": '"v1"'})
+        self.assertEqual(
+            get_events(),
+            [
+                {
+                    "calendar": "École",
+                    "name": "Congé",
+                    "begin": self.today.strftime("%d/%m/%Y"),
+                    "end": (self.today + timedelta(days=1)).strftime("%d/%m/%Y"),
+                },
+                {
+                    "calendar": "École",
+                    "name": "Réunion",
+                    "begin": (self.today + timedelta(days=5)).strftime("%d/%m/%Y"),
+                    "end": (self.today + timedelta(days=5)).strftime("%d/%m/%Y"),
+                },
+            ],
+        )
+
+    def test_sorted_by_time(self):
+        day = (self.today + timedelta(days=5)).strftime("%Y%m%d")
+        for name, hour in [("Conseil", 14), ("Accueil", 9)]:
+            self.ics = self.ics.replace(
+                "END:VCALENDAR",
+                "BEGIN:VEVENT\r\nUID:%s\r\nSUMMARY:%s\r\nDTSTART:%sT%02i0000\r\n"
+                "DTEND:%sT%02i0000\r\nEND:VEVENT\r\nEND:VCALENDAR"
+                % (name, name, day, hour, day, hour + 1),
+            )
+        refresh_calendars(FakeCalendarSession(self.ics))
+        self.assertEqual(
+            [e["name"] for e in get_events()], ["Congé", "Réunion", "Accueil", "Conseil"]
+        )
+
+    @mock.patch("core.tasks.task_refresh_calendars.delay")
+    def test_stale_while_revalidate(self, delay):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username="calendar"))
+        # Nothing is stored yet, a refresh is triggered once.
+        self.assertEqual(client.get("/core/api/calendar/").data, {"results": []})
+        client.get("/core/api/calendar/")
+        self.assertEqual(delay.call_count, 1)
+
+        store = refresh_calendars(FakeCalendarSession(self.ics))
+        client.get("/core/api/calendar/")
+        self.assertEqual(delay.call_count, 1)
+
+        # A stale store is still served while being refreshed.
+        store["updated"] -= REFRESH_INTERVAL + 1
+        cache.set(STORE_KEY, store, None)
+        self.assertEqual(len(client.get("/core/api/calendar/").data["results"]), 2)
+        self.assertEqual(delay.call_count, 2)
+
+
+class WidgetsTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(username="director"))
+
+        today = timezone.localdate()
+        student = StudentModel.objects.filter(classe__isnull=False).first()
+        AdditionalStudentInfo.objects.update_or_create(
+            student=student, defaults={"birth_date": today.replace(year=2010)}
+        )
+        self.name = "%s %s %s" % (student.last_name, student.first_name, student.classe.compact_str)
+
+    def test_birthdays(self):
+        response = self.client.get("/core/api/birthday/")
+        self.assertEqual(response.data, {"results": [{"name": self.name}]})
+
+        # Birthdays are kept until midnight and not modified for browsers.
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/core/api/birthday/", HTTP_IF_NONE_MATCH=response.headers["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        responsibles = self.client.get("/core/api/birthday/", {"people": "responsible"})
+        self.assertNotEqual(responsibles.headers["ETag"], response.headers["ETag"])
+
+    def test_scholar_calendar(self):
+        dates = compute_scholar_calendar(2023, 8, 15)
+        self.assertEqual(len(dates), 13)
+        self.assertEqual(dates[0][0], [2023, 8, 1, "Ma", "×"])
+        self.assertEqual(dates[0][14], [2023, 8, 15, "Ma", ""])
+        self.assertEqual(dates[-1][13], [2024, 8, 14, "Me", ""])
+        self.assertEqual(dates[-1][14], [2024, 8, 15, "Je", "×"])
+
+        response = self.client.get("/core/api/scholar_calendar/")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            "/core/api/scholar_calendar/", HTTP_IF_NONE_MATCH=response.headers["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class StandInRemoteSession:
+    """Send the requests of push_model to this instance's API, as a stand-in remote."""
+
+    def __init__(self, client):
+        self.client = client
+        self.rows = {}
+        self.deleted = {}
+
+    def post(self, url, data, headers, timeout):
+        name = url.split("/")[-2]
+        payload = decode_payload(data, "gzip")
+        if payload["rows"]:
+            self.rows[name] = self.rows.get(name, 0) + len(payload["rows"])
+        if payload["deleted"]:
+            self.deleted[name] = payload["deleted"]
+        return self.client.post(
+            url, data, content_type="application/json", HTTP_CONTENT_ENCODING="gzip"
+        )
+
+
+class BulkSyncTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(
+            user=User.objects.create(username="remote", is_staff=True, is_superuser=True)
+        )
+
+    def test_import(self):
+        rows = [row for row, _ in export_rows("student")]
+        student = rows[0]
+        student["last_name"] = "Nouveau"
+        student["courses"] = student["courses"][1:]
+        new_student = dict(student, matricule=999999, courses=[])
+
+        with self.assertNumQueries(5):
+            import_rows("student", [student, new_student])
+        updated = StudentModel.objects.get(matricule=student["matricule"])
+        self.assertEqual(updated.last_name, "Nouveau")
+        self.assertEqual(updated.last_name_search, "nouveau")
+        self.assertEqual(
+            sorted(updated.courses.values_list("id", flat=True)), sorted(student["courses"])
+        )
+        self.assertEqual(
+            StudentModel.objects.get(matricule=999999).first_name, student["first_name"]
+        )
+
+    def test_push(self):
+        session = StandInRemoteSession(self.client)
+        for name in SYNC_MODELS:
+            sent, errors = push_model(session, "/", name, chunk_size=100, workers=1)
+            self.assertEqual(errors, [])
+            self.assertEqual(sent, SYNC_MODELS[name].model.objects.count())
+
+        # Only changed rows are sent again.
+        session.rows = {}
+        StudentModel.objects.filter(
+            matricule=StudentModel.objects.order_by("matricule").first().matricule
+        ).update(first_name="Changé")
+        for name in SYNC_MODELS:
+            push_model(session, "/", name, workers=1)
+        self.assertEqual(session.rows, {"student": 1})
+
+    def test_errors(self):
+        response = self.client.post(
+            "/core/api/bulk_sync/student/",
+            encode_rows([{"matricule": 1}]),
+            content_type="application/json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post("/core/api/bulk_sync/unknown/").status_code, 404)
+
+        self.client.force_authenticate(user=User.objects.get(username="director"))
+        self.assertEqual(self.client.post("/core/api/bulk_sync/student/").status_code, 403)
+
+
+class ChangeLogTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        core_settings = get_core_settings()
+        core_settings.remote = "https://remote.school.be"
+        core_settings.remote_token = "token"
+        core_settings.save()
+        settings_registry.clear()
+
+        self.client = APIClient()
+        self.client.force_authenticate(
+            user=User.objects.create(username="remote", is_staff=True, is_superuser=True)
+        )
+        ChangeLogModel.objects.all().delete()
+        self.student = StudentModel.objects.order_by("matricule").first()
+
+    def get_log(self):
+        return list(
+            ChangeLogModel.objects.filter(is_replayed=False)
+            .order_by("id")
+            .values_list("model", "object_pk", "action")
+        )
+
+    def test_log(self):
+        matricule = str(self.student.matricule)
+        self.student.first_name = "Changé"
+        self.student.save()
+        self.student.courses.clear()
+        user = User.objects.get(username="director")
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
+        CourseModel.objects.first().delete()
+        self.student.delete()
+
+        log = self.get_log()
+        self.assertEqual(log[:2], [("student", matricule, "save"), ("student", matricule, "save")])
+        self.assertEqual(log[-1], ("student", matricule, "delete"))
+        self.assertIn("course", [e[0] for e in log])
+        self.assertNotIn("user", [e[0] for e in log])
+
+    def test_replay(self):
+        matricule = self.student.matricule
+        self.student.first_name = "Changé"
+        self.student.save()
+        other_student = StudentModel.objects.order_by("matricule")[1]
+        other_matricule = other_student.matricule
+        other_student.delete()
+
+        session = StandInRemoteSession(self.client)
+        self.assertEqual(replay_changes("/", session), 2)
+        self.assertEqual(session.rows, {"student": 1})
+        self.assertEqual(session.deleted, {"student": [other_matricule]})
+        self.assertEqual(self.get_log(), [])
+        self.assertEqual(StudentModel.objects.get(matricule=matricule).first_name, "Changé")
+
+    def test_prune(self):
+        self.student.save()
+        self.student.save()
+        ChangeLogModel.objects.filter(id=ChangeLogModel.objects.order_by("id").first().id).update(
+            datetime_creation=timezone.now() - timedelta(days=REPLAYED_RETENTION_DAYS + 1)
+        )
+        replay_changes("/", StandInRemoteSession(self.client))
+        # Only the old entry is removed, the recent one is kept.
+        self.assertEqual(ChangeLogModel.objects.filter(is_replayed=True).count(), 1)
+
+    def test_replay_error(self):
+        self.student.save()
+
+        class UnavailableSession:
+            def post(self, url, data, headers, timeout):
+                return FakeCalendarResponse(503, "Unavailable")
+
+        with self.assertRaises(SyncError):
+            replay_changes("/", UnavailableSession())
+        # Changes are kept to be replayed later.
+        self.assertEqual(len(self.get_log()), 1)
+
+    def test_no_remote(self):
+        core_settings = get_core_settings()
+        core_settings.remote = ""
+        core_settings.save()
+        settings_registry.clear()
+        self.student.save()
+        self.assertEqual(self.get_log(), [])
+
+
+class SettingsRegistryTest(TestCase):
+    def setUp(self):
+        settings_registry.clear()
+
+    def test_loaded_once(self):
+        core_settings = get_core_settings()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_core_settings(), core_settings)
+
+    def test_invalidation(self):
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(INVALIDATION_GROUP, channel_name)
+
+        core_settings = CoreSettingsModel.objects.get(pk=get_core_settings().pk)
+        core_settings.school_name = "Athénée"
+        with self.captureOnCommitCallbacks(execute=True):
+            core_settings.save()
+        self.assertEqual(get_core_settings().school_name, "Athénée")
+
+        # Other processes are notified once the change is committed.
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message["label"], "core.coresettingsmodel")
+
+
+class QuietImportStudentCSV(ImportStudentCSV):
+    def print_log(self, log: str) -> None:
+        pass
+
+
+class ImportStudentTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    csv_text = (
+        "1000;Gaudin;Guy;1;b;Math;A\n"
+        "1000;Gaudin;Guy;1;b;Science;\n"
+        "5000;Nouveau;Élève;7;z;Math;A\n"
+    )
+    new_courses_csv_text = (
+        "1000;Gaudin;Guy;1;b;Histoire;\n"
+        "1000;Gaudin;Guy;1;b;Geo;A\n"
+        "5000;Nouveau;Élève;7;z;Geo;A\n"
+        "5001;Autre;Élève;7;z;Latin;\n"
+    )
+    column_index = {
+        "matricule": 0,
+        "last_name": 1,
+        "first_name": 2,
+        "year": 3,
+        "classe_letter": 4,
+        "course_name_short": 5,
+        "group": 6,
+    }
+
+    def _import(self, bulk_sync: bool) -> None:
+        teaching = TeachingModel.objects.get(name="secondaire")
+        importation = QuietImportStudentCSV(
+            teaching, column_index=self.column_index, bulk_sync=bulk_sync
+        )
+        importation.sync(io.StringIO(self.csv_text))
+
+    def _assert_imported(self):
+        def courses(student):
+            return {(gc.course.short_name, gc.group) for gc in student.courses.all()}
+
+        guy = StudentModel.objects.get(matricule=1000)
+        self.assertIsNone(guy.inactive_from)
+        self.assertEqual(guy.classe.compact_str, "1B")
+        self.assertEqual(courses(guy), {("Math", "A"), ("Science", "")})
+
+        new_student = StudentModel.objects.get(matricule=5000)
+        self.assertEqual(new_student.first_name, "Élève")
+        self.assertEqual(new_student.classe.compact_str, "7Z")
+        self.assertEqual(courses(new_student), {("Math", "A")})
+        self.assertEqual(new_student.additionalstudentinfo.student_email, "")
+
+        self.assertEqual(CourseModel.objects.count(), 3)
+        inactives = StudentModel.objects.filter(
+            teaching__name="secondaire", inactive_from__isnull=False
+        )
+        self.assertEqual(inactives.count(), 629)
+        self.assertFalse(inactives.filter(classe__isnull=False).exists())
+        self.assertFalse(inactives.filter(courses__isnull=False).exists())
+        self.assertFalse(
+            StudentModel.objects.filter(
+                teaching__name="primaire", inactive_from__isnull=False
+            ).exists()
+        )
+
+    def test_sync(self):
+        self._import(bulk_sync=False)
+        self._assert_imported()
+
+    def test_bulk_sync(self):
+        self._import(bulk_sync=True)
+        self._assert_imported()
+
+    def test_bulk_sync_is_idempotent(self):
+        self._import(bulk_sync=True)
+        self._import(bulk_sync=True)
+        self._assert_imported()
+
+    def _import_file(self, rows_done: int = 0, chunk_size: int = 1) -> ImportPeopleModel:
+        import_people = ImportPeopleModel(
+            teaching=TeachingModel.objects.get(name="secondaire"),
+            columns=json.dumps(list(self.column_index.keys())),
+            rows_done=rows_done,
+        )
+        import_people.csv_file.save("students.csv", ContentFile(self.csv_text.encode("utf-8")))
+        importation = QuietImportStudentCSV(import_people.teaching, column_index=self.column_index)
+        import_people_file(importation, import_people, chunk_size=chunk_size)
+        return import_people
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_import_file_by_chunks(self):
+        import_people = self._import_file()
+        self._assert_imported()
+        import_people.refresh_from_db()
+        self.assertEqual(import_people.rows_total, 3)
+        self.assertEqual(import_people.rows_done, 3)
+        self.assertTrue(import_people.is_done)
+        self.assertFalse(import_people.csv_file)
+
+    def _assert_new_courses(self):
+        def courses(matricule):
+            student = StudentModel.objects.get(matricule=matricule)
+            return {(gc.course.short_name, gc.group) for gc in student.courses.all()}
+
+        self.assertEqual(courses(1000), {("Histoire", ""), ("Geo", "A")})
+        self.assertEqual(courses(5000), {("Geo", "A")})
+        self.assertEqual(courses(5001), {("Latin", "")})
+        for short_name in ["Histoire", "Geo", "Latin"]:
+            self.assertEqual(CourseModel.objects.filter(short_name=short_name).count(), 1)
+
+    def test_bulk_sync_new_courses(self):
+        # New courses of a same chunk are not merged.
+        self.csv_text = self.new_courses_csv_text
+        self._import(bulk_sync=True)
+        self._assert_new_courses()
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_import_file_new_courses(self):
+        # Uploaded files are imported in bulk mode, in one chunk here.
+        self.csv_text = self.new_courses_csv_text
+        self._import_file(chunk_size=500)
+        self._assert_new_courses()
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_resume_import_file(self):
+        # The two rows of the first student were already imported.
+        self._import_file(rows_done=2)
+        self.assertEqual(StudentModel.objects.get(matricule=1000).classe.compact_str, "1A")
+        self.assertEqual(StudentModel.objects.get(matricule=5000).classe.compact_str, "7Z")
+        self.assertIsNone(StudentModel.objects.get(matricule=1000).inactive_from)
+
+
+class QuietImportResponsibleCSV(ImportResponsibleCSV):
+    def print_log(self, log: str) -> None:
+        pass
+
+
+class ImportResponsibleTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    csv_text = (
+        "100003;Chevallier;Jean;2a;2a;teacher\n"
+        "100003;Chevallier;Jean;3b;;teacher\n"
+        "999999;Nouveau;Prof;4c;;newprof\n"
+    )
+    column_index = {
+        "matricule": 0,
+        "last_name": 1,
+        "first_name": 2,
+        "classe": 3,
+        "tenure": 4,
+        "username": 5,
+    }
+
+    def _import(self, bulk_sync: bool) -> None:
+        teaching = TeachingModel.objects.get(name="secondaire")
+        importation = QuietImportResponsibleCSV(
+            teaching, column_index=self.column_index, is_teacher=True, bulk_sync=bulk_sync
+        )
+        importation.sync(io.StringIO(self.csv_text))
+
+    def _snapshot(self) -> list:
+        return [
+            (
+                r.matricule,
+                r.last_name,
+                r.first_name,
+                r.inactive_from is None,
+                r.is_teacher,
+                r.user.username if r.user else None,
+                sorted(g.name for g in r.user.groups.all()) if r.user else [],
+                sorted(c.compact_str for c in r.classe.all()),
+                sorted(c.compact_str for c in r.tenure.all()),
+                sorted(c.id for c in r.courses.all()),
+            )
+            for r in ResponsibleModel.objects.filter(teaching__name="secondaire").order_by(
+                "matricule"
+            )
+        ]
+
+    def test_bulk_sync(self):
+        # Compare with the regular import.
+        with transaction.atomic():
+            self._import(bulk_sync=False)
+            expected = self._snapshot()
+            transaction.set_rollback(True)
+
+        self._import(bulk_sync=True)
+        self.assertListEqual(self._snapshot(), expected)
+
+        teacher = ResponsibleModel.objects.get(matricule=100003)
+        self.assertEqual(teacher.user.username, "teacher")
+        self.assertEqual(sorted(c.compact_str for c in teacher.classe.all()), ["2A", "3B"])
+        self.assertEqual([c.compact_str for c in teacher.tenure.all()], ["2A"])
+        new_teacher = ResponsibleModel.objects.get(matricule=999999)
+        self.assertTrue(new_teacher.user.groups.filter(name="professeur").exists())
+        self.assertTrue(
+            ResponsibleModel.objects.filter(
+                teaching__name="secondaire", is_teacher=True, inactive_from__isnull=False
+            ).exists()
+        )
+
+        # A second import must not change anything.
+        self._import(bulk_sync=True)
+        self.assertListEqual(self._snapshot(), expected)
+
+    def test_bulk_sync_new_courses(self):
+        # New courses of a same chunk are not merged.
+        self.csv_text = (
+            "100003;Chevallier;Jean;2a;2a;teacher;Histoire\n"
+            "100003;Chevallier;Jean;3b;;teacher;Geo\n"
+            "999999;Nouveau;Prof;4c;;newprof;Geo\n"
+        )
+        self.column_index = dict(self.column_index, course_name_short=6)
+        self._import(bulk_sync=True)
+
+        def courses(matricule):
+            teacher = ResponsibleModel.objects.get(matricule=matricule)
+            return sorted(gc.course.short_name for gc in teacher.courses.all())
+
+        self.assertEqual(courses(100003), ["Geo", "Histoire"])
+        self.assertEqual(courses(999999), ["Geo"])
+        self.assertEqual(CourseModel.objects.filter(short_name__in=["Histoire", "Geo"]).count(), 2)
+
+
+ProEcoAbsence = namedtuple("ProEcoAbsence", ["date", "morning", "afternoon"])
+
+
+@override_settings(
+    SYNC_FDB_SERVER=[{"teaching_name": "secondaire", "server": "proeco", "teaching_type": 5}]
+)
+class SyncAbsencesTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        from student_absence.models import PeriodModel
+
+        settings_registry.clear()
+        self.student, self.other_student = StudentModel.objects.filter(
+            teaching__name="secondaire"
+        ).order_by("matricule")[:2]
+        self.morning = PeriodModel.objects.create(
+            start=datetime.time(8, 15), end=datetime.time(9, 5), name="P1"
+        )
+        self.afternoon = PeriodModel.objects.create(
+            start=datetime.time(13, 0), end=datetime.time(13, 50), name="P5"
+        )
+        self.day = datetime.date(get_scholar_year(), 10, 5)
+        self.other_day = self.day + timedelta(days=1)
+
+    def add_absence(self, student, day, period, is_absent, username):
+        from student_absence.models import StudentAbsenceModel
+
+        return StudentAbsenceModel.objects.create(
+            student=student, date_absence=day, period=period, is_absent=is_absent, username=username
+        )
+
+    def sync(self, proeco_students: dict) -> str:
+        reader = mock.Mock()
+        reader.get_students.return_value = proeco_students
+        libreschoolfdb = mock.Mock(reader=reader)
+        with mock.patch.dict(
+            sys.modules, {"libreschoolfdb": libreschoolfdb, "libreschoolfdb.reader": reader}
+        ), self.assertLogs("core.management.commands.syncabsences", "INFO") as logs:
+            call_command("syncabsences", stdout=io.StringIO())
+        return logs.output[0]
+
+    def test_sync(self):
+        from student_absence.models import JustificationModel, StudentAbsenceModel
+
+        self.add_absence(self.student, self.day, self.morning, False, PROECO_USERNAME)
+        removed = self.add_absence(
+            self.student, self.other_day, self.morning, True, PROECO_USERNAME
+        )
+        # The other student has no ProEco absence anymore.
+        removed_other = self.add_absence(
+            self.other_student, self.day, self.morning, True, PROECO_USERNAME
+        )
+        kept = [
+            self.add_absence(self.student, self.other_day, self.afternoon, True, "educ"),
+            self.add_absence(self.other_student, self.other_day, self.morning, False, "educ"),
+        ]
+
+        log = self.sync(
+            {
+                self.student.matricule: {
+                    "absences": [ProEcoAbsence(self.day, True, False)],
+                    "absences_justifications": [
+                        {
+                            "start": (self.day, 0),
+                            "end": (self.day, 1),
+                            "code": "M",
+                            "half_days": 2,
+                        }
+                    ],
+                },
+                self.other_student.matricule: {"absences": [], "absences_justifications": []},
+            }
+        )
+        self.assertIn(
+            "absences 1 inserted, 1 updated, 2 deleted; justifications 1 inserted, 0 deleted", log
+        )
+
+        # Half days are mapped to the periods starting before or after noon.
+        absences = StudentAbsenceModel.objects.filter(student=self.student, date_absence=self.day)
+        self.assertTrue(absences.get(period=self.morning).is_absent)
+        self.assertFalse(absences.get(period=self.afternoon).is_absent)
+        self.assertFalse(
+            StudentAbsenceModel.objects.filter(id__in=[removed.id, removed_other.id]).exists()
+        )
+        # Absences saved in HappySchool are kept.
+        self.assertEqual(StudentAbsenceModel.objects.filter(id__in=[a.id for a in kept]).count(), 2)
+        self.assertEqual(JustificationModel.objects.filter(student=self.student).count(), 1)
+
+        # A second sync changes nothing.
+        log = self.sync(
+            {
+                self.student.matricule: {
+                    "absences": [ProEcoAbsence(self.day, True, False)],
+                    "absences_justifications": [
+                        {"start": (self.day, 0), "end": (self.day, 1), "code": "M", "half_days": 2}
+                    ],
+                },
+            }
+        )
+        self.assertIn(
+            "absences 0 inserted, 0 updated, 0 deleted; justifications 0 inserted, 0 deleted", log
+        )
@@ -42,6 +42,8 @@ urlpatterns = [
     path("api/logo/", admin_views.LogoAPI.as_view(), name="logo"),
     path("api/update/", admin_views.UpdateAPIView.as_view(), name="update"),
     path("api/restart/", admin_views.RestartAPIView.as_view(), name="restart"),
+    path("api/metrics/", admin_views.MetricsAPIView.as_view(), name="metrics"),
+    path("api/bulk_sync/<str:model>/", views.BulkSyncAPI.as_view(), name="bulk_sync"),
     path("ping/", views.PingAPI.as_view(), name="ping"),
 ]
 
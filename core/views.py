@@ -19,14 +19,7 @@
 
 import json
 import warnings
-import requests
 import os
-import calendar
-import itertools
-
-from datetime import date, timedelta
-
-from icalendar import Calendar
 
 from rest_framework import status
 from rest_framework.filters import OrderingFilter
@@ -42,11 +35,12 @@ from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMix
 
 from django_filters import rest_framework as filters
 
-from django.views.decorators.cache import cache_page
-from django.utils.decorators import method_decorator
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.db.models import CharField, Q
-from django.core.exceptions import ObjectDoesNotExist, FieldError
+from django.core.exceptions import ObjectDoesNotExist, FieldError, ValidationError
+from django.db import IntegrityError
 from django.views.generic import TemplateView
 from django.contrib.auth.models import Group, User
 
@@ -56,13 +50,16 @@ from core.models import (
     EmailModel,
     CoreSettingsModel,
     StudentModel,
-    ImportCalendarModel,
     ClasseModel,
     CourseModel,
     GivenCourseModel,
 )
-from core.people import get_classes
+from core.calendars import get_events
+from core.sync import SYNC_MODELS, SyncError, decode_payload, delete_rows, import_rows
+from core.widgets import get_birthdays, get_scholar_calendar
+from core.people import get_access_scope, get_core_settings, search_by_name
 from core.permissions import IsSecretaryPermission
+from core.settings_registry import settings_registry
 from core.serializers import (
     ResponsibleSensitiveSerializer,
     TeachingSerializer,
@@ -83,17 +80,8 @@ from core.serializers import (
 from core.utilities import get_scholar_year, get_menu
 
 
-def get_app_settings(SettingsModel):
-    settings_model = SettingsModel.objects.first()
-    if not settings_model:
-        # Create default settings.
-        settings_model = SettingsModel()
-        settings_model.save()
-    return settings_model
-
-
-def get_core_settings():
-    return get_app_settings(CoreSettingsModel)
+def get_app_settings(SettingsModel, create_default=None):
+    return settings_registry.get(SettingsModel, create_default=create_default)
 
 
 class BaseFilters(filters.FilterSet):
@@ -163,50 +151,7 @@ class BaseFilters(filters.FilterSet):
         return queryset.filter(query_filter)
 
     def people_name_by(self, queryset, name, value):
-        tokens = value.split(" ")
-        people = queryset.none()
-
-        if len(tokens) > 1:
-            # First check compound last name.
-            people = queryset.filter(
-                Q(
-                    **{
-                        f"{self.student_field}__last_name__unaccent__istartswith": " ".join(
-                            tokens[:2]
-                        )
-                    }
-                )
-                | Q(
-                    **{
-                        f"{self.student_field}__last_name__unaccent__istartswith": " ".join(
-                            tokens[-2:]
-                        )
-                    }
-                )
-            )
-            if len(people) == 0:
-                people = queryset.filter(
-                    Q(
-                        **{
-                            f"{self.student_field}__first_name__unaccent__iexact": tokens[0],
-                            f"{self.student_field}__last_name__unaccent__istartswith": tokens[1],
-                        }
-                    )
-                    | Q(
-                        **{
-                            f"{self.student_field}__first_name__unaccent__istartswith": tokens[1],
-                            f"{self.student_field}__last_name__unaccent__iexact": tokens[0],
-                        }
-                    )
-                )
-
-        if len(people) == 0:
-            for name_part in tokens:
-                people |= queryset.filter(
-                    Q(**{f"{self.student_field}__first_name__unaccent__istartswith": name_part})
-                    | Q(**{f"{self.student_field}__last_name__unaccent__istartswith": name_part})
-                )
-        return people
+        return search_by_name(queryset, value, field=self.student_field)
 
 
 class PageNumberSizePagination(PageNumberPagination):
@@ -242,50 +187,33 @@ class BaseModelViewSet(ModelViewSet):
             return self.queryset
         else:
             stud_teach_rel = get_core_settings().student_teacher_relationship
-            try:
-                responsible = ResponsibleModel.objects.get(user=self.request.user)
-
-                if stud_teach_rel == CoreSettingsModel.BY_CLASSES or self.is_only_tenure():
-                    teachings = responsible.teaching.all()
-                    classes = get_classes(
-                        list(map(lambda t: t.name, teachings)),
-                        True,
-                        self.request.user,
-                        tenure_class_only=self.is_only_tenure(),
-                    ).values_list("id")
-                    try:
-                        queryset = self.queryset.filter(student__classe__id__in=classes)
-                    except FieldError:
-                        queryset = self.queryset.filter(matricule__classe__id__in=classes)
-                        warnings.warn(
-                            "Use *student* as field name instead of matricule", DeprecationWarning
-                        )
-                elif stud_teach_rel == CoreSettingsModel.BY_COURSES:
-                    try:
-                        queryset = self.queryset.filter(
-                            student__courses__in=responsible.courses.all()
-                        )
-                    except FieldError:
-                        queryset = self.queryset.filter(
-                            matricule__courses__in=responsible.courses.all()
-                        )
-                        warnings.warn(
-                            "Use *student* as field name instead of matricule", DeprecationWarning
-                        )
-                elif stud_teach_rel == CoreSettingsModel.BY_CLASSES_COURSES:
-                    teachings = responsible.teaching.all()
-                    classes = get_classes(
-                        list(map(lambda t: t.name, teachings)),
-                        True,
-                        self.request.user,
-                        tenure_class_only=self.is_only_tenure(),
-                    ).values_list("id")
-                    queryset = self.queryset.filter(
-                        Q(matricule__classe__id__in=classes)
-                        | Q(matricule__courses__in=responsible.courses.all())
-                    )
-            except ObjectDoesNotExist:
+            # Classes are taken from all the responsible's teachings.
+            scope = get_access_scope(self.request.user, tenure_class_only=self.is_only_tenure())
+            if not scope.responsible_id:
                 return self.queryset.none()
+
+            classes = scope.classe_ids
+            courses = GivenCourseModel.objects.filter(responsiblemodel=scope.responsible_id)
+            if stud_teach_rel == CoreSettingsModel.BY_CLASSES or self.is_only_tenure():
+                try:
+                    queryset = self.queryset.filter(student__classe__id__in=classes)
+                except FieldError:
+                    queryset = self.queryset.filter(matricule__classe__id__in=classes)
+                    warnings.warn(
+                        "Use *student* as field name instead of matricule", DeprecationWarning
+                    )
+            elif stud_teach_rel == CoreSettingsModel.BY_COURSES:
+                try:
+                    queryset = self.queryset.filter(student__courses__in=courses)
+                except FieldError:
+                    queryset = self.queryset.filter(matricule__courses__in=courses)
+                    warnings.warn(
+                        "Use *student* as field name instead of matricule", DeprecationWarning
+                    )
+            elif stud_teach_rel == CoreSettingsModel.BY_CLASSES_COURSES:
+                queryset = self.queryset.filter(
+                    Q(matricule__classe__id__in=classes) | Q(matricule__courses__in=courses)
+                )
             return queryset
 
     def perform_create(self, serializer):
@@ -369,13 +297,14 @@ class MembersAPI(ModelViewSet):
     def get_queryset(self):
         person_type = self.request.GET.get("person_type", None)
         if person_type == "secretary":
-            return ResponsibleModel.objects.filter(is_secretary=True)
+            queryset = ResponsibleModel.objects.filter(is_secretary=True)
         elif person_type == "others":
-            return ResponsibleModel.objects.filter(
+            queryset = ResponsibleModel.objects.filter(
                 is_teacher=False, is_educator=False, is_secretary=False
             )
         else:
-            return ResponsibleModel.objects.filter(is_teacher=False, is_educator=False)
+            queryset = ResponsibleModel.objects.filter(is_teacher=False, is_educator=False)
+        return ResponsibleSensitiveSerializer.setup_eager_loading(queryset)
 
 
 class ScholarYearAPI(APIView):
@@ -542,123 +471,57 @@ class PeriodCoreViewSet(ModelViewSet):
 class BirthdayAPI(APIView):
     permission_classes = (IsAuthenticated,)
 
-    def get(self, format=None):
-        people = self.request.GET.get("people", "student")
-
-        birthday = []
-        today = timezone.now()
-        if people == "student":
-            students = StudentModel.objects.filter(
-                additionalstudentinfo__birth_date__month=today.month,
-                additionalstudentinfo__birth_date__day=today.day,
-                classe__isnull=False,
-            ).order_by("teaching")
-            students = students.values_list(
-                "last_name", "first_name", "classe__year", "classe__letter"
-            )
-            birthday += [
-                {"name": "%s %s %s%s" % (s[0], s[1], s[2], s[3].upper())} for s in students
-            ]
-        elif people == "responsible":
-            responsibles = ResponsibleModel.objects.filter(
-                birth_date__month=today.month, birth_date__day=today.day, inactive_from__isnull=True
-            )
-            responsibles = responsibles.values_list("last_name", "first_name")
-            birthday += [{"name": "%s %s" % (s[0], s[1])} for s in responsibles]
-        return Response({"results": birthday})
+    @method_decorator(
+        condition(
+            etag_func=lambda request: get_birthdays(request.GET.get("people", "student"))["etag"]
+        )
+    )
+    def get(self, request, format=None):
+        people = request.GET.get("people", "student")
+        return Response({"results": get_birthdays(people)["data"]})
 
 
 class ScholarCalendarAPI(APIView):
     permission_classes = (IsAuthenticated,)
 
-    def get(self, format=None):
-        start_year = get_scholar_year()
-        start_month = get_core_settings().month_scholar_year_start
-        start_day = get_core_settings().day_scholar_year_start
-        cal = calendar.Calendar()
-        day_of_week = {
-            0: "Lu",
-            1: "Ma",
-            2: "Me",
-            3: "Je",
-            4: "Ve",
-            5: "Sa",
-            6: "Di",
-        }
-        dates = [
-            d[:3] + (day_of_week[d[3]], "")
-            if d[2] >= start_day
-            else d[:3] + (day_of_week[d[3]], "×")
-            for d in cal.itermonthdays4(start_year, start_month)
-            if d[1] == start_month
-        ]
-        for m in range(start_month + 1, 13):
-            dates += [
-                d[:3] + (day_of_week[d[3]], "")
-                for d in cal.itermonthdays4(start_year, m)
-                if d[1] == m
-            ]
-        for m in range(1, start_month):
-            dates += [
-                d[:3] + (day_of_week[d[3]], "")
-                for d in cal.itermonthdays4(start_year + 1, m)
-                if d[1] == m
-            ]
-        dates += [
-            d[:3] + (day_of_week[d[3]], "")
-            if d[2] < start_day
-            else d[:3] + (day_of_week[d[3]], "×")
-            for d in cal.itermonthdays4(start_year + 1, start_month)
-            if d[1] == start_month
-        ]
-        dates = [list(group) for key, group in itertools.groupby(dates, lambda d: d[1])]
-        return Response(dates)
+    @method_decorator(condition(etag_func=lambda request: get_scholar_calendar()["etag"]))
+    def get(self, request, format=None):
+        return Response(get_scholar_calendar()["data"])
 
 
 class CalendarAPI(APIView):
+    """Upcoming events of the imported calendars, served from the calendar store."""
+
     permission_classes = (IsAuthenticated,)
 
-    @staticmethod
-    def _today(event):
-        now = timezone.now()
-        if type(event["DTSTART"].dt) == date:
-            return now.date()
-        return now
-
-    @staticmethod
-    def _format_date(date, is_end=False):
-        if ":" in str(date):
-            print(date.strftime("%H:%M" if is_end else "%d/%m/%Y %H:%M"))
-            return date.strftime("%H:%M" if is_end else "%d/%m/%Y %H:%M")
-        else:
-            if is_end:
-                return (date - timedelta(days=1)).strftime("%d/%m/%Y")
-            else:
-                return date.strftime("%d/%m/%Y")
+    def get(self, request, format=None):
+        return Response({"results": get_events()})
 
-    # Cache for 6 hours.
-    @method_decorator(cache_page(60 * 60 * 6))
-    def get(self, format=None):
-        events = []
-        for cal_ics in ImportCalendarModel.objects.all():
-            cal = Calendar.from_ical(requests.get(cal_ics.url).text)
-            # for e in cal.walk('VEVENT'):
-            #    if e['DTSTART'].dt > self._today(e) or e['DTSTART'].dt <= self._today(e) < e['DTEND'].dt:
-            #        print(e['DTEND'].dt)
-            evts = [
-                {
-                    "calendar": cal_ics.name,
-                    "name": str(event["SUMMARY"]),
-                    "begin": self._format_date(event["DTSTART"].dt),
-                    "end": self._format_date(event["DTEND"].dt, True),
-                }
-                for event in cal.walk("VEVENT")
-                if event["DTSTART"].dt > self._today(event)
-                or event["DTSTART"].dt <= self._today(event) < event["DTEND"].dt
+
+class BulkSyncAPI(APIView):
+    """Create or update the rows sent by the syncremote command of another instance."""
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, model, format=None):
+        if model not in SYNC_MODELS:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        meta = SYNC_MODELS[model].model._meta
+        if not request.user.has_perms(
+            [
+                "%s.%s_%s" % (meta.app_label, action, meta.model_name)
+                for action in ("add", "change", "delete")
             ]
-            events += evts
-        events = sorted(events, key=lambda e: (e["begin"][6:], e["begin"][3:5], e["begin"][:2]))
-        return Response({"results": events})
+        ):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            payload = decode_payload(request.body, request.META.get("HTTP_CONTENT_ENCODING", ""))
+            imported = import_rows(model, payload["rows"])
+            deleted = delete_rows(model, payload["deleted"])
+        except (SyncError, ValidationError, IntegrityError, KeyError, ValueError, OSError) as err:
+            return Response({"error": str(err)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"imported": imported, "deleted": deleted})
 
 
 class PingAPI(APIView):
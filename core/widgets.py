@@ -0,0 +1,122 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import calendar
+import hashlib
+import itertools
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.models import ResponsibleModel, StudentModel
+from core.people import get_core_settings
+from core.utilities import get_scholar_year
+
+BIRTHDAYS_KEY = "core_birthdays_%s_%s"
+SCHOLAR_CALENDAR_KEY = "core_scholar_calendar_%s_%i_%i_%i"
+PEOPLE = ("student", "responsible")
+DAYS_OF_WEEK = ("Lu", "Ma", "Me", "Je", "Ve", "Sa", "Di")
+
+
+def _until_midnight() -> int:
+    """Seconds until the next (local) midnight, when daily widgets expire."""
+    now = timezone.localtime()
+    midnight = datetime.combine(now.date() + timedelta(days=1), time(), tzinfo=now.tzinfo)
+    return max(int((midnight - now).total_seconds()), 1)
+
+
+def _cached(key: str, compute) -> dict:
+    """Get a widget from the cache or compute it, with an ETag of its content."""
+    widget = cache.get(key)
+    if widget is None:
+        data = compute()
+        etag = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        widget = {"data": data, "etag": etag}
+        cache.set(key, widget, _until_midnight())
+    return widget
+
+
+def compute_birthdays(people: str) -> list:
+    today = timezone.localdate()
+    if people == "student":
+        students = StudentModel.objects.filter(
+            additionalstudentinfo__birth_date__month=today.month,
+            additionalstudentinfo__birth_date__day=today.day,
+            classe__isnull=False,
+        ).order_by("teaching")
+        students = students.values_list("last_name", "first_name", "classe__year", "classe__letter")
+        return [{"name": "%s %s %s%s" % (s[0], s[1], s[2], s[3].upper())} for s in students]
+    elif people == "responsible":
+        responsibles = ResponsibleModel.objects.filter(
+            birth_date__month=today.month, birth_date__day=today.day, inactive_from__isnull=True
+        )
+        responsibles = responsibles.values_list("last_name", "first_name")
+        return [{"name": "%s %s" % (s[0], s[1])} for s in responsibles]
+    return []
+
+
+def get_birthdays(people: str = "student") -> dict:
+    """Today's birthdays of students or responsibles."""
+    return _cached(
+        BIRTHDAYS_KEY % (people, timezone.localdate().isoformat()),
+        lambda: compute_birthdays(people),
+    )
+
+
+def compute_scholar_calendar(start_year: int, start_month: int, start_day: int) -> list:
+    """Days of the scholar year grouped by month, days outside of the year are marked by ×."""
+    cal = calendar.Calendar()
+
+    def month_days(year, month, is_outside=lambda d: False):
+        return [
+            list(d[:3]) + [DAYS_OF_WEEK[d[3]], "×" if is_outside(d) else ""]
+            for d in cal.itermonthdays4(year, month)
+            if d[1] == month
+        ]
+
+    dates = month_days(start_year, start_month, lambda d: d[2] < start_day)
+    for m in range(start_month + 1, 13):
+        dates += month_days(start_year, m)
+    for m in range(1, start_month):
+        dates += month_days(start_year + 1, m)
+    dates += month_days(start_year + 1, start_month, lambda d: d[2] >= start_day)
+    return [list(group) for key, group in itertools.groupby(dates, lambda d: d[1])]
+
+
+def get_scholar_calendar() -> dict:
+    """The current scholar year calendar."""
+    core_settings = get_core_settings()
+    start = (
+        get_scholar_year(),
+        core_settings.month_scholar_year_start,
+        core_settings.day_scholar_year_start,
+    )
+    return _cached(
+        SCHOLAR_CALENDAR_KEY % ((timezone.localdate().isoformat(),) + start),
+        lambda: compute_scholar_calendar(*start),
+    )
+
+
+def precompute_widgets() -> None:
+    """Compute today's widgets before the first users log in."""
+    for people in PEOPLE:
+        get_birthdays(people)
+    get_scholar_calendar()
@@ -0,0 +1,126 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db.models import Count, Q, QuerySet
+from django.utils import timezone
+
+from core.models import ResponsibleModel
+from core.people import get_classes
+from core.utilities import get_scholar_year
+from core.views import get_app_settings
+
+from .models import CasEleve, DossierEleveSettingsModel, SanctionStatisticsModel
+
+NOT_DISCIPLINARY = "Non disciplinaire"
+TOTAL_DISCIPLINARY = "Total disciplinaire"
+
+
+def get_statistics_queryset(user) -> QuerySet:
+    """Cases the user can count, all of them or only the ones of its classes."""
+    all_access = get_app_settings(DossierEleveSettingsModel).all_access.all()
+    queryset = CasEleve.objects.all()
+    if not user.groups.intersection(all_access).exists():
+        teachings = ResponsibleModel.objects.get(user=user).teaching.all()
+        classes = get_classes(list(map(lambda t: t.name, teachings)), True, user)
+        queryset = queryset.filter(student__classe__in=classes)
+    return queryset
+
+
+def get_sanction_statistics() -> list:
+    """Statistics' display with their sanctions decisions' ids."""
+    statistics = {}
+    for stat_id, display, decision_id in SanctionStatisticsModel.objects.order_by("id").values_list(
+        "id", "display", "sanctions_decisions"
+    ):
+        decisions = statistics.setdefault(stat_id, (display, []))[1]
+        if decision_id is not None:
+            decisions.append(decision_id)
+    return list(statistics.values())
+
+
+def _get_aggregates(sanction_statistics: list, only_sanctions: bool, all_years: bool) -> dict:
+    discip = Q(info=None) & (Q(sanction_faite=True) | Q(sanction_faite__isnull=True))
+    info = Q(sanction_decision=None)
+    if not all_years:
+        limit_date = timezone.make_aware(timezone.datetime(get_scholar_year(), 8, 15))
+        discip &= Q(datetime_encodage__gte=limit_date)
+        info &= Q(datetime_encodage__gte=limit_date)
+
+    aggregates = {
+        "stat_%i" % i: Count("id", filter=discip & Q(sanction_decision__in=decisions))
+        for i, (display, decisions) in enumerate(sanction_statistics)
+        if decisions
+    }
+    if not only_sanctions:
+        aggregates["not_disciplinary_count"] = Count("id", filter=info)
+        aggregates["disciplinary_count"] = Count("id", filter=discip)
+    return aggregates
+
+
+def _format_stats(counts: dict, sanction_statistics: list, only_sanctions: bool) -> list:
+    stats = [
+        {"display": display, "value": counts.get("stat_%i" % i) or 0}
+        for i, (display, decisions) in enumerate(sanction_statistics)
+    ]
+    if not only_sanctions:
+        stats.append(
+            {"display": NOT_DISCIPLINARY, "value": counts.get("not_disciplinary_count") or 0}
+        )
+        stats.append(
+            {"display": TOTAL_DISCIPLINARY, "value": counts.get("disciplinary_count") or 0}
+        )
+    return stats
+
+
+def gen_stats(user, student, only_sanctions=False, all_years=False) -> list:
+    """Count a student's cases by sanction statistic in one query.
+
+    :param user: The user asking, only the cases of its classes are counted.
+    :param student: The student or its matricule.
+    :param only_sanctions: Skip non disciplinary and total counts.
+    :param all_years: Count cases of every scholar year instead of the current one.
+    :return: The statistics' display with their value.
+    """
+    sanction_statistics = get_sanction_statistics()
+    aggregates = _get_aggregates(sanction_statistics, only_sanctions, all_years)
+    counts = {}
+    if aggregates:
+        counts = get_statistics_queryset(user).filter(student=student).aggregate(**aggregates)
+    return _format_stats(counts, sanction_statistics, only_sanctions)
+
+
+def gen_stats_by_student(user, students, only_sanctions=False, all_years=False) -> dict:
+    """Same as gen_stats for several students in one query, by matricule."""
+    students = list(students)
+    sanction_statistics = get_sanction_statistics()
+    aggregates = _get_aggregates(sanction_statistics, only_sanctions, all_years)
+    counts = {}
+    if aggregates:
+        counts = {
+            c["student"]: c
+            for c in get_statistics_queryset(user)
+            .filter(student__in=students)
+            .order_by()
+            .values("student")
+            .annotate(**aggregates)
+        }
+    return {
+        s.matricule: _format_stats(counts.get(s.matricule, {}), sanction_statistics, only_sanctions)
+        for s in students
+    }
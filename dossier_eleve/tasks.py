@@ -17,19 +17,44 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
-from datetime import date
+import hashlib
+import json
+import tempfile
+import uuid
+from datetime import date, timedelta
+from io import BytesIO
 
-from celery import shared_task
+from celery import chord, shared_task
+
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from PyPDF2 import PdfMerger
 
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max
+from django.test import RequestFactory
+from django.utils import timezone
 
 from core.email import send_email
-from core.models import ResponsibleModel, EmailModel
+from core.models import ResponsibleModel, EmailModel, ClasseModel, StudentModel
 from core.utilities import get_scholar_year
 from core.people import get_teachers_from_student
 from core.views import get_core_settings
 
 from .models import CasEleve, DossierEleveSettingsModel
+from .statistics import gen_stats_by_student
+
+# Students' PDF are cached until their cases change, the timeout only bounds the staleness due
+# to other changes (statistics settings, tenure, photo).
+STUDENT_PDF_TIMEOUT = 60 * 60 * 12
+# Classes' PDF are removed after this delay.
+CLASSE_PDF_TIMEOUT = 60 * 60
+CLASSE_PDF_DIR = "dossier_eleve/classe_pdf/"
 
 
 @shared_task(bind=True)
@@ -130,3 +155,141 @@ def task_send_info_email(self, instance_id):
         )
         for t in teachers:
             print("Sending email to : " + t)
+
+
+def get_classe_pdf_status_key(task_id: str) -> str:
+    return "dossier_eleve_classe_pdf_%s" % task_id
+
+
+def _get_student_pdf_key(user_id: int, matricule: int, params: dict, fingerprint: tuple) -> str:
+    """Cache key of a student's PDF, it changes with its cases' last modification."""
+    key = json.dumps([user_id, matricule, params, fingerprint], sort_keys=True, default=str)
+    return "dossier_eleve_student_pdf_%s" % hashlib.md5(key.encode()).hexdigest()
+
+
+def render_student_pdf(user, matricule, params, host, secure, statistics) -> bytes:
+    """Render the PDF of a student's cases as CasElevePDFGenAPI would, None without cases."""
+    from .views import CasElevePDFGenAPI
+
+    request = RequestFactory().get(
+        "/dossier_eleve/get_pdf/",
+        dict(params, student__matricule=matricule),
+        HTTP_HOST=host,
+        secure=secure,
+    )
+    request.user = user
+    view = CasElevePDFGenAPI()
+    view.setup(request)
+    context = view.generate_context(request, statistics)
+    if not context:
+        return None
+    return view.render_to_response(context).rendered_content
+
+
+@shared_task
+def task_student_pdf(user_id, matricule, params, host, secure, statistics, cache_key):
+    pdf = render_student_pdf(
+        User.objects.get(id=user_id), matricule, params, host, secure, statistics
+    )
+    # Students without cases are cached too, as an empty PDF.
+    cache.set(cache_key, pdf or b"", STUDENT_PDF_TIMEOUT)
+    return cache_key
+
+
+def _remove_expired_classe_pdfs() -> None:
+    try:
+        files = default_storage.listdir(CLASSE_PDF_DIR)[1]
+    except FileNotFoundError:
+        return
+    limit = timezone.now() - timedelta(seconds=CLASSE_PDF_TIMEOUT)
+    for file_name in files:
+        if default_storage.get_modified_time(CLASSE_PDF_DIR + file_name) < limit:
+            default_storage.delete(CLASSE_PDF_DIR + file_name)
+
+
+@shared_task
+def task_merge_classe_pdf(students, task_id, classe_id, user_id, params, host, secure):
+    """Merge the students' PDF and send the file url to the websocket.
+
+    Students are given as their PDF's cache key, matricule and statistics, PDF missing from
+    the cache are rendered again.
+    """
+    pdfs = cache.get_many([key for key, _, _ in students])
+    merger = PdfMerger()
+    added = False
+    for key, matricule, statistics in students:
+        if key not in pdfs:
+            pdfs[key] = render_student_pdf(
+                User.objects.get(id=user_id), matricule, params, host, secure, statistics
+            )
+            cache.set(key, pdfs[key] or b"", STUDENT_PDF_TIMEOUT)
+        if pdfs[key]:
+            merger.append(BytesIO(pdfs[key]))
+            added = True
+
+    _remove_expired_classe_pdfs()
+    status = {"file_url": None, "classe_id": classe_id, "user_id": user_id}
+    if added:
+        with tempfile.TemporaryFile() as output:
+            merger.write(output)
+            output.seek(0)
+            # The file is only served by ClassePDFFileAPI, its name must not be guessable.
+            status["file_name"] = default_storage.save(
+                "%s%s.pdf" % (CLASSE_PDF_DIR, uuid.uuid4().hex), File(output)
+            )
+        status["file_url"] = "/dossier_eleve/api/classe_pdf/%s/" % task_id
+
+    cache.set(get_classe_pdf_status_key(task_id), status, CLASSE_PDF_TIMEOUT)
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        get_classe_pdf_status_key(task_id),
+        {"type": "dossier_eleve.classe.pdf", "task": task_id, "file_url": status["file_url"]},
+    )
+
+
+@shared_task(bind=True)
+def task_classe_pdf(self, user_id, classe_id, params, host, secure):
+    """Render the PDF of a classe, one task by student not cached yet."""
+    user = User.objects.get(id=user_id)
+    classe = ClasseModel.objects.get(id=classe_id)
+    students = list(StudentModel.objects.filter(classe=classe).order_by("last_name", "first_name"))
+    statistics = gen_stats_by_student(
+        user, students, all_years=not params.get("scholar_year", False)
+    )
+    fingerprints = {
+        c["student"]: (c["last_modified"], c["count"])
+        for c in CasEleve.objects.filter(student__classe=classe)
+        .order_by()
+        .values("student")
+        .annotate(last_modified=Max("datetime_modified"), count=Count("id"))
+    }
+
+    merged_students = []
+    renderings = []
+    for student in students:
+        if student.matricule not in fingerprints:
+            continue
+        key = _get_student_pdf_key(
+            user_id, student.matricule, params, fingerprints[student.matricule]
+        )
+        merged_students.append([key, student.matricule, statistics[student.matricule]])
+        if key not in cache:
+            renderings.append(
+                task_student_pdf.s(
+                    user_id,
+                    student.matricule,
+                    params,
+                    host,
+                    secure,
+                    statistics[student.matricule],
+                    key,
+                )
+            )
+
+    merge = task_merge_classe_pdf.si(
+        merged_students, self.request.id, classe.id, user_id, params, host, secure
+    )
+    if renderings:
+        chord(renderings)(merge)
+    else:
+        merge.delay()
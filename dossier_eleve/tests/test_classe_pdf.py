@@ -0,0 +1,158 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from unittest import mock
+
+from celery import current_app
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+
+from core.models import StudentModel
+from core.settings_registry import settings_registry
+
+from dossier_eleve.models import CasEleve
+from dossier_eleve.tasks import (
+    CLASSE_PDF_DIR,
+    CLASSE_PDF_TIMEOUT,
+    get_classe_pdf_status_key,
+    task_merge_classe_pdf,
+)
+
+
+def blank_pdf(*args, **kwargs):
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+@mock.patch("dossier_eleve.tasks.render_student_pdf", side_effect=blank_pdf)
+class ClassePDFTests(TestCase):
+    fixtures = ["test_dossier_eleve_users.json", "test_dossier_eleve_settings_pyramid.json"]
+
+    def setUp(self):
+        # Run the tasks and their chord in the test.
+        current_app.conf.update(task_always_eager=True, task_eager_propagates=True)
+        self.addCleanup(
+            current_app.conf.update, task_always_eager=False, task_eager_propagates=False
+        )
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        cache.clear()
+        settings_registry.clear()
+        Group.objects.get(name="direction").permissions.add(
+            Permission.objects.get(codename="view_caseleve")
+        )
+        self.client.force_login(User.objects.get(username="director"))
+
+        StudentModel.objects.create(
+            matricule=1235, first_name="Titi", last_name="Tutu", classe_id=1, teaching_id=1
+        )
+        self.cases = [
+            CasEleve.objects.create(student_id=matricule, info_id=None, demandeur="Dupont Jean")
+            for matricule in [1234, 1235]
+        ]
+
+    def generate(self):
+        response = self.client.get("/dossier_eleve/api/classe_pdf/?classe=1&page_size=500")
+        task_id = json.loads(response.data)
+        # Clients connected late to the websocket get the status from the cache.
+        return cache.get(get_classe_pdf_status_key(task_id))["file_url"]
+
+    def get_pages(self, response) -> int:
+        return len(PdfReader(BytesIO(b"".join(response.streaming_content))).pages)
+
+    def test_merged(self, render):
+        file_url = self.generate()
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(self.get_pages(self.client.get(file_url)), 2)
+
+    def test_file_access(self, render):
+        file_url = self.generate()
+        self.assertNotIn("/media/", file_url)
+        self.client.force_login(User.objects.get(username="student"))
+        self.assertEqual(self.client.get(file_url).status_code, 403)
+
+    def test_file_owner(self, render):
+        # Only the user who asked for the file can download it, even with the classe access.
+        task_merge_classe_pdf(
+            [["other", 1234, {}]],
+            "task",
+            1,
+            User.objects.get(username="student").id,
+            {},
+            "testserver",
+            False,
+        )
+        self.assertEqual(self.client.get("/dossier_eleve/api/classe_pdf/task/").status_code, 404)
+
+    def test_missing_student_pdf(self, render):
+        # A student's PDF evicted from the cache before the merge is rendered again.
+        user = User.objects.get(username="director")
+        task_merge_classe_pdf(
+            [["evicted", 1234, {}], ["other", 1235, {}]],
+            "task",
+            1,
+            user.id,
+            {},
+            "testserver",
+            False,
+        )
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(self.get_pages(self.client.get("/dossier_eleve/api/classe_pdf/task/")), 2)
+
+    def test_expired_files(self, render):
+        old_file = default_storage.save(CLASSE_PDF_DIR + "old.pdf", ContentFile(b""))
+        old_time = time.time() - CLASSE_PDF_TIMEOUT - 60
+        os.utime(default_storage.path(old_file), (old_time, old_time))
+        self.generate()
+        self.assertFalse(default_storage.exists(old_file))
+
+    def test_cached(self, render):
+        self.generate()
+        self.generate()
+        self.assertEqual(render.call_count, 2)
+
+        # Only students with modified cases are rendered again.
+        self.cases[0].save()
+        self.generate()
+        self.assertEqual(render.call_count, 3)
+
+    def test_access(self, render):
+        self.client.force_login(User.objects.get(username="student"))
+        response = self.client.get("/dossier_eleve/api/classe_pdf/?classe=1")
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,85 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from core.models import StudentModel
+from core.settings_registry import settings_registry
+
+from dossier_eleve.models import CasEleve, SanctionStatisticsModel
+from dossier_eleve.statistics import gen_stats, gen_stats_by_student
+
+
+class StatisticsTests(TestCase):
+    fixtures = [
+        "test_dossier_eleve_users.json",
+        "test_dossier_eleve_settings_pyramid.json",
+        "dossier_eleve_sanctions.json",
+        "dossier_eleve_infos.json",
+    ]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        self.admin = User.objects.get(username="admin")
+        self.teacher = User.objects.get(username="teacher")
+        self.students = StudentModel.objects.order_by("matricule")
+
+        SanctionStatisticsModel.objects.create(display="Retenues").sanctions_decisions.set([2])
+        SanctionStatisticsModel.objects.create(display="Aucune")
+        SanctionStatisticsModel.objects.create(display="Midi").sanctions_decisions.set([1, 2])
+
+        for matricule, info, decision, done in [
+            (1234, None, 2, None),
+            (1234, None, 2, True),
+            (1234, None, 2, False),
+            (1234, None, 1, None),
+            (1234, 1, None, None),
+            (2222, None, 2, True),
+        ]:
+            CasEleve.objects.create(
+                student_id=matricule,
+                info_id=info,
+                sanction_decision_id=decision,
+                sanction_faite=done,
+                demandeur="Dupont Jean",
+            )
+
+    def test_gen_stats(self):
+        self.assertEqual(
+            gen_stats(self.admin, 1234),
+            [
+                {"display": "Retenues", "value": 2},
+                {"display": "Aucune", "value": 0},
+                {"display": "Midi", "value": 3},
+                {"display": "Non disciplinaire", "value": 1},
+                {"display": "Total disciplinaire", "value": 3},
+            ],
+        )
+        self.assertEqual(len(gen_stats(self.admin, 1234, only_sanctions=True)), 3)
+        # Teachers only count the cases of their classes.
+        self.assertEqual(gen_stats(self.teacher, 2222)[0]["value"], 0)
+
+    def test_gen_stats_by_student(self):
+        stats = gen_stats_by_student(self.admin, self.students)
+        self.assertEqual(list(stats), [1234, 2222, 9876])
+        for student in self.students:
+            self.assertEqual(stats[student.matricule], gen_stats(self.admin, student))
@@ -34,6 +34,8 @@ urlpatterns = [
     path("<int:year>/<int:month>/<int:day>/<str:file>", views.AttachmentView.as_view()),
     path("attachment/<int:pk>/", views.AttachmentView.as_view()),
     path("get_pdf/", views.CasElevePDFGenAPI.as_view()),
+    path("api/classe_pdf/", views.ClassePDFAPI.as_view()),
+    path("api/classe_pdf/<slug:task_id>/", views.ClassePDFFileAPI.as_view()),
     path("get_pdf_list/", views.CasEleveListPDFGen.as_view()),
     path("get_pdf_council/", views.AskSanctionCouncilPDFGenAPI.as_view()),
     path("get_pdf_retenues/", views.AskSanctionRetenuesPDFGenAPI.as_view()),
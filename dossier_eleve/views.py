@@ -24,12 +24,14 @@ from weasyprint import HTML
 
 from django.shortcuts import render
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, FileResponse
 from django.template.loader import get_template
 from django.template import Template, Context
 from django.conf import settings
 from django.db.models import Q
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.storage import default_storage
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.contrib.auth.models import Group
@@ -62,11 +64,17 @@ from core.email import send_email, get_resp_emails
 
 from .serializers import *
 from .models import *
-from .tasks import task_send_info_email, notify_sanction
+from .tasks import (
+    task_send_info_email,
+    notify_sanction,
+    task_classe_pdf,
+    get_classe_pdf_status_key,
+)
+from .statistics import gen_stats, gen_stats_by_student
 
 from z3c.rml import rml2pdf
 from io import BytesIO
-from PyPDF2 import PdfFileMerger
+from PyPDF2 import PdfMerger
 
 
 def get_menu_entry(active_app, request):
@@ -566,39 +574,7 @@ class StatisticAPI(APIView):
         return Response(json.dumps(stats))
 
     def gen_stats(self, user_from, student, only_sanctions=False, all_years=False):
-        all_access = get_settings().all_access.all()
-        queryset = CasEleve.objects.all()
-        if not user_from.groups.intersection(all_access).exists():
-            teachings = ResponsibleModel.objects.get(user=user_from).teaching.all()
-            classes = get_classes(list(map(lambda t: t.name, teachings)), True, user_from)
-            queryset = queryset.filter(student__classe__in=classes)
-
-        cas_discip = queryset.filter(info=None, student=student).filter(
-            Q(sanction_faite=True) | Q(sanction_faite__isnull=True)
-        )
-        cas_info = queryset.filter(sanction_decision=None, student=student)
-
-        if not all_years:
-            current_scolar_year = get_scholar_year()
-            limit_date = timezone.make_aware(timezone.datetime(current_scolar_year, 8, 15))
-            cas_discip = cas_discip.filter(datetime_encodage__gte=limit_date)
-            cas_info = cas_info.filter(datetime_encodage__gte=limit_date)
-
-        sanctions = SanctionStatisticsModel.objects.all()
-
-        stats = []
-        for s in sanctions:
-            stat = {
-                "display": s.display,
-                "value": len(cas_discip.filter(sanction_decision__in=s.sanctions_decisions.all())),
-            }
-            stats.append(stat)
-
-        if not only_sanctions:
-            stats.append({"display": "Non disciplinaire", "value": len(cas_info)})
-            stats.append({"display": "Total disciplinaire", "value": len(cas_discip)})
-
-        return stats
+        return gen_stats(user_from, student, only_sanctions=only_sanctions, all_years=all_years)
 
 
 class UploadFileView(BaseUploadFileView):
@@ -668,13 +644,16 @@ class CasElevePDFGenAPI(LoginRequiredMixin, PermissionRequiredMixin, WeasyTempla
             except ObjectDoesNotExist:
                 return HttpResponse("Vous n'avez pas les accès nécessaire.", status=401)
 
-            students = People().get_students_by_classe(classe)
-            merger = PdfFileMerger()
+            students = list(People().get_students_by_classe(classe))
+            statistics = gen_stats_by_student(
+                request.user, students, all_years=not request.GET.get("scholar_year", False)
+            )
+            merger = PdfMerger()
             added = False
             for s in students:
                 request.GET = request.GET.copy()
                 request.GET["student__matricule"] = s.matricule
-                student_context = self.generate_context(request)
+                student_context = self.generate_context(request, statistics[s.matricule])
                 if not student_context:
                     continue
                 student_response = self.render_to_response(student_context)
@@ -699,7 +678,7 @@ class CasElevePDFGenAPI(LoginRequiredMixin, PermissionRequiredMixin, WeasyTempla
             return self.render_to_response(context)
 
     @staticmethod
-    def generate_context(request):
+    def generate_context(request, statistics=None):
         if request.GET.get("classe"):
             request.GET.pop("classe")
         view_set = CasEleveViewSet.as_view({"get": "list"})
@@ -722,10 +701,10 @@ class CasElevePDFGenAPI(LoginRequiredMixin, PermissionRequiredMixin, WeasyTempla
         student = StudentModel.objects.get(matricule=request.GET["student__matricule"])
         check_student_photo(student)
 
-        all_years = not request.GET.get("scholar_year", False)
-        context = {
-            "statistics": StatisticAPI().gen_stats(request.user, student, all_years=all_years)
-        }
+        if statistics is None:
+            all_years = not request.GET.get("scholar_year", False)
+            statistics = gen_stats(request.user, student, all_years=all_years)
+        context = {"statistics": statistics}
         tenure = ResponsibleModel.objects.filter(tenure=student.classe).first()
         context["tenure"] = tenure.fullname if tenure else "—"
 
@@ -734,6 +713,54 @@ class CasElevePDFGenAPI(LoginRequiredMixin, PermissionRequiredMixin, WeasyTempla
         return context
 
 
+class ClassePDFAPI(APIView):
+    """Generate a classe's PDF in background, its url is sent to the websocket of the task."""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, format=None):
+        if not request.user.has_perm("dossier_eleve.view_caseleve"):
+            return Response(status=403)
+
+        classe_access = get_classes(get_settings().teachings.all(), True, request.user)
+        try:
+            classe = classe_access.get(id=request.GET.get("classe"))
+        except (ObjectDoesNotExist, ValueError):
+            return Response("Vous n'avez pas les accès nécessaire.", status=401)
+
+        params = request.GET.dict()
+        params.pop("classe")
+        task = task_classe_pdf.delay(
+            request.user.id, classe.id, params, request.get_host(), request.is_secure()
+        )
+        return Response(json.dumps(str(task)))
+
+
+class ClassePDFFileAPI(APIView):
+    """Serve a classe's PDF generated by ClassePDFAPI."""
+
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, task_id, format=None):
+        if not request.user.has_perm("dossier_eleve.view_caseleve"):
+            return Response(status=403)
+
+        status = cache.get(get_classe_pdf_status_key(task_id))
+        # Only the user who asked for the file can download it.
+        if not status or not status.get("file_name") or status.get("user_id") != request.user.id:
+            return Response(status=404)
+        classe_access = get_classes(get_settings().teachings.all(), True, request.user)
+        classe = classe_access.filter(id=status["classe_id"]).first()
+        if not classe:
+            return Response(status=404)
+
+        return FileResponse(
+            default_storage.open(status["file_name"]),
+            filename=classe.compact_str + ".pdf",
+            content_type="application/pdf",
+        )
+
+
 class AskSanctionsPDFGenAPI(APIView):
     permission_classes = (IsAuthenticated,)
     template = ""
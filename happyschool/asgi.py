@@ -44,6 +44,16 @@ if "schedule_change" in settings.INSTALLED_APPS:
 
     routes += patterns
 
+if "dossier_eleve" in settings.INSTALLED_APPS:
+    from dossier_eleve.routing import websocket_urlpatterns as patterns
+
+    routes += patterns
+
+if "lateness" in settings.INSTALLED_APPS:
+    from lateness.routing import websocket_urlpatterns as patterns
+
+    routes += patterns
+
 application = ProtocolTypeRouter(
     {
         "http": get_asgi_application(),
@@ -19,6 +19,8 @@
 
 import os
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -68,6 +70,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.QueryMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -307,6 +310,21 @@ CELERY_BROKER = "redis://localhost:6379"
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
+# Periodic tasks, run by the worker with its -B option.
+CELERYBEAT_SCHEDULE = {
+    # Refresh the imported calendars (in seconds).
+    "refresh-calendars": {"task": "core.tasks.task_refresh_calendars", "schedule": 60 * 20},
+    # Compute birthdays and the scholar calendar each day, just after midnight.
+    "precompute-widgets": {
+        "task": "core.tasks.task_precompute_widgets",
+        "schedule": crontab(minute=1, hour=0),
+    },
+    # Resume the notifications that could not be sent after their retries (in seconds).
+    "resume-notifications": {
+        "task": "mail_notification.tasks.task_resume_notifications",
+        "schedule": 60 * 30,
+    },
+}
 
 
 ASGI_APPLICATION = "happyschool.asgi.application"
@@ -320,6 +338,19 @@ CHANNEL_LAYERS = {
     },
 }
 
+# The cache must be shared by all the processes (daphne, celery) as cached data like access
+# scopes are invalidated through it.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://localhost:6379",
+    }
+}
+
+# Search people from an in-memory snapshot of the directory in each process: faster
+# autocomplete at the cost of some memory.
+ANNUAIRE_DIRECTORY_SNAPSHOT = False
+
 WEBPACK_LOADER = {
     "DEFAULT": {
         "BUNDLE_DIR_NAME": "bundles/",
@@ -329,6 +360,10 @@ WEBPACK_LOADER = {
 
 MAILGUN_KEY = "your-mailgun-key"
 SPARKPOST_KEY = "your-sparkpost-key"
+# Mail notifications are sent by SparkPost transmissions of up to MAIL_NOTIFICATION_BATCH_SIZE
+# recipients, at most MAIL_NOTIFICATION_RATE transmissions by second.
+MAIL_NOTIFICATION_BATCH_SIZE = 500
+MAIL_NOTIFICATION_RATE = 1
 
 EMAIL_ATTACHMENTS_SYNC = {
     "rsync_command": "/usr/bin/rsync -e ssh -avz --delete-after /home/user/happyschool/media/mail_notification happyschool@remote:/home/user/happyschool/media",
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class LatenessConfig(AppConfig):
     name = "lateness"
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,72 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import LatenessCounterModel, LatenessModel
+
+
+def get_count_start():
+    from .views import get_settings
+
+    return get_settings().date_count_start
+
+
+def is_counted(student_id, justified: bool, datetime_creation, count_start) -> bool:
+    return (
+        student_id is not None
+        and not justified
+        and timezone.localtime(datetime_creation).date() >= count_start
+    )
+
+
+def add_to_counter(student_id, delta: int) -> None:
+    """Change the counter of a student, in the current transaction."""
+    counters = LatenessCounterModel.objects.filter(student_id=student_id)
+    if counters.update(count=F("count") + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            LatenessCounterModel.objects.create(student_id=student_id, count=delta)
+    except IntegrityError:
+        # Created by a concurrent transaction.
+        counters.update(count=F("count") + delta)
+
+
+def rebuild_counters() -> int:
+    """Count again the latenesses of every student, after a change of the counting start.
+
+    :return: The number of counters.
+    """
+    counts = (
+        LatenessModel.objects.filter(
+            justified=False, student__isnull=False, datetime_creation__gte=get_count_start()
+        )
+        .order_by()
+        .values_list("student")
+        .annotate(count=Count("id"))
+    )
+    with transaction.atomic():
+        LatenessCounterModel.objects.all().delete()
+        counters = LatenessCounterModel.objects.bulk_create(
+            [LatenessCounterModel(student_id=s, count=c) for s, c in counts], batch_size=1000
+        )
+    return len(counters)
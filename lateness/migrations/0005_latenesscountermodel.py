@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2026-10-18 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_latenesses(apps, schema_editor):
+    LatenessModel = apps.get_model("lateness", "LatenessModel")
+    LatenessSettingsModel = apps.get_model("lateness", "LatenessSettingsModel")
+    LatenessCounterModel = apps.get_model("lateness", "LatenessCounterModel")
+    lateness_settings = LatenessSettingsModel.objects.first()
+    if not lateness_settings:
+        return
+    counts = (
+        LatenessModel.objects.filter(
+            justified=False,
+            student__isnull=False,
+            datetime_creation__gte=lateness_settings.date_count_start,
+        )
+        .order_by()
+        .values_list("student")
+        .annotate(count=models.Count("id"))
+    )
+    LatenessCounterModel.objects.bulk_create(
+        [LatenessCounterModel(student_id=s, count=c) for s, c in counts], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0024_changelogmodel"),
+        ("lateness", "0004_alter_latenesssettingsmodel_printer"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LatenessCounterModel",
+            fields=[
+                (
+                    "student",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="lateness_counter",
+                        serialize=False,
+                        to="core.studentmodel",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(count_latenesses, migrations.RunPython.noop),
+    ]
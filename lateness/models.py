@@ -95,7 +95,20 @@ class LatenessModel(models.Model):
 
     @property
     def lateness_count(self):
-        settings = LatenessSettingsModel.objects.first()
-        return LatenessModel.objects.filter(
-            student=self.student, justified=False, datetime_creation__gte=settings.date_count_start
-        ).count()
+        """Unjustified latenesses of the student since the counting start."""
+        try:
+            return self.student.lateness_counter.count
+        except (AttributeError, LatenessCounterModel.DoesNotExist):
+            return 0
+
+
+class LatenessCounterModel(models.Model):
+    """Count of the unjustified latenesses of a student since the counting start.
+
+    It is maintained by lateness.signals and rebuilt when the counting start changes.
+    """
+
+    student = models.OneToOneField(
+        StudentModel, on_delete=models.CASCADE, primary_key=True, related_name="lateness_counter"
+    )
+    count = models.PositiveIntegerField(default=0, db_index=True)
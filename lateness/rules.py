@@ -0,0 +1,211 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import threading
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import LatenessModel, SanctionTriggerModel
+
+# Rules are compiled again by each process once the triggers changed.
+RULES_VERSION_KEY = "lateness_rules_version"
+
+_compiled = {"version": None, "rules": None}
+_compiled_lock = threading.Lock()
+
+
+class Rule(NamedTuple):
+    """A compiled sanction trigger."""
+
+    id: Optional[int]
+    first: int
+    every: int
+    only_warn: bool
+    start: Optional[datetime.time]
+    stop: Optional[datetime.time]
+    next_week_day: Optional[int]
+    delay: Optional[int]
+    sanction_time: Optional[datetime.time]
+    sanction_id: Optional[int]
+
+    def in_window(self, time: datetime.time) -> bool:
+        if self.start is None and self.stop is None:
+            return True
+        if self.start is None or self.stop is None:
+            # An half open interval never matches.
+            return False
+        return self.start <= time < self.stop
+
+    def is_triggered(self, count: int) -> bool:
+        """The rule triggers at the first count, then every `every` latenesses."""
+        if count < self.first:
+            return False
+        if count == self.first:
+            return True
+        return self.every > 0 and (count - self.first) % self.every == 0
+
+    def get_sanction_date(self, today: datetime.datetime) -> datetime.datetime:
+        # next_week_day == 7 is the same day
+        if self.next_week_day < 7:
+            day_shift = 6 + self.next_week_day
+            day = today + datetime.timedelta(
+                days=(day_shift - today.isoweekday()) % (6 + self.delay) + 1
+            )
+        else:
+            day = today
+        return day.replace(hour=self.sanction_time.hour, minute=self.sanction_time.minute)
+
+
+class RuleSet:
+    """Rules indexed by teaching and year, and by teaching and classe."""
+
+    def __init__(self) -> None:
+        self.by_year = defaultdict(list)
+        self.by_classe = defaultdict(list)
+
+    def add(self, rule: Rule, teaching_id: int, years=(), classe_ids=()) -> None:
+        for year in years:
+            self.by_year[(teaching_id, year)].append(rule)
+        for classe_id in classe_ids:
+            self.by_classe[(teaching_id, classe_id)].append(rule)
+
+    def get_rules(self, teaching_id: int, year: int, classe_id: int) -> list:
+        rules = self.by_year.get((teaching_id, year), []) + self.by_classe.get(
+            (teaching_id, classe_id), []
+        )
+        # A trigger matching both the year and the classe applies once.
+        return list({id(rule): rule for rule in rules}.values())
+
+    def match(
+        self, teaching_id: int, year: int, classe_id: int, count: int, time: datetime.time
+    ) -> list:
+        """The rules triggered by the count of latenesses of a student at a given time."""
+        return [
+            rule
+            for rule in self.get_rules(teaching_id, year, classe_id)
+            if rule.in_window(time) and rule.is_triggered(count)
+        ]
+
+
+def make_rule(trigger, sanction_ids=None) -> Rule:
+    sanction_id = trigger.sanction_id
+    if sanction_ids is not None and sanction_id not in sanction_ids:
+        sanction_id = None
+    return Rule(
+        id=trigger.id,
+        first=trigger.lateness_count_trigger_first,
+        every=trigger.lateness_count_trigger,
+        # Without an existing sanction, the trigger can only warn.
+        only_warn=trigger.only_warn or sanction_id is None,
+        start=trigger.time_lateness_start,
+        stop=trigger.time_lateness_stop,
+        next_week_day=trigger.next_week_day,
+        delay=trigger.delay,
+        sanction_time=trigger.sanction_time,
+        sanction_id=sanction_id,
+    )
+
+
+def compile_rules() -> RuleSet:
+    """Load every trigger with two queries (and one for the sanctions)."""
+    triggers = list(SanctionTriggerModel.objects.prefetch_related("year", "classe"))
+    sanction_ids = set()
+    if "dossier_eleve" in settings.INSTALLED_APPS:
+        from dossier_eleve.models import SanctionDecisionDisciplinaire
+
+        sanction_ids = set(
+            SanctionDecisionDisciplinaire.objects.filter(
+                id__in=[t.sanction_id for t in triggers if t.sanction_id]
+            ).values_list("id", flat=True)
+        )
+
+    rules = RuleSet()
+    for trigger in triggers:
+        rules.add(
+            make_rule(trigger, sanction_ids),
+            trigger.teaching_id,
+            [y.year for y in trigger.year.all()],
+            [c.id for c in trigger.classe.all()],
+        )
+    return rules
+
+
+def get_rules() -> RuleSet:
+    """The compiled triggers, compiled again after any change of the triggers."""
+    version = cache.get(RULES_VERSION_KEY, 0)
+    if _compiled["version"] != version:
+        with _compiled_lock:
+            if _compiled["version"] != version:
+                _compiled["rules"] = compile_rules()
+                _compiled["version"] = version
+    return _compiled["rules"]
+
+
+def invalidate_rules() -> None:
+    try:
+        cache.incr(RULES_VERSION_KEY)
+    except ValueError:
+        # The version is unknown, any other value than the compiled one works.
+        cache.set(RULES_VERSION_KEY, timezone.now().timestamp(), None)
+
+
+def replay_latenesses(rules: list, count_start: datetime.date) -> list:
+    """Count how many times each rule would have been triggered since the counting start.
+
+    :param rules: Tuples of a rule, its teaching id, years and classe ids.
+    :return: For each rule, the number of sanctions (or warnings) and of students.
+    """
+    rule_set = RuleSet()
+    for rule, teaching_id, years, classe_ids in rules:
+        rule_set.add(rule, teaching_id, years, classe_ids)
+
+    latenesses = (
+        LatenessModel.objects.filter(
+            justified=False,
+            datetime_creation__gte=count_start,
+            student__classe__isnull=False,
+        )
+        .order_by("datetime_creation")
+        .values_list(
+            "student",
+            "student__teaching",
+            "student__classe__year",
+            "student__classe",
+            "datetime_creation",
+        )
+    )
+    counts = defaultdict(int)
+    triggered = defaultdict(int)
+    students = defaultdict(set)
+    for student, teaching_id, year, classe_id, datetime_creation in latenesses.iterator():
+        counts[student] += 1
+        time = timezone.localtime(datetime_creation).time()
+        for rule in rule_set.match(teaching_id, year, classe_id, counts[student], time):
+            triggered[id(rule)] += 1
+            students[id(rule)].add(student)
+
+    return [
+        {"sanctions": triggered[id(rule)], "students": len(students[id(rule)])}
+        for rule, *_ in rules
+    ]
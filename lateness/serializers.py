@@ -19,8 +19,8 @@
 
 from rest_framework import serializers
 
-from core.serializers import StudentSerializer, StudentModel
-from .models import LatenessSettingsModel, LatenessModel
+from core.serializers import EagerLoadingMixin, StudentSerializer, StudentModel
+from .models import LatenessSettingsModel, LatenessModel, SanctionTriggerModel
 
 
 class LatenessSettingsSerializer(serializers.ModelSerializer):
@@ -29,13 +29,20 @@ class LatenessSettingsSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class LatenessSerializer(serializers.ModelSerializer):
+class LatenessSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     # In order to write with the id and read the entire object, it uses two fields field + field_id.
     student = StudentSerializer(read_only=True)
     student_id = serializers.PrimaryKeyRelatedField(
         queryset=StudentModel.objects.all(), source="student", required=False, allow_null=True
     )
 
+    select_related_fields = ("student__lateness_counter",)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, prefix=""):
+        queryset = super().setup_eager_loading(queryset, prefix)
+        return StudentSerializer.setup_eager_loading(queryset, prefix + "student__")
+
     class Meta:
         model = LatenessModel
         fields = (
@@ -48,3 +55,9 @@ class LatenessSerializer(serializers.ModelSerializer):
             "justified",
             "has_sanction",
         )
+
+
+class SanctionTriggerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SanctionTriggerModel
+        fields = "__all__"
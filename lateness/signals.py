@@ -0,0 +1,89 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .counters import add_to_counter, get_count_start, is_counted
+from .models import LatenessModel, LatenessSettingsModel, SanctionTriggerModel
+from .rules import invalidate_rules
+from .tasks import task_rebuild_counters
+
+
+@receiver(post_init, sender=LatenessModel)
+def remember_counted_state(sender, instance, **kwargs):
+    instance._counted_state = (instance.student_id, instance.justified)
+
+
+@receiver(post_save, sender=LatenessModel)
+def update_counter(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    count_start = get_count_start()
+    was_counted = not created and is_counted(
+        *instance._counted_state, instance.datetime_creation, count_start
+    )
+    counted = is_counted(
+        instance.student_id, instance.justified, instance.datetime_creation, count_start
+    )
+    if was_counted and (not counted or instance._counted_state[0] != instance.student_id):
+        add_to_counter(instance._counted_state[0], -1)
+        was_counted = False
+    if counted and not was_counted:
+        add_to_counter(instance.student_id, 1)
+    instance._counted_state = (instance.student_id, instance.justified)
+
+
+@receiver(post_delete, sender=LatenessModel)
+def remove_from_counter(sender, instance, **kwargs):
+    # The saved state is the one counted.
+    student_id, justified = instance._counted_state
+    if is_counted(student_id, justified, instance.datetime_creation, get_count_start()):
+        add_to_counter(student_id, -1)
+
+
+@receiver(post_init, sender=LatenessSettingsModel)
+def remember_count_start(sender, instance, **kwargs):
+    instance._count_start = instance.date_count_start
+
+
+@receiver(post_save, sender=LatenessSettingsModel)
+def count_start_changed(sender, instance, created, raw=False, **kwargs):
+    if raw or created or instance.date_count_start == instance._count_start:
+        return
+    instance._count_start = instance.date_count_start
+    # Counters are rebuilt once the new counting start is committed.
+    transaction.on_commit(task_rebuild_counters.delay)
+
+
+@receiver([post_save, post_delete], sender=SanctionTriggerModel)
+@receiver(m2m_changed, sender=SanctionTriggerModel.year.through)
+@receiver(m2m_changed, sender=SanctionTriggerModel.classe.through)
+def triggers_changed(sender, action="post", **kwargs):
+    if action.startswith("post"):
+        transaction.on_commit(invalidate_rules)
+
+
+if "dossier_eleve" in settings.INSTALLED_APPS:
+    from dossier_eleve.models import SanctionDecisionDisciplinaire
+
+    post_save.connect(triggers_changed, sender=SanctionDecisionDisciplinaire)
+    post_delete.connect(triggers_changed, sender=SanctionDecisionDisciplinaire)
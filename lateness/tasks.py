@@ -0,0 +1,288 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import threading
+from collections import defaultdict
+
+from celery import chain, shared_task
+from escpos.exceptions import Error as EscposError
+from escpos.printer import Network, Dummy
+from unidecode import unidecode
+
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models import ObjectDoesNotExist
+from django.utils import timezone
+
+from core.email import get_resp_emails, send_email
+
+from .counters import rebuild_counters
+from .models import LatenessModel
+from .rules import get_rules
+
+# Printers' connections are kept open by the worker, one by printer address. Each printer
+# has its own lock, so that an unreachable printer does not block the other ones.
+_printers = {}
+_printers_locks = defaultdict(threading.Lock)
+_printers_locks_lock = threading.Lock()
+
+
+def _get_printer_lock(host: str) -> threading.Lock:
+    with _printers_locks_lock:
+        return _printers_locks[host]
+
+
+def get_status_group(user_id: int) -> str:
+    return "lateness_status_%i" % user_id
+
+
+def send_status(user_id: int, lateness_id: int, step: str, **status) -> None:
+    """Send the progress of a lateness' processing to the user that encoded it."""
+    async_to_sync(get_channel_layer().group_send)(
+        get_status_group(user_id),
+        {"type": "lateness.status", "lateness": lateness_id, "step": step, **status},
+    )
+
+
+def process_lateness(lateness: LatenessModel, user: User, printer: str = None) -> None:
+    """Print the ticket, apply the sanctions, notify and update absences in background."""
+    pipeline = chain(
+        task_print_ticket.si(lateness.id, user.id, printer),
+        task_evaluate_triggers.s(lateness.id, user.id),
+        task_notify_responsibles.s(lateness.id),
+        task_sync_absence.s(lateness.id, user.id),
+    )
+    transaction.on_commit(pipeline.delay)
+
+
+def write_ticket(printer, lateness: LatenessModel, lateness_count: int) -> None:
+    printer.charcode("CP437")
+    printer.set(align="center", bold=True)
+    printer.text("RETARD\n")
+    printer.set(align="left", bold=False)
+    absence_dt = lateness.datetime_creation.astimezone(timezone.get_default_timezone())
+
+    count_or_justified = "Retard justifié" if lateness.justified else "Nombre de retards: "
+    if not lateness.justified:
+        count_or_justified += "%i" % lateness_count
+
+    printer.text(
+        "\n%s %s\n%s\n%s\n%s\nBonne journée !"
+        % (
+            unidecode(lateness.student.last_name),
+            unidecode(lateness.student.first_name),
+            lateness.student.classe.compact_str,
+            absence_dt.strftime("%H:%M - %d/%m/%Y"),
+            count_or_justified,
+        )
+    )
+    printer.cut()
+
+
+def print_ticket(host: str, lateness: LatenessModel, lateness_count: int) -> bool:
+    """Print a lateness ticket, through the open connection to the printer if any.
+
+    :return: True if the ticket has been printed.
+    """
+    if settings.DEBUG:
+        printer = Dummy()
+        write_ticket(printer, lateness, lateness_count)
+        print(host, printer.output)
+        return True
+
+    with _get_printer_lock(host):
+        # The printer could have closed an idle connection, it is reopened once.
+        for _ in range(2):
+            printer = _printers.get(host)
+            if not printer:
+                printer = Network(host)
+                _printers[host] = printer
+            try:
+                write_ticket(printer, lateness, lateness_count)
+                return True
+            except (OSError, EscposError):
+                del _printers[host]
+                try:
+                    printer.close()
+                except (OSError, EscposError):
+                    pass
+    return False
+
+
+@shared_task
+def task_print_ticket(lateness_id: int, user_id: int, printer: str = None) -> int:
+    """Print the ticket of a lateness if asked.
+
+    :return: The number of latenesses of the student, passed to the next tasks.
+    """
+    lateness = LatenessModel.objects.select_related(
+        "student__classe", "student__lateness_counter"
+    ).get(id=lateness_id)
+    lateness_count = lateness.lateness_count
+    if printer:
+        printed = print_ticket(printer, lateness, lateness_count)
+        send_status(user_id, lateness_id, "print", success=printed)
+    return lateness_count
+
+
+def evaluate_triggers(lateness: LatenessModel, lateness_count: int, user: User) -> None:
+    """Apply the sanctions triggered by a lateness."""
+    student = lateness.student
+    if not student.classe:
+        return
+    time = timezone.localtime(lateness.datetime_creation).time()
+    rules = get_rules().match(
+        student.teaching_id, student.classe.year, student.classe_id, lateness_count, time
+    )
+    for rule in rules:
+        lateness.has_sanction = True
+        if rule.only_warn:
+            continue
+        from dossier_eleve.models import CasEleve
+
+        cas = CasEleve.objects.create(
+            student=student,
+            name=student.display,
+            demandeur=user.get_full_name(),
+            sanction_decision_id=rule.sanction_id,
+            explication_commentaire="Sanction pour cause de retard.",
+            sanction_faite=False,
+            date_sanction=rule.get_sanction_date(datetime.datetime.today()),
+            created_by=user,
+        )
+        cas.visible_by_groups.set(Group.objects.all())
+        lateness.sanction_id = cas.id
+    if rules:
+        lateness.save()
+
+
+@shared_task
+def task_evaluate_triggers(lateness_count: int, lateness_id: int, user_id: int) -> int:
+    lateness = LatenessModel.objects.select_related("student__classe").get(id=lateness_id)
+    evaluate_triggers(lateness, lateness_count, User.objects.get(id=user_id))
+    send_status(
+        user_id,
+        lateness_id,
+        "sanction",
+        has_sanction=lateness.has_sanction,
+        sanction_id=lateness.sanction_id,
+    )
+    return lateness_count
+
+
+@shared_task
+def task_notify_responsibles(lateness_count: int, lateness_id: int) -> int:
+    from .views import get_settings
+
+    if not get_settings().notify_responsible:
+        return lateness_count
+
+    lateness = LatenessModel.objects.select_related("student__classe").get(id=lateness_id)
+    context = {"lateness": lateness, "lateness_count": lateness_count}
+    send_email(
+        get_resp_emails(lateness.student),
+        "[Retard]%s  %s %s"
+        % (
+            "[Sanction]" if lateness.has_sanction else "",
+            lateness.student.fullname,
+            lateness.student.classe.compact_str,
+        ),
+        "lateness/lateness_email.html",
+        context=context,
+    )
+    return lateness_count
+
+
+def _get_period(time: datetime.time):
+    from student_absence_teacher.models import PeriodModel
+
+    try:
+        return PeriodModel.objects.get(start__lt=time, end__gte=time)
+    except ObjectDoesNotExist:
+        return None
+
+
+def _get_student_absence_teacher(lateness: LatenessModel, period):
+    from student_absence_teacher.models import StudentAbsenceTeacherModel
+
+    try:
+        return StudentAbsenceTeacherModel.objects.get(
+            date_absence=lateness.datetime_creation,
+            student=lateness.student,
+            period=period,
+        )
+    except ObjectDoesNotExist:
+        return None
+
+
+def update_student_absence_teacher(lateness: LatenessModel, time: datetime.time, user: User):
+    """Mark the student late in the attendances of the period."""
+    from student_absence_teacher.models import StudentAbsenceTeacherModel
+
+    period = _get_period(time)
+    if not period:
+        return
+    student_lateness = _get_student_absence_teacher(lateness, period)
+    if not student_lateness:
+        student_lateness = StudentAbsenceTeacherModel(
+            date_absence=lateness.datetime_creation,
+            student=lateness.student,
+            period=period,
+        )
+    # A student is late even if the roll call was taken before its arrival.
+    student_lateness.status = StudentAbsenceTeacherModel.LATENESS
+    student_lateness.comment = (
+        f"Retard à {time.strftime('%H:%M')} {'(justifié)' if lateness.justified else ''}"
+    )
+    student_lateness.user = user
+    student_lateness.save()
+
+
+def remove_student_absence_teacher(lateness: LatenessModel) -> None:
+    from student_absence_teacher.models import StudentAbsenceTeacherModel
+
+    period = _get_period(timezone.localtime(lateness.datetime_update).time())
+    if not period:
+        return
+    student_lateness = _get_student_absence_teacher(lateness, period)
+    if student_lateness and student_lateness.status == StudentAbsenceTeacherModel.LATENESS:
+        student_lateness.delete()
+
+
+@shared_task
+def task_sync_absence(lateness_count: int, lateness_id: int, user_id: int) -> None:
+    if "student_absence_teacher" not in settings.INSTALLED_APPS:
+        return
+    lateness = LatenessModel.objects.select_related("student").get(id=lateness_id)
+    update_student_absence_teacher(
+        lateness,
+        timezone.localtime(lateness.datetime_creation).time(),
+        User.objects.get(id=user_id),
+    )
+    send_status(user_id, lateness_id, "absence")
+
+
+@shared_task
+def task_rebuild_counters() -> int:
+    return rebuild_counters()
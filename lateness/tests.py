@@ -1,3 +1,266 @@
-from django.test import TestCase
+from datetime import date, datetime, time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from celery import current_app
+from channels.layers import get_channel_layer
+from escpos.printer import Dummy
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from core.models import StudentModel, YearModel
+from core.settings_registry import settings_registry
+from student_absence_teacher.models import PeriodModel, StudentAbsenceTeacherModel
+
+from .counters import rebuild_counters
+from .models import LatenessCounterModel, LatenessModel, LatenessSettingsModel, SanctionTriggerModel
+from .rules import get_rules, invalidate_rules
+from .tasks import _get_printer_lock, _printers, get_status_group, print_ticket
+
+
+class LatenessPipelineTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        # Run the pipeline in the test.
+        current_app.conf.update(task_always_eager=True, task_eager_propagates=True)
+        self.addCleanup(
+            current_app.conf.update, task_always_eager=False, task_eager_propagates=False
+        )
+        settings_registry.clear()
+        invalidate_rules()
+        self.user = User.objects.get(username="admin")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.student = StudentModel.objects.filter(classe__isnull=False).first()
+
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(
+            get_status_group(self.user.id), self.channel_name
+        )
+
+    def tearDown(self):
+        _printers.clear()
+
+    def receive_status(self) -> dict:
+        return async_to_sync(self.channel_layer.receive)(self.channel_name)
+
+    def test_create(self):
+        PeriodModel.objects.create(start=time(0, 0), end=time(23, 59, 59), name="Journée")
+        trigger = SanctionTriggerModel.objects.create(
+            teaching=self.student.teaching,
+            lateness_count_trigger_first=1,
+            lateness_count_trigger=1,
+            only_warn=True,
+        )
+        trigger.year.add(YearModel.objects.create(year=self.student.classe.year))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                "/lateness/api/lateness/", {"student_id": self.student.matricule}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        # Nothing else is done by the request.
+        lateness = LatenessModel.objects.get(id=response.json()["id"])
+        self.assertFalse(lateness.has_sanction)
+        self.assertFalse(StudentAbsenceTeacherModel.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        lateness.refresh_from_db()
+        self.assertTrue(lateness.has_sanction)
+        self.assertTrue(
+            StudentAbsenceTeacherModel.objects.filter(
+                student=self.student, status=StudentAbsenceTeacherModel.LATENESS
+            ).exists()
+        )
+        status = self.receive_status()
+        self.assertEqual(status["step"], "sanction")
+        self.assertTrue(status["has_sanction"])
+        self.assertEqual(self.receive_status()["step"], "absence")
+
+    def test_printer_connection(self):
+        lateness = LatenessModel.objects.create(student=self.student)
+        printer = Dummy()
+        with mock.patch("lateness.tasks.Network", return_value=printer) as network:
+            self.assertTrue(print_ticket("10.0.0.1", lateness, 1))
+            self.assertTrue(print_ticket("10.0.0.1", lateness, 2))
+        # The connection is kept open between tickets.
+        network.assert_called_once_with("10.0.0.1")
+        self.assertIn(b"RETARD", printer.output)
+
+        # A lost connection is reopened once.
+        closed = mock.Mock(spec=Dummy)
+        closed.charcode.side_effect = OSError
+        _printers["10.0.0.1"] = closed
+        with mock.patch("lateness.tasks.Network", return_value=Dummy()) as network:
+            self.assertTrue(print_ticket("10.0.0.1", lateness, 3))
+        network.assert_called_once()
+
+    @override_settings(DEBUG=False)
+    def test_printer_unavailable(self):
+        lateness = LatenessModel.objects.create(student=self.student)
+        with mock.patch(
+            "lateness.tasks.Network",
+            side_effect=lambda host: mock.Mock(spec=Dummy, charcode=mock.Mock(side_effect=OSError)),
+        ):
+            self.assertFalse(print_ticket("10.0.0.1", lateness, 1))
+        self.assertNotIn("10.0.0.1", _printers)
+
+    @override_settings(DEBUG=False)
+    def test_printer_stuck(self):
+        # A printer stuck connecting does not block the other printers.
+        lateness = LatenessModel.objects.create(student=self.student)
+        with _get_printer_lock("10.0.0.1"), mock.patch(
+            "lateness.tasks.Network", return_value=Dummy()
+        ):
+            self.assertTrue(print_ticket("10.0.0.2", lateness, 1))
+
+
+class LatenessCounterTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        settings_registry.clear()
+        self.students = list(StudentModel.objects.filter(classe__isnull=False)[:2])
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(username="admin"))
+
+    def get_count(self, student) -> int:
+        return LatenessModel(student=StudentModel.objects.get(pk=student.pk)).lateness_count
+
+    def test_maintained(self):
+        student, other = self.students
+        lateness = LatenessModel.objects.create(student=student)
+        LatenessModel.objects.create(student=student)
+        LatenessModel.objects.create(student=student, justified=True)
+        self.assertEqual(self.get_count(student), 2)
+
+        lateness.justified = True
+        lateness.save()
+        self.assertEqual(self.get_count(student), 1)
+        lateness.justified = False
+        lateness.save()
+        lateness.student = other
+        lateness.save()
+        self.assertEqual(self.get_count(student), 1)
+        self.assertEqual(self.get_count(other), 1)
+
+        LatenessModel.objects.filter(student=student).delete()
+        self.assertEqual(self.get_count(student), 0)
+
+    def test_rebuild(self):
+        student, other = self.students
+        old = LatenessModel.objects.create(student=student)
+        LatenessModel.objects.filter(id=old.id).update(datetime_creation="2019-01-01T08:00Z")
+        LatenessModel.objects.create(student=other)
+
+        lateness_settings = LatenessSettingsModel.objects.first()
+        lateness_settings.date_count_start = date(2018, 9, 1)
+        lateness_settings.save()
+        settings_registry.clear()
+        self.assertEqual(rebuild_counters(), 2)
+        self.assertEqual(
+            dict(LatenessCounterModel.objects.filter(count__gt=0).values_list("student", "count")),
+            {student.pk: 1, other.pk: 1},
+        )
+
+    @mock.patch("lateness.signals.task_rebuild_counters")
+    def test_count_start_changed(self, task):
+        # Saved outside of the API, like in the admin.
+        lateness_settings = LatenessSettingsModel.objects.create()
+        with self.captureOnCommitCallbacks(execute=True):
+            lateness_settings.save()
+        task.delay.assert_not_called()
+        lateness_settings.date_count_start = date(2018, 9, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            lateness_settings.save()
+            task.delay.assert_not_called()
+        task.delay.assert_called_once()
+        with self.captureOnCommitCallbacks(execute=True):
+            LatenessSettingsModel.objects.get(pk=lateness_settings.pk).save()
+        task.delay.assert_called_once()
+
+    def test_top_list(self):
+        for student in self.students:
+            LatenessModel.objects.create(student=student)
+        LatenessModel.objects.create(student=self.students[1])
+        self.client.get("/lateness/api/top_lateness")
+
+        # One joined query for the counters and their students.
+        with self.assertNumQueries(1):
+            response = self.client.get("/lateness/api/top_lateness")
+        self.assertEqual(
+            [(s["student"]["matricule"], s["count"]) for s in response.json()],
+            [(self.students[1].matricule, 2), (self.students[0].matricule, 1)],
+        )
+
+
+class RuleEngineTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        settings_registry.clear()
+        invalidate_rules()
+        self.student = StudentModel.objects.filter(classe__isnull=False).first()
+        self.trigger = SanctionTriggerModel.objects.create(
+            teaching=self.student.teaching,
+            lateness_count_trigger_first=3,
+            lateness_count_trigger=2,
+            only_warn=True,
+            time_lateness_start=time(8, 0),
+            time_lateness_stop=time(9, 0),
+        )
+        self.trigger.classe.add(self.student.classe)
+
+    def match(self, count, at=time(8, 5)) -> list:
+        classe = self.student.classe
+        return get_rules().match(self.student.teaching_id, classe.year, classe.id, count, at)
+
+    def test_match(self):
+        self.assertEqual([len(self.match(c)) for c in range(1, 8)], [0, 0, 1, 0, 1, 0, 1])
+        self.assertEqual(self.match(3, time(9, 0)), [])
+        # A trigger matching by year and classe applies once.
+        self.trigger.year.add(YearModel.objects.create(year=self.student.classe.year))
+        invalidate_rules()
+        self.assertEqual(len(self.match(3)), 1)
+
+    def test_compiled_once(self):
+        get_rules()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.match(3)), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trigger.lateness_count_trigger_first = 2
+            self.trigger.save()
+        self.assertEqual(len(self.match(2)), 1)
+
+    def test_dry_run(self):
+        for hour in (8, 8, 10, 8, 8, 8):
+            lateness = LatenessModel.objects.create(student=self.student)
+            LatenessModel.objects.filter(id=lateness.id).update(
+                datetime_creation=timezone.make_aware(datetime.combine(date.today(), time(hour)))
+            )
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(username="admin"))
+
+        response = client.post("/lateness/api/trigger_dry_run/", {}, format="json")
+        self.assertEqual(
+            response.json(), [{"trigger": self.trigger.id, "sanctions": 2, "students": 1}]
+        )
+
+        candidate = {
+            "teaching": self.student.teaching.id,
+            "lateness_count_trigger_first": 1,
+            "lateness_count_trigger": 1,
+            "classe": [self.student.classe.id],
+        }
+        response = client.post(
+            "/lateness/api/trigger_dry_run/", {"triggers": [candidate]}, format="json"
+        )
+        self.assertEqual(response.json(), [{"trigger": None, "sanctions": 6, "students": 1}])
@@ -27,6 +27,7 @@ from . import views
 urlpatterns = [
     path("", views.LatenessView.as_view(), name="lateness"),
     path("api/top_lateness", views.TopLatenessAPI.as_view()),
+    path("api/trigger_dry_run/", views.TriggerDryRunAPI.as_view()),
 ]
 
 router = DefaultRouter()
@@ -20,13 +20,9 @@
 import json
 import datetime
 
-from escpos.printer import Network, Dummy
-from unidecode import unidecode
-
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
 from django.views.generic import TemplateView
-from django.contrib.auth.models import Group
-from django.db.models import ObjectDoesNotExist, Count, Q
+from django.db.models import ObjectDoesNotExist
 from django.utils import timezone
 from django.conf import settings
 
@@ -38,15 +34,29 @@ from rest_framework.mixins import UpdateModelMixin
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from core.models import ResponsibleModel, TeachingModel, StudentModel
+from core.models import ResponsibleModel, TeachingModel
 from core.utilities import get_menu
-from core.views import BaseModelViewSet, BaseFilters
-from core.email import get_resp_emails, send_email
+from core.views import BaseModelViewSet, BaseFilters, get_app_settings
 from core.people import get_classes
 from core.serializers import StudentSerializer
 
-from .models import LatenessSettingsModel, LatenessModel, SanctionTriggerModel
-from .serializers import LatenessSettingsSerializer, LatenessSerializer
+from .models import (
+    LatenessSettingsModel,
+    LatenessModel,
+    LatenessCounterModel,
+    SanctionTriggerModel,
+)
+from .rules import make_rule, replay_latenesses
+from .serializers import (
+    LatenessSettingsSerializer,
+    LatenessSerializer,
+    SanctionTriggerSerializer,
+)
+from .tasks import (
+    process_lateness,
+    remove_student_absence_teacher,
+    update_student_absence_teacher,
+)
 
 
 def get_menu_entry(active_app, request):
@@ -60,16 +70,14 @@ def get_menu_entry(active_app, request):
     }
 
 
-def get_settings():
-    settings_lateness = LatenessSettingsModel.objects.first()
-    if not settings_lateness:
-        # Create default settings.
-        settings_lateness = LatenessSettingsModel.objects.create()
-        if TeachingModel.objects.count() == 1:
-            settings_lateness.teachings.add(TeachingModel.objects.first())
-        settings_lateness.save()
+def create_default_settings():
+    settings_lateness = LatenessSettingsModel.objects.create()
+    if TeachingModel.objects.count() == 1:
+        settings_lateness.teachings.add(TeachingModel.objects.first())
 
-    return settings_lateness
+
+def get_settings():
+    return get_app_settings(LatenessSettingsModel, create_default=create_default_settings)
 
 
 class LatenessView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
@@ -121,15 +129,7 @@ class LatenessFilter(BaseFilters):
         filter_overrides = BaseFilters.Meta.filter_overrides
 
     def count_lateness_by(self, queryset, field_name, value):
-        date_from = get_settings().date_count_start
-        counting = (
-            LatenessModel.objects.filter(justified=False, datetime_creation__gte=date_from)
-            .values("student")
-            .annotate(count_lateness=Count("student"))
-            .filter(count_lateness__gte=value)
-            .values_list("student", flat=True)
-        )
-        return LatenessModel.objects.filter(student__in=counting, justified=False)
+        return queryset.filter(student__lateness_counter__count__gte=value, justified=False)
 
     def date_lateness_by(self, queryset, field_name, value):
         if "gte" in field_name:
@@ -143,7 +143,7 @@ class LatenessFilter(BaseFilters):
 
 
 class LatenessViewSet(BaseModelViewSet):
-    queryset = LatenessModel.objects.all()
+    queryset = LatenessSerializer.setup_eager_loading(LatenessModel.objects.all())
     serializer_class = LatenessSerializer
     permission_classes = (
         IsAuthenticated,
@@ -156,184 +156,15 @@ class LatenessViewSet(BaseModelViewSet):
     filterset_class = LatenessFilter
     username_field = None
 
-    if "student_absence_teacher" in settings.INSTALLED_APPS:
-
-        def _get_student_absence_teacher(self, instance, time):
-            from student_absence_teacher.models import StudentAbsenceTeacherModel, PeriodModel
-
-            try:
-                period = PeriodModel.objects.get(start__lt=time, end__gte=time)
-            except ObjectDoesNotExist:
-                return
-
-            try:
-                return StudentAbsenceTeacherModel.objects.get(
-                    date_absence=instance.datetime_creation,
-                    student=instance.student,
-                    period=period,
-                    status=StudentAbsenceTeacherModel.LATENESS,
-                )
-            except ObjectDoesNotExist:
-                return None
-
-        def _update_student_absence_teacher(self, instance, time):
-            from student_absence_teacher.models import StudentAbsenceTeacherModel, PeriodModel
-
-            student_lateness = self._get_student_absence_teacher(instance, time)
-            if not student_lateness:
-                try:
-                    period = PeriodModel.objects.get(start__lt=time, end__gte=time)
-                except ObjectDoesNotExist:
-                    return
-
-                student_lateness = StudentAbsenceTeacherModel(
-                    date_absence=instance.datetime_creation,
-                    student=instance.student,
-                    period=period,
-                    status=StudentAbsenceTeacherModel.LATENESS,
-                    user=self.request.user,
-                )
-            student_lateness.comment = f"Retard à {time.time().strftime('%H:%M')} {'(justifié)' if instance.justified else ''}"
-            student_lateness.user = self.request.user
-            student_lateness.save()
-
-        def _remove_student_absence_teacher(self, instance):
-            from student_absence_teacher.models import StudentAbsenceTeacherModel
-
-            student_lateness = self._get_student_absence_teacher(
-                instance, instance.datetime_update.astimezone().time()
-            )
-            if student_lateness:
-                student_lateness.delete()
-
     def perform_create(self, serializer):
         lateness = serializer.save()
         printing = self.request.query_params.get("print", None)
-        printer = self.request.query_params.get("printer", 0)
-
-        lateness_settings = get_settings()
-
-        lateness_count = (
-            self.get_queryset()
-            .filter(
-                datetime_creation__gte=get_settings().date_count_start,
-                student=lateness.student,
-                justified=False,
-            )
-            .count()
-        )
-
-        if lateness_settings.printer and printing:
-            try:
-                if settings.DEBUG:
-                    print(printer)
-                printer = Network(printer) if not settings.DEBUG else Dummy()
-                printer.charcode("USA")
-                printer.set(align="CENTER", text_type="B")
-                printer.text("RETARD\n")
-                printer.set(align="LEFT")
-                absence_dt = lateness.datetime_creation.astimezone(timezone.get_default_timezone())
-
-                count_or_justified = (
-                    "Retard justifié" if lateness.justified else "Nombre de retards: "
-                )
-                if not lateness.justified:
-                    count_or_justified += "%i" % lateness_count
-
-                printer.text(
-                    "\n%s %s\n%s\n%s\n%s\nBonne journée !"
-                    % (
-                        unidecode(lateness.student.last_name),
-                        unidecode(lateness.student.first_name),
-                        lateness.student.classe.compact_str,
-                        absence_dt.strftime("%H:%M - %d/%m/%Y"),
-                        count_or_justified,
-                    )
-                )
-                if settings.DEBUG:
-                    print(printer.output)
-                printer.cut()
-                printer.close()
-            except OSError:
-                pass
+        printer = self.request.query_params.get("printer", None)
+        if not get_settings().printer or not printing:
+            printer = None
 
-        now = timezone.localtime()
-        # Trigger
-        for trigger in (
-            SanctionTriggerModel.objects.filter(teaching=lateness.student.teaching)
-            .filter(Q(year__year=lateness.student.classe.year) | Q(classe=lateness.student.classe))
-            .filter(
-                Q(
-                    time_lateness_start__isnull=False,
-                    time_lateness_stop__isnull=False,
-                    time_lateness_start__lte=now,
-                    time_lateness_stop__gt=now,
-                )
-                | Q(
-                    time_lateness_start__isnull=True,
-                    time_lateness_stop__isnull=True,
-                )
-            )
-            .distinct()
-        ):
-            count_first = trigger.lateness_count_trigger_first
-            count_trigger = trigger.lateness_count_trigger
-            if lateness_count < count_first or (
-                lateness_count > count_first and (lateness_count - count_first) % count_trigger != 0
-            ):
-                continue
-
-            lateness.has_sanction = True
-            if trigger.only_warn:
-                lateness.save()
-                continue
-            from dossier_eleve.models import CasEleve, SanctionDecisionDisciplinaire
-
-            sanction = SanctionDecisionDisciplinaire.objects.get(id=trigger.sanction_id)
-            today = datetime.datetime.today()
-            # next_week_day == 7 is the same day
-            if trigger.next_week_day < 7:
-                day_shift = 6 + trigger.next_week_day
-                day = today + datetime.timedelta(
-                    days=(day_shift - today.isoweekday()) % (6 + trigger.delay) + 1
-                )
-            else:
-                day = today
-            day = day.replace(hour=trigger.sanction_time.hour, minute=trigger.sanction_time.minute)
-
-            cas = CasEleve.objects.create(
-                student=lateness.student,
-                name=lateness.student.display,
-                demandeur=self.request.user.get_full_name(),
-                sanction_decision=sanction,
-                explication_commentaire="Sanction pour cause de retard.",
-                sanction_faite=False,
-                date_sanction=day,
-                created_by=self.request.user,
-            )
-            cas.visible_by_groups.set(Group.objects.all())
-            lateness.sanction_id = cas.id
-            lateness.save()
-
-        # Notification
-        if lateness_settings.notify_responsible:
-            responsibles = get_resp_emails(lateness.student)
-            context = {"lateness": lateness, "lateness_count": lateness_count}
-            send_email(
-                responsibles,
-                "[Retard]%s  %s %s"
-                % (
-                    "[Sanction]" if lateness.has_sanction else "",
-                    lateness.student.fullname,
-                    lateness.student.classe.compact_str,
-                ),
-                "lateness/lateness_email.html",
-                context=context,
-            )
-
-        # Student absence teacher.
-        if "student_absence_teacher" in settings.INSTALLED_APPS:
-            self._update_student_absence_teacher(lateness, now)
+        # Everything else is done in background, the status is sent through a websocket.
+        process_lateness(lateness, self.request.user, printer)
 
     def remove_sanction(self, instance):
         if instance.sanction_id:
@@ -348,7 +179,8 @@ class LatenessViewSet(BaseModelViewSet):
 
     def perform_destroy(self, instance):
         self.remove_sanction(instance)
-        self._remove_student_absence_teacher(instance)
+        if "student_absence_teacher" in settings.INSTALLED_APPS:
+            remove_student_absence_teacher(instance)
         super().perform_destroy(instance)
 
     def perform_update(self, serializer):
@@ -359,12 +191,59 @@ class LatenessViewSet(BaseModelViewSet):
         # Student absence teacher.
         if "student_absence_teacher" in settings.INSTALLED_APPS:
             # Take update time to show in student_absence_teacher comment
-            self._update_student_absence_teacher(instance, timezone.localtime())
+            update_student_absence_teacher(instance, timezone.localtime().time(), self.request.user)
 
     def get_group_all_access(self):
         return get_settings().all_access.all()
 
 
+class TriggerDryRunAPI(APIView):
+    """Count the sanctions that triggers would have given since the counting start.
+
+    Candidate triggers are posted as a list of triggers, without a list the current
+    triggers are replayed.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, format=None):
+        if not request.user.has_perm("lateness.view_sanctiontriggermodel"):
+            return Response(status=403)
+
+        candidates = request.data.get("triggers")
+        if candidates is None:
+            triggers = list(SanctionTriggerModel.objects.prefetch_related("year", "classe"))
+            rules = [
+                (
+                    make_rule(t),
+                    t.teaching_id,
+                    [y.year for y in t.year.all()],
+                    [c.id for c in t.classe.all()],
+                )
+                for t in triggers
+            ]
+        else:
+            serializer = SanctionTriggerSerializer(data=candidates, many=True)
+            serializer.is_valid(raise_exception=True)
+            triggers, rules = [], []
+            for data in serializer.validated_data:
+                years = data.pop("year", [])
+                classes = data.pop("classe", [])
+                trigger = SanctionTriggerModel(**data)
+                triggers.append(trigger)
+                rules.append(
+                    (
+                        make_rule(trigger),
+                        trigger.teaching_id,
+                        [y.year for y in years],
+                        [c.id for c in classes],
+                    )
+                )
+
+        results = replay_latenesses(rules, get_settings().date_count_start)
+        return Response([{"trigger": t.id, **r} for t, r in zip(triggers, results)])
+
+
 if "proeco" in settings.INSTALLED_APPS:
     from proeco.views import ExportStudentSelectionAPI
 
@@ -399,8 +278,7 @@ class TopLatenessAPI(APIView):
         if not request.user.has_perm("lateness.view_latenessmodel"):
             return Response([])
 
-        date_from = get_settings().date_count_start
-        latenesses = LatenessModel.objects.filter(justified=False, datetime_creation__gte=date_from)
+        counters = LatenessCounterModel.objects.filter(count__gt=0)
 
         own_classes = request.GET.get("own_classes", False)
         if own_classes:
@@ -410,20 +288,11 @@ class TopLatenessAPI(APIView):
                 tenure_class_only=True,
                 educ_by_years=True,
             ).values_list("id")
-            latenesses = latenesses.filter(student__classe__id__in=classes)
-        top_list = (
-            latenesses.values("student")
-            .annotate(count_lateness=Count("student"))
-            .order_by("-count_lateness")
-            .values_list("student", "count_lateness")[:50]
-        )
-
+            counters = counters.filter(student__classe__id__in=classes)
+        counters = StudentSerializer.setup_eager_loading(counters, prefix="student__")
         top_list = [
-            {
-                "student": StudentSerializer(StudentModel.objects.get(matricule=s[0])).data,
-                "count": s[1],
-            }
-            for s in top_list
+            {"student": StudentSerializer(c.student).data, "count": c.count}
+            for c in counters.order_by("-count")[:50]
         ]
 
         return Response(top_list)
@@ -25,6 +25,7 @@ from .models import (
     EmailAttachment,
     EmailSender,
     EmailNotificationSettingsModel,
+    EmailRecipient,
 )
 
 admin.site.register(EmailTag)
@@ -32,3 +33,4 @@ admin.site.register(EmailSender)
 admin.site.register(EmailNotification)
 admin.site.register(EmailAttachment)
 admin.site.register(EmailNotificationSettingsModel)
+admin.site.register(EmailRecipient)
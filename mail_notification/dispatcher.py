@@ -0,0 +1,201 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from core.email import SPARKPOST_TRANSMISSIONS_URL, get_sp_content
+
+from .models import EmailNotification, EmailRecipient
+
+# Placeholder of the answer form's uuid in notifications' body.
+ANSWER_PLACEHOLDER = "specific_uuid"
+
+
+class DispatchError(Exception):
+    """SparkPost could not be reached, pending recipients can be sent later."""
+
+
+def is_not_sent(err: requests.RequestException) -> bool:
+    """Whether a request failed before being sent, thus can safely be sent again."""
+    if isinstance(err, requests.ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    return isinstance(err, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class TokenBucket:
+    """Limit calls to rate by second, with bursts of up to capacity calls."""
+
+    def __init__(self, rate: float, capacity: int = 1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+
+    def acquire(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            self.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1
+            self.updated_at = self.clock()
+        self.tokens -= 1
+
+
+def get_session() -> requests.Session:
+    """A session keeping its connection to SparkPost, retrying when asked to slow down.
+
+    Transmissions are not idempotent, they are only sent again when SparkPost refused them
+    (429) or when the connection failed before sending them.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        other=0,
+        status_forcelist=[429],
+        allowed_methods=["POST"],
+        backoff_factor=2,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.headers["Authorization"] = settings.SPARKPOST_KEY
+    return session
+
+
+def create_recipients(email_notif: EmailNotification, recipients) -> None:
+    """Store the recipients of a notification, a list of (email, answer) tuples."""
+    seen = set()
+    email_recipients = []
+    for email, answer in recipients:
+        # Ignore empty and duplicated recipients.
+        if not email or (email, answer) in seen:
+            continue
+        seen.add((email, answer))
+        email_recipients.append(
+            EmailRecipient(notification=email_notif, email=email, answer=answer)
+        )
+    EmailRecipient.objects.bulk_create(email_recipients, batch_size=1000)
+
+
+class BulkDispatcher:
+    """Send the pending recipients of a notification by SparkPost transmissions.
+
+    Each transmission has up to batch_size recipients, with the uuid of their answer form as
+    substitution data. Statuses are saved after each transmission, thus a new dispatcher
+    resumes where an interrupted one stopped.
+    """
+
+    def __init__(
+        self,
+        email_notif: EmailNotification,
+        batch_size: int = None,
+        rate: float = None,
+        session: requests.Session = None,
+        dry_run: bool = False,
+    ) -> None:
+        self.email_notif = email_notif
+        self.batch_size = batch_size or getattr(settings, "MAIL_NOTIFICATION_BATCH_SIZE", 500)
+        self.bucket = TokenBucket(rate or getattr(settings, "MAIL_NOTIFICATION_RATE", 1))
+        self.session = session or get_session()
+        self.dry_run = dry_run
+
+    def get_transmission(self, recipients: list) -> dict:
+        body = "<html>%s</html>" % self.email_notif.body
+        transmission = get_sp_content(
+            self.email_notif.subject,
+            body.replace(ANSWER_PLACEHOLDER, "{{answer_uuid}}"),
+            self.email_notif.email_from,
+        )
+        transmission["recipients"] = [
+            {
+                "address": {"email": r.email},
+                "substitution_data": {
+                    "answer_uuid": str(r.answer_id) if r.answer_id else ANSWER_PLACEHOLDER
+                },
+            }
+            for r in recipients
+        ]
+        return transmission
+
+    @staticmethod
+    def set_error(recipient_ids: list, error: str) -> bool:
+        EmailRecipient.objects.filter(id__in=recipient_ids).update(
+            status=EmailRecipient.ERROR, error=error[:500]
+        )
+        return False
+
+    def send_batch(self, recipients: list) -> bool:
+        """Send a transmission and save its recipients' status.
+
+        A batch SparkPost may have received (timeout, server error) is not pending anymore.
+        """
+        recipient_ids = [r.id for r in recipients]
+        if not self.dry_run:
+            self.bucket.acquire()
+            try:
+                response = self.session.post(
+                    SPARKPOST_TRANSMISSIONS_URL,
+                    json=self.get_transmission(recipients),
+                    timeout=60,
+                )
+            except requests.RequestException as err:
+                if is_not_sent(err):
+                    raise DispatchError(str(err)) from err
+                # SparkPost may have accepted it, it must not be sent again.
+                return self.set_error(recipient_ids, "Unknown delivery: %s" % err)
+
+            if response.status_code == 429:
+                raise DispatchError("SparkPost responded %i" % response.status_code)
+            if response.status_code != 200:
+                return self.set_error(
+                    recipient_ids, "%i: %s" % (response.status_code, response.text)
+                )
+
+        EmailRecipient.objects.filter(id__in=recipient_ids).update(
+            status=EmailRecipient.SENT, error="", datetime_sent=timezone.now()
+        )
+        return True
+
+    def dispatch(self) -> dict:
+        """Send every pending recipient, return the number of recipients by status."""
+        pending = self.email_notif.recipients.filter(status=EmailRecipient.PENDING).order_by("id")
+        while True:
+            batch = list(pending[: self.batch_size])
+            if not batch:
+                break
+            self.send_batch(batch)
+
+        counts = dict(
+            self.email_notif.recipients.order_by().values_list("status").annotate(count=Count("id"))
+        )
+        return {status: counts.get(status, 0) for status, _ in EmailRecipient.STATUS_CHOICES}
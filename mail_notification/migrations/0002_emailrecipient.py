@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mail_answer", "0001_initial"),
+        ("mail_notification", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailRecipient",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("email", models.CharField(max_length=254)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "En attente"),
+                            ("sent", "Envoyé"),
+                            ("error", "Erreur"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("error", models.CharField(blank=True, max_length=500)),
+                (
+                    "datetime_sent",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Date et heure d'envoi"
+                    ),
+                ),
+                (
+                    "answer",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="mail_answer.mailanswermodel",
+                    ),
+                ),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="recipients",
+                        to="mail_notification.emailnotification",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="emailrecipient",
+            index=models.Index(
+                fields=["notification", "status"], name="mail_notifi_notific_067450_idx"
+            ),
+        ),
+    ]
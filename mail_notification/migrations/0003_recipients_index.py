@@ -0,0 +1,71 @@
+# Generated by Django 4.2 on 2026-10-18 17:28
+
+from django.db import migrations, models
+
+# Copies of mail_notification.recipients as they were when this migration was written.
+STAFF = "Personnels"
+
+
+def parse_keyword(keyword: str) -> tuple:
+    if not keyword:
+        return [], None
+    if keyword[0].isdigit():
+        if len(keyword) == 2:
+            return [int(keyword[0])], keyword[1].lower()
+        if "année" in keyword:
+            return [int(keyword[0])], None
+        degree = int(keyword[0])
+        return [degree * 2 - 1, degree * 2], None
+    if "supérieur" in keyword:
+        return [4, 5, 6], None
+    if "inférieur" in keyword:
+        return [1, 2, 3], None
+    if "Toutes les classes" in keyword:
+        return [1, 2, 3, 4, 5, 6], None
+    return [], None
+
+
+def index_recipients(apps, schema_editor):
+    EmailNotification = apps.get_model("mail_notification", "EmailNotification")
+    OtherEmailGroupModel = apps.get_model("mail_notification", "OtherEmailGroupModel")
+    ClasseModel = apps.get_model("core", "ClasseModel")
+    groups = set(OtherEmailGroupModel.objects.values_list("name", flat=True))
+    for email_notif in EmailNotification.objects.filter(to_type="teachers"):
+        keywords = email_notif.email_to.split(",")
+        if STAFF in keywords:
+            email_notif.to_staff = True
+            email_notif.save()
+
+        # Custom groups are not classes, even if named like a cycle.
+        for keyword in [k for k in keywords if k != STAFF and k not in groups]:
+            years, letter = parse_keyword(keyword)
+            if not years:
+                continue
+            classes = ClasseModel.objects.filter(
+                year__in=years, teaching__name=email_notif.teaching
+            )
+            if letter:
+                classes = classes.filter(letter=letter)
+            email_notif.classes.add(*classes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0021_people_search_names"),
+        ("mail_notification", "0002_emailrecipient"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailnotification",
+            name="classes",
+            field=models.ManyToManyField(blank=True, to="core.classemodel"),
+        ),
+        migrations.AddField(
+            model_name="emailnotification",
+            name="to_staff",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(index_recipients, migrations.RunPython.noop),
+    ]
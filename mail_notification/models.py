@@ -24,8 +24,8 @@ from time import strftime
 from django.db import models
 from django.contrib.auth.models import Group
 
-from core.models import EmailModel
-from mail_answer.models import MailTemplateModel
+from core.models import ClasseModel, EmailModel
+from mail_answer.models import MailTemplateModel, MailAnswerModel
 
 
 def unique_file_name(instance, filename):
@@ -81,6 +81,9 @@ class EmailNotification(models.Model):
     teaching = models.CharField(max_length=50)
     answers = models.ForeignKey(MailTemplateModel, on_delete=models.SET_NULL, null=True)
     datetime_created = models.DateTimeField("Date de création")
+    # Recipients index, resolved from email_to when sending.
+    classes = models.ManyToManyField(ClasseModel, blank=True)
+    to_staff = models.BooleanField(default=False)
 
     def __str__(self):
         return """
@@ -103,6 +106,35 @@ class EmailNotification(models.Model):
         permissions = (("access_mail_notification", "Can access to mail notification"),)
 
 
+class EmailRecipient(models.Model):
+    """A recipient of an email notification and its sending status."""
+
+    PENDING = "pending"
+    SENT = "sent"
+    ERROR = "error"
+    STATUS_CHOICES = [
+        (PENDING, "En attente"),
+        (SENT, "Envoyé"),
+        (ERROR, "Erreur"),
+    ]
+
+    notification = models.ForeignKey(
+        EmailNotification, on_delete=models.CASCADE, related_name="recipients"
+    )
+    email = models.CharField(max_length=254)
+    # The answer form of the recipient, if the notification has one.
+    answer = models.ForeignKey(MailAnswerModel, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.CharField(max_length=500, blank=True)
+    datetime_sent = models.DateTimeField("Date et heure d'envoi", null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["notification", "status"])]
+
+    def __str__(self):
+        return "%s (%s)" % (self.email, self.status)
+
+
 class OtherEmailGroupModel(models.Model):
     name = models.CharField(max_length=200)
 
@@ -0,0 +1,234 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from functools import reduce
+from operator import or_
+
+from unidecode import unidecode
+
+from django.db.models import Q, QuerySet
+
+from core.models import ClasseModel, EmailModel, ResponsibleModel, StudentModel
+from core.views import get_app_settings
+
+from mail_notification.models import (
+    EmailNotification,
+    EmailNotificationSettingsModel,
+    OtherEmailGroupModel,
+    OtherEmailModel,
+)
+
+CYCLES = ["Cycle inférieur", "Cycle supérieur"]
+DEGREES = ["1er degré", "2ème degré", "3ème degré"]
+YEARS = ["1ère année", "2ème année", "3ème année", "4ème année", "5ème année", "6ème année"]
+ALL_CLASSES = "Toutes les classes"
+STAFF = "Personnels"
+
+
+def parse_keyword(keyword: str) -> tuple:
+    """Parse a keyword related to classes.
+
+    :param keyword: A class, a year, a degree or a cycle (2B, 1ère année, 2ème degré,…).
+    :return: A tuple (years, letter), letter being None if the keyword is not a class.
+    """
+    if not keyword:
+        return [], None
+    # If it starts with a digit, it could be a class, a year or a degree.
+    if keyword[0].isdigit():
+        # Class length is only two.
+        if len(keyword) == 2:
+            return [int(keyword[0])], keyword[1].lower()
+        if "année" in keyword:
+            return [int(keyword[0])], None
+        # It is a degree.
+        degree = int(keyword[0])
+        return [degree * 2 - 1, degree * 2], None
+    # It is a cycle.
+    if "supérieur" in keyword:
+        return [4, 5, 6], None
+    if "inférieur" in keyword:
+        return [1, 2, 3], None
+    if ALL_CLASSES in keyword:
+        return [1, 2, 3, 4, 5, 6], None
+    return [], None
+
+
+class RecipientResolver:
+    """Resolve the keywords of a notification to emails with a few set-based queries.
+
+    The keywords are compiled into a single classe predicate, emails are then fetched with
+    joins instead of iterating over classes and students.
+    """
+
+    def __init__(
+        self,
+        email_to: str,
+        to_type: str,
+        teaching: str,
+        responsibles: bool = True,
+        all_parents: bool = False,
+    ):
+        self.to_type = to_type
+        self.teaching = teaching
+        self.responsibles = responsibles
+        self.all_parents = all_parents
+
+        keywords = [k for k in email_to.split(",") if k]
+        self.staff = False
+        self.groups = []
+        if to_type == "teachers":
+            self.staff = STAFF in keywords
+            keywords = [k for k in keywords if k != STAFF]
+            self.groups = list(
+                OtherEmailGroupModel.objects.filter(name__in=keywords).values_list(
+                    "name", flat=True
+                )
+            )
+            keywords = [k for k in keywords if k not in self.groups]
+
+        self.years = set()
+        self.classes = []
+        for keyword in keywords:
+            years, letter = parse_keyword(keyword)
+            self.years.update(years)
+            if letter:
+                self.classes.append((years[0], letter))
+            elif years:
+                self.classes += [(year, None) for year in years]
+
+    def get_classe_predicate(self, prefix: str = "") -> Q:
+        """A predicate matching the classes of the keywords, prefix being the path to the classe."""
+        whole_years = {year for year, letter in self.classes if not letter}
+        predicates = []
+        if whole_years:
+            predicates.append(Q(**{"%syear__in" % prefix: whole_years}))
+        predicates += [
+            Q(**{"%syear" % prefix: year, "%sletter" % prefix: letter})
+            for year, letter in self.classes
+            if letter and year not in whole_years
+        ]
+        if not predicates:
+            return None
+        return reduce(or_, predicates) & Q(**{"%steaching__name" % prefix: self.teaching})
+
+    def get_classes(self) -> QuerySet:
+        """The classes of the keywords."""
+        classe_predicate = self.get_classe_predicate()
+        if not classe_predicate:
+            return ClasseModel.objects.none()
+        return ClasseModel.objects.filter(classe_predicate)
+
+    def get_responsibles_emails(self) -> set:
+        """Emails of the responsibles (educators, coordinators,…) of the keywords' years."""
+        if not self.responsibles or not self.years:
+            return set()
+        return set(
+            EmailModel.objects.filter(years__in=self.years, teaching__name=self.teaching)
+            .values_list("email", flat=True)
+            .distinct()
+        )
+
+    def get_teachers_emails(self) -> set:
+        """Emails of the teachers of the classes, of the staff and of the custom groups."""
+        emails = self.get_responsibles_emails()
+
+        people = []
+        if self.staff:
+            people.append(Q(is_teacher=False, is_educator=False, is_secretary=False))
+        classe_predicate = self.get_classe_predicate("classe__")
+        if classe_predicate:
+            people.append(classe_predicate & Q(is_teacher=True))
+        if people:
+            use_email_school = get_app_settings(EmailNotificationSettingsModel).use_email_school
+            for email, email_school, is_teacher in (
+                ResponsibleModel.objects.filter(reduce(or_, people))
+                .values_list("email", "email_school", "is_teacher")
+                .distinct()
+            ):
+                emails.add(email_school if is_teacher and use_email_school else email)
+
+        if self.groups:
+            emails.update(
+                OtherEmailModel.objects.filter(group__name__in=self.groups).values_list(
+                    "email", flat=True
+                )
+            )
+        return emails
+
+    def get_students_emails(self) -> list:
+        """The students of the classes with their parents' emails, as (matricule, emails) tuples."""
+        classe_predicate = self.get_classe_predicate("classe__")
+        if not classe_predicate:
+            return []
+        if self.all_parents:
+            fields = ["additionalstudentinfo__mother_email", "additionalstudentinfo__father_email"]
+        else:
+            fields = ["additionalstudentinfo__resp_email"]
+        students = StudentModel.objects.filter(classe_predicate).values_list("matricule", *fields)
+        return [(matricule, sorted({e for e in emails if e})) for matricule, *emails in students]
+
+    def get_parents_emails(self) -> set:
+        """Emails of the parents of the classes' students."""
+        emails = self.get_responsibles_emails()
+        for _, parents_emails in self.get_students_emails():
+            emails.update(parents_emails)
+        return emails
+
+    def get_emails(self) -> set:
+        """All the emails of the notification recipients."""
+        if self.to_type == "teachers":
+            emails = self.get_teachers_emails()
+        elif self.to_type == "parents":
+            emails = self.get_parents_emails()
+        else:
+            return set()
+        emails.discard(None)
+        emails.discard("")
+        return emails
+
+
+def index_recipients(email_notif: EmailNotification):
+    """Store the classes and the staff reached by a notification."""
+    resolver = RecipientResolver(email_notif.email_to, email_notif.to_type, email_notif.teaching)
+    email_notif.to_staff = resolver.staff
+    email_notif.save()
+    email_notif.classes.set(resolver.get_classes())
+
+
+def get_keyword_options(teaching: str, to_type: str, query: str) -> list:
+    """Keywords that the resolver understands and that start with the (unaccented) query."""
+    if not query[0].isdigit():
+        options = CYCLES + [ALL_CLASSES]
+        if to_type == "teachers":
+            options.append(STAFF)
+            # Add custom groups
+            options += list(OtherEmailGroupModel.objects.values_list("name", flat=True))
+        return [o for o in options if unidecode(o).lower().startswith(query)]
+
+    options = [o for o in DEGREES + YEARS if unidecode(o).lower().startswith(query)]
+    classes = ClasseModel.objects.filter(year=query[0])
+    if teaching != "all":
+        classes = classes.filter(teaching__name=teaching)
+    if len(query) > 1:
+        classes = classes.filter(letter=query[1])
+    for year, letter in classes.order_by("year", "letter").values_list("year", "letter"):
+        classe = "%i%s" % (year, letter.upper())
+        if classe not in options:
+            options.append(classe)
+    return options
@@ -17,4 +17,345 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.test import TestCase
+from unittest import mock
+
+import requests
+from celery import current_app
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import (
+    AdditionalStudentInfo,
+    ClasseModel,
+    EmailModel,
+    ResponsibleModel,
+    StudentModel,
+    TeachingModel,
+    YearModel,
+)
+from core.settings_registry import settings_registry
+from mail_answer.models import MailAnswerModel, MailAnswerSettingsModel, MailTemplateModel
+
+from mail_notification.dispatcher import (
+    BulkDispatcher,
+    DispatchError,
+    TokenBucket,
+    create_recipients,
+    is_not_sent,
+)
+from mail_notification.models import (
+    EmailNotification,
+    EmailNotificationSettingsModel,
+    EmailRecipient,
+    OtherEmailGroupModel,
+    OtherEmailModel,
+)
+from mail_notification.recipients import (
+    RecipientResolver,
+    get_keyword_options,
+    index_recipients,
+    parse_keyword,
+)
+from mail_notification.tasks import (
+    get_emails,
+    get_settings,
+    task_resume_notifications,
+    task_send_emails_notif,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = "Error %i" % status_code
+
+
+class FakeSession:
+    """Record transmissions and answer with the given status codes."""
+
+    def __init__(self, status_codes):
+        self.status_codes = list(status_codes)
+        self.transmissions = []
+
+    def post(self, url, json, timeout):
+        self.transmissions.append(json)
+        status_code = self.status_codes.pop(0)
+        if isinstance(status_code, Exception):
+            raise status_code
+        return FakeResponse(status_code)
+
+
+class BulkDispatcherTest(TestCase):
+    def setUp(self):
+        self.email_notif = EmailNotification.objects.create(
+            email_to="1A",
+            to_type="parents",
+            email_from="Direction <direction@school.be>",
+            subject="Sujet",
+            body="<p>Répondez ici: https://school.be/mail_answer/answer/specific_uuid/</p>",
+            teaching="secondaire",
+            datetime_created=timezone.now(),
+        )
+        create_recipients(
+            self.email_notif,
+            [("parent%i@school.be" % i, None) for i in range(5)]
+            + [("parent0@school.be", None), ("", None)],
+        )
+
+    def dispatch(self, status_codes):
+        session = FakeSession(status_codes)
+        dispatcher = BulkDispatcher(self.email_notif, batch_size=2, rate=1000, session=session)
+        return dispatcher.dispatch(), session.transmissions
+
+    def test_batches(self):
+        counts, transmissions = self.dispatch([200, 200, 200])
+        self.assertEqual(counts, {"pending": 0, "sent": 5, "error": 0})
+        self.assertEqual([len(t["recipients"]) for t in transmissions], [2, 2, 1])
+        self.assertIn("{{answer_uuid}}", transmissions[0]["content"]["html"])
+        self.assertEqual(
+            transmissions[0]["recipients"][0],
+            {
+                "address": {"email": "parent0@school.be"},
+                "substitution_data": {"answer_uuid": "specific_uuid"},
+            },
+        )
+
+    def test_rejected_batch(self):
+        counts, _ = self.dispatch([200, 400, 200])
+        self.assertEqual(counts, {"pending": 0, "sent": 3, "error": 2})
+        self.assertEqual(
+            EmailRecipient.objects.filter(status=EmailRecipient.ERROR).first().error,
+            "400: Error 400",
+        )
+
+    def test_resume(self):
+        with self.assertRaises(DispatchError):
+            self.dispatch([200, 429])
+
+        # Only the recipients that were not sent are sent again.
+        counts, transmissions = self.dispatch([200, 200])
+        self.assertEqual(counts, {"pending": 0, "sent": 5, "error": 0})
+        self.assertEqual(
+            [r["address"]["email"] for t in transmissions for r in t["recipients"]],
+            ["parent2@school.be", "parent3@school.be", "parent4@school.be"],
+        )
+
+    def test_unknown_delivery(self):
+        # Batches SparkPost may have accepted are not sent again.
+        counts, transmissions = self.dispatch([503, requests.ReadTimeout("timeout"), 200])
+        self.assertEqual(counts, {"pending": 0, "sent": 1, "error": 4})
+        self.assertEqual(len(transmissions), 3)
+
+    def test_not_sent(self):
+        refused = requests.ConnectionError(
+            MaxRetryError(None, "/", NewConnectionError(None, "Connection refused"))
+        )
+        with self.assertRaises(DispatchError):
+            self.dispatch([200, refused])
+        self.assertEqual(
+            self.email_notif.recipients.filter(status=EmailRecipient.PENDING).count(), 3
+        )
+        self.assertFalse(is_not_sent(requests.ConnectionError("Connection reset")))
+
+    @override_settings(MAIL_NOTIFICATION_BATCH_SIZE=2, MAIL_NOTIFICATION_RATE=1000)
+    @mock.patch("mail_notification.tasks.subprocess.run")
+    def test_resume_stopped(self, _):
+        current_app.conf.update(task_always_eager=True, task_eager_propagates=True)
+        self.addCleanup(
+            current_app.conf.update, task_always_eager=False, task_eager_propagates=False
+        )
+        session = FakeSession([200, 429])
+        with mock.patch(
+            "mail_notification.dispatcher.get_session", return_value=session
+        ), self.assertRaises(DispatchError):
+            task_send_emails_notif.apply(
+                (self.email_notif.pk,), retries=task_send_emails_notif.max_retries
+            )
+        self.email_notif.refresh_from_db()
+        self.assertTrue(self.email_notif.errors.startswith("Stopped"))
+
+        # Only the notifications with pending recipients are resumed.
+        session = FakeSession([200, 200])
+        with mock.patch("mail_notification.dispatcher.get_session", return_value=session):
+            task_resume_notifications()
+            task_resume_notifications()
+        self.email_notif.refresh_from_db()
+        self.assertEqual(self.email_notif.errors, "Sent.")
+        self.assertEqual([len(t["recipients"]) for t in session.transmissions], [2, 1])
+
+
+class TokenBucketTest(TestCase):
+    def test_rate(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(delay):
+            sleeps.append(delay)
+            now[0] += delay
+
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+        for i in range(4):
+            bucket.acquire()
+        # The two first calls use the burst capacity, then one call every half second.
+        self.assertEqual(sleeps, [0.5, 0.5])
+
+
+class RecipientResolverTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        EmailNotificationSettingsModel.objects.create(use_email_school=True)
+        MailAnswerSettingsModel.objects.create()
+        teaching = TeachingModel.objects.create(name="secondaire", display_name="Secondaire")
+        other_teaching = TeachingModel.objects.create(name="primaire", display_name="Primaire")
+        classes = {
+            "1A": ClasseModel.objects.create(year=1, letter="a", teaching=teaching),
+            "1B": ClasseModel.objects.create(year=1, letter="b", teaching=teaching),
+            "4A": ClasseModel.objects.create(year=4, letter="a", teaching=teaching),
+            "1C": ClasseModel.objects.create(year=1, letter="c", teaching=other_teaching),
+        }
+        for matricule, classe in enumerate(["1A", "1A", "1B", "4A", "1C"]):
+            student = StudentModel.objects.create(
+                matricule=matricule,
+                first_name="Élève",
+                last_name=str(matricule),
+                teaching=classes[classe].teaching,
+                classe=classes[classe],
+            )
+            AdditionalStudentInfo.objects.create(
+                student=student,
+                mother_email="mother%i@school.be" % matricule,
+                # Siblings share their father.
+                father_email="father@school.be" if matricule < 2 else "",
+                resp_email="resp%i@school.be" % matricule,
+            )
+        # A student without additional info.
+        StudentModel.objects.create(
+            matricule=10,
+            first_name="Élève",
+            last_name="10",
+            teaching=teaching,
+            classe=classes["4A"],
+        )
+
+        for name, classe in [("1a", "1A"), ("4a", "4A"), ("1c", "1C")]:
+            teacher = ResponsibleModel.objects.create(
+                first_name=name,
+                last_name="Prof",
+                email="%s@home.be" % name,
+                email_school="%s@school.be" % name,
+                is_teacher=True,
+            )
+            teacher.classe.add(classes[classe])
+        ResponsibleModel.objects.create(
+            first_name="Staff", last_name="Staff", email="staff@school.be"
+        )
+        educator = EmailModel.objects.create(email="educ1@school.be", teaching=teaching)
+        educator.years.add(YearModel.objects.create(id=1, year=1))
+        group = OtherEmailGroupModel.objects.create(name="Direction")
+        OtherEmailModel.objects.create(
+            email="direction@school.be", last_name="D", first_name="D", group=group
+        )
+
+    def test_parse_keyword(self):
+        self.assertEqual(parse_keyword("2B"), ([2], "b"))
+        self.assertEqual(parse_keyword("3ème année"), ([3], None))
+        self.assertEqual(parse_keyword("2ème degré"), ([3, 4], None))
+        self.assertEqual(parse_keyword("Cycle supérieur"), ([4, 5, 6], None))
+        self.assertEqual(parse_keyword("Toutes les classes"), ([1, 2, 3, 4, 5, 6], None))
+        self.assertEqual(parse_keyword("Inconnu"), ([], None))
+
+    def test_teachers(self):
+        resolver = RecipientResolver("1A,Personnels,Direction", "teachers", "secondaire")
+        # Settings are kept in the settings registry.
+        get_settings()
+        with self.assertNumQueries(3):
+            emails = resolver.get_emails()
+        self.assertEqual(
+            emails,
+            {"1a@school.be", "staff@school.be", "direction@school.be", "educ1@school.be"},
+        )
+        resolver = RecipientResolver("Cycle supérieur", "teachers", "secondaire", False)
+        self.assertEqual(resolver.get_emails(), {"4a@school.be"})
+
+    def test_parents(self):
+        resolver = RecipientResolver(
+            "Toutes les classes", "parents", "secondaire", all_parents=True
+        )
+        with self.assertNumQueries(2):
+            emails = resolver.get_emails()
+        self.assertEqual(
+            emails,
+            {"educ1@school.be", "father@school.be"} | {"mother%i@school.be" % i for i in range(4)},
+        )
+        resolver = RecipientResolver("1B,4ème année", "parents", "secondaire", False)
+        self.assertEqual(resolver.get_emails(), {"resp2@school.be", "resp3@school.be"})
+
+    def test_template(self):
+        template = MailTemplateModel.objects.create(
+            name="Sortie", acknowledge=True, datetime_creation=timezone.now()
+        )
+        emails = get_emails("1A", "parents", "secondaire", template=template, all_parents=True)
+        self.assertEqual(MailAnswerModel.objects.filter(template=template).count(), 2)
+        # Each student's parents get the student's answer form.
+        self.assertEqual(len(emails), 5)
+        answers = {e: a for e, a in emails}
+        self.assertIsNone(answers["educ1@school.be"])
+        self.assertEqual(answers["mother0@school.be"].student_id, 0)
+        self.assertEqual(answers["mother1@school.be"].student_id, 1)
+
+    def test_keyword_options(self):
+        self.assertEqual(get_keyword_options("secondaire", "teachers", "d"), ["Direction"])
+        self.assertEqual(get_keyword_options("secondaire", "parents", "d"), [])
+        self.assertEqual(
+            get_keyword_options("secondaire", "parents", "1"),
+            ["1er degré", "1ère année", "1A", "1B"],
+        )
+        self.assertEqual(get_keyword_options("all", "parents", "1c"), ["1C"])
+
+
+class EmailNotificationViewSetTest(TestCase):
+    fixtures = ["test_dossier_eleve_users.json"]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        for email_to, teaching in [
+            ("1A", "secondaire"),
+            ("Personnels", "secondaire"),
+            ("1B,Direction", "secondaire"),
+            ("3ème année", "secondaire"),
+            ("3B", "primaire"),
+        ] + [("2ème degré,1er degré", "secondaire")] * 60:
+            email_notif = EmailNotification.objects.create(
+                email_to=email_to,
+                to_type="teachers",
+                email_from="direction@school.be",
+                subject=email_to,
+                body="",
+                teaching=teaching,
+                datetime_created=timezone.now(),
+            )
+            index_recipients(email_notif)
+
+    def get_subjects(self, username):
+        self.client.force_login(User.objects.get(username=username))
+        response = self.client.get("/mail_notification/api/notif/", {"page_size": 100})
+        self.assertEqual(response.status_code, 200)
+        return [n["subject"] for n in response.json()["results"]]
+
+    def test_visibility(self):
+        self.assertEqual(
+            self.get_subjects("teacher"),
+            ["2ème degré,1er degré"] * 60 + ["1B,Direction", "1A"],
+        )
+        # Educators reach the classes of their years.
+        self.assertEqual(self.get_subjects("educator"), self.get_subjects("teacher"))
+        self.assertEqual(
+            self.get_subjects("director"),
+            ["2ème degré,1er degré"] * 60 + ["1B,Direction", "Personnels", "1A"],
+        )
@@ -35,6 +35,11 @@ urlpatterns = [
         views.get_email_to_options,
         name="get_email_to_options",
     ),
+    path(
+        "api/recipients_preview/",
+        views.RecipientsPreviewAPI.as_view(),
+        name="recipients_preview",
+    ),
     path("get_tags_options/", views.get_tags_options, name="get_tags_options"),
     path("get_senders/<teaching>/", views.SendersList.as_view(), name="get_senders"),
     path("upload_file/", views.UploadFile.as_view(), name="attached_file"),
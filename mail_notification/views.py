@@ -38,7 +38,7 @@
 from core.people import get_classes
 import os
 import json
-from django.db.models.query import QuerySet
+from django.db.models import Q
 
 from unidecode import unidecode
 
@@ -59,11 +59,10 @@ from rest_framework.filters import SearchFilter
 
 from django_filters import rest_framework as filters
 
-from annuaire.views import create_classes_list
 from core.permissions import IsInGroupPermission
 from core.utilities import get_menu
-from core.views import LargePageSizePagination, PageNumberSizePagination
-from core.models import ResponsibleModel, TeachingModel, ClasseModel
+from core.views import LargePageSizePagination, PageNumberSizePagination, get_app_settings
+from core.models import ResponsibleModel, TeachingModel
 from mail_answer.models import MailTemplateModel
 from mail_answer.models import MailAnswerSettingsModel as AnswersSettings
 
@@ -83,12 +82,13 @@ from mail_notification.serializers import (
     OtherEmailSerializer,
     OtherEmailGroupSerializer,
 )
+from mail_notification.recipients import (
+    RecipientResolver,
+    get_keyword_options,
+    index_recipients,
+)
 from mail_notification.tasks import task_send_emails_notif
 
-CYCLES = ["Cycle inférieur", "Cycle supérieur"]
-DEGREES = ["1er degré", "2ème degré", "3ème degré"]
-YEARS = ["1ère année", "2ème année", "3ème année", "4ème année", "5ème année", "6ème année"]
-
 
 def get_menu_entry(active_app, request):
     if not request.user.has_perm("mail_notification.access_mail_notification"):
@@ -125,12 +125,7 @@ def get_list(request):
 
 
 def get_settings():
-    settings_email_notif = EmailNotificationSettingsModel.objects.first()
-    if not settings_email_notif:
-        # Create default settings.
-        settings_email_notif = EmailNotificationSettingsModel.objects.create().save()
-
-    return settings_email_notif
+    return get_app_settings(EmailNotificationSettingsModel)
 
 
 class HasPermissions(IsInGroupPermission):
@@ -176,88 +171,27 @@ class EmailNotificationViewSet(ReadOnlyModelViewSet):
         except ObjectDoesNotExist:
             return EmailNotification.objects.none()
 
-        raw_notif = EmailNotification.objects.filter(
-            to_type="teachers", teaching__in=responsible.teaching.values_list("name", flat=True)
-        ).order_by("-datetime_created")[:50]
-        filtered_notif = [
-            notif.id
-            for notif in raw_notif
-            if self.is_responsible_in_recipients(responsible, notif.email_to)
-        ]
-
-        return EmailNotification.objects.filter(id__in=filtered_notif).order_by("-datetime_created")
-
-    def is_responsible_in_recipients(
-        self, responsible: ResponsibleModel, email_to: str
-    ) -> QuerySet:
-        recipients = email_to.split(",")
-        for recipient in recipients:
-            # Check if it is the staff.
-            if recipient == "Personnels":
-                if (
-                    not responsible.is_teacher
-                    and not responsible.is_educator
-                    and not responsible.is_secretary
-                ):
-                    return True
-                else:
-                    continue
-
-            # Check if it is a custom group.
-            if OtherEmailGroupModel.objects.filter(name=recipient).exists():
-                continue
-
-            # So it is directly related to classes.
-            years = []
-            # If it starts with a digit, it could be a class, a year or a degree.
-            if recipient[0].isdigit():
-                # Class length is only two.
-                if len(recipient) == 2:
-                    classes = ClasseModel.objects.filter(
-                        year=int(recipient[0]),
-                        letter=recipient[1].lower(),
-                        teaching__in=responsible.teaching.all(),
-                    )
-                    years.append(int(recipient[0]))
-                elif "année" in recipient:
-                    classes = ClasseModel.objects.filter(
-                        year=int(recipient[0]),
-                        teaching__id__in=responsible.teaching.all().values_list("id", flat=True),
-                    )
-                    years.append(int(recipient[0]))
-                else:
-                    # It is a degrée.
-                    classes = ClasseModel.objects.filter(
-                        year__in=[int(recipient[0]) * 2, int(recipient[0]) * 2 - 1],
-                        teaching__id__in=responsible.teaching.all().values_list("id", flat=True),
-                    )
-                    degree = int(recipient[0])
-                    years += [degree * 2, degree * 2 - 1]
-            else:
-                # It is a cycle.
-                if "supérieur" in recipient:
-                    years += [4, 5, 6]
-                elif "inférieur" in recipient:
-                    years += [1, 2, 3]
-                elif "Toutes les classes" in recipient:
-                    years += [1, 2, 3, 4, 5, 6]
-                # elif "Tout le personnel" in recip:
-                #
-                else:
-                    years = []
-                classes = ClasseModel.objects.filter(
-                    year__in=years, teaching__in=responsible.teaching.all()
-                )
-
-            if (
-                get_classes(check_access=True, user=responsible.user, tenure_class_only=False)
-                .intersection(classes)
-                .exists()
-            ):
-                return True
-            else:
-                continue
-        return False
+        reached = Q(
+            classes__in=get_classes(
+                check_access=True, user=responsible.user, tenure_class_only=False
+            )
+        )
+        if (
+            not responsible.is_teacher
+            and not responsible.is_educator
+            and not responsible.is_secretary
+        ):
+            reached |= Q(to_staff=True)
+
+        return (
+            EmailNotification.objects.filter(
+                reached,
+                to_type="teachers",
+                teaching__in=responsible.teaching.values_list("name", flat=True),
+            )
+            .distinct()
+            .order_by("-datetime_created")
+        )
 
 
 class UploadFile(APIView):
@@ -351,6 +285,7 @@ class SendEmailsView(APIView):
 
         email_to_sent.body = template.render(context)
         email_to_sent.save()
+        index_recipients(email_to_sent)
 
         task = task_send_emails_notif.apply_async(
             countdown=5,
@@ -369,47 +304,22 @@ def get_email_to_options(request, teaching, to_type):
     if not query:
         return JsonResponse([], safe=False)
 
-    recipients = []
-    if not query[0].isdigit():
-        recipients += CYCLES
-        # Add static groups.
-        recipients.append("Toutes les classes")
-        if to_type == "teachers":
-            recipients.append("Personnels")
-            # Add custom groups
-            recipients += list(
-                map(lambda g: g["name"], OtherEmailGroupModel.objects.all().values("name"))
-            )
-        recipients = list(filter(lambda r: unidecode(r).lower().startswith(query), recipients))
-        return JsonResponse(recipients, safe=False)
-
-    recipients += DEGREES + YEARS
-    recipients = list(filter(lambda r: unidecode(r).lower().startswith(query), recipients))
-
-    if len(query) == 1:
-        recipients += map(
-            lambda c: c.split(" ")[0],
-            sorted(
-                create_classes_list(
-                    request, check_access=False, enseignement=teaching, annees=query[0]
-                )
-            ),
-        )
-    else:
-        recipients += map(
-            lambda c: c.split(" ")[0],
-            sorted(
-                create_classes_list(
-                    request,
-                    check_access=False,
-                    enseignement=teaching,
-                    annees=query[0],
-                    letters=query[1],
-                )
-            ),
-        )
+    return JsonResponse(get_keyword_options(teaching, to_type, query), safe=False)
+
 
-    return JsonResponse(recipients, safe=False)
+class RecipientsPreviewAPI(APIView):
+    """Preview the emails a notification would be sent to."""
+
+    permission_classes = (IsAuthenticated, HasPermissions)
+
+    def get(self, request, format=None):
+        email_to = request.GET.get("email_to", "")
+        to_type = request.GET.get("to_type", "")
+        teaching = request.GET.get("teaching", "")
+        responsibles = request.GET.get("responsibles", "true") == "true"
+        resolver = RecipientResolver(email_to, to_type, teaching, responsibles, all_parents=True)
+        emails = sorted(resolver.get_emails())
+        return Response({"count": len(emails), "emails": emails})
 
 
 @login_required
@@ -32,6 +32,11 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--nocourse", action="store_false")
         parser.add_argument("--people", action="store", default="all")
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Import people in bulk: fewer queries, one transaction.",
+        )
 
     def handle(self, *args, **options):
         proecos = settings.SYNC_FDB_SERVER
@@ -48,6 +53,7 @@ class Command(BaseCommand):
                 search_login_directory=settings.USE_LDAP_INFO,
                 classe_format=classe_format,
                 sync_course=options["nocourse"],
+                bulk_sync=options["bulk"],
             )
             importation_responsible = ImportResponsibleFDB(
                 teaching=teaching,
@@ -58,6 +64,7 @@ class Command(BaseCommand):
                 classe_format=classe_format,
                 username_attribute=username_attribute,
                 sync_course=options["nocourse"],
+                bulk_sync=options["bulk"],
             )
             if options["people"] == "all" or options["people"] == "student":
                 importation_student.sync()
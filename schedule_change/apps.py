@@ -20,5 +20,38 @@
 from django.apps import AppConfig
 
 
+def copy_to_remote() -> bool:
+    from schedule_change.views import get_settings
+
+    return get_settings().copy_to_remote
+
+
 class ScheduleChangeConfig(AppConfig):
     name = "schedule_change"
+
+    def ready(self):
+        from core.sync import register_sync_model
+        from .models import ScheduleChangeModel
+
+        # Changes are copied to the remote instance by the core change log.
+        register_sync_model(
+            "schedule_change",
+            ScheduleChangeModel,
+            [
+                "id",
+                "change",
+                "category",
+                "date_change",
+                "time_start",
+                "time_end",
+                "classes",
+                "teachers_replaced",
+                "teachers_substitute",
+                "place",
+                "comment",
+                "user",
+                "created_by",
+                "hide_for_students",
+            ],
+            is_enabled=copy_to_remote,
+        )
@@ -31,7 +31,7 @@ from django.core.files.storage import default_storage
 from core.models import ClasseModel, ResponsibleModel, TeachingModel
 from core.email import send_email
 
-from .views import get_core_settings
+from .views import get_core_settings, get_app_settings
 from .models import ScheduleChangeSettingsModel, ScheduleChangeModel, ScheduleChangeCategoryModel
 
 
@@ -107,12 +107,7 @@ def task_export(self, ids, date_from, date_to, send_to_teachers=False, message="
 
 
 def get_settings():
-    settings_schedule = ScheduleChangeSettingsModel.objects.first()
-    if not settings_schedule:
-        # Create default settings.
-        settings_schedule = ScheduleChangeSettingsModel.objects.create().save()
-
-    return settings_schedule
+    return get_app_settings(ScheduleChangeSettingsModel)
 
 
 def get_classes_from_display(flat_classes: str) -> QuerySet:
@@ -18,7 +18,6 @@
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
-import requests
 
 from z3c.rml import rml2pdf
 
@@ -221,8 +220,6 @@ class ScheduleChangeViewSet(BaseModelViewSet):
             email_replaced,
             "Nouveau changement",
         )
-        if get_settings().copy_to_remote:
-            self.copy_to_remote(requests.post, change.id)
 
     def perform_update(self, serializer):
         email_general = serializer.validated_data.pop("send_email_general")
@@ -239,27 +236,6 @@ class ScheduleChangeViewSet(BaseModelViewSet):
             email_replaced,
             "Changement modifié",
         )
-        if get_settings().copy_to_remote:
-            self.copy_to_remote(requests.put, change.id)
-
-    def perform_destroy(self, instance):
-        if get_settings().copy_to_remote:
-            self.copy_to_remote(requests.delete, instance.id)
-        super().perform_destroy(instance)
-
-    def copy_to_remote(self, method, id):
-        core_settings = get_core_settings()
-        remote_url = core_settings.remote
-        # Ensure a slash at the end.
-        if remote_url[-1] != "/":
-            remote_url += "/"
-        remote_url += "schedule_change/api/schedule_change/"
-        if method != requests.post:
-            remote_url += "%i/" % id
-        remote_token = core_settings.remote_token
-        headers = {"Authorization": "Token %s" % remote_token}
-        self.request.data["id"] = id
-        method(remote_url, headers=headers, json=self.request.data)
 
     def notify_email(
         self, change, email_general, email_educ, email_substitute, email_replaced, title
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class StudentAbsenceConfig(AppConfig):
     name = "student_absence"
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,182 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import PeriodModel
+
+PERIODS_KEY = "student_absence_periods"
+# Idle connections kept by server.
+POOL_SIZE = 4
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_periods() -> dict:
+    """Periods by id, with their ProEco index (their rank by start time)."""
+    periods = cache.get(PERIODS_KEY)
+    if periods is None:
+        periods = {p.id: (i, p) for i, p in enumerate(PeriodModel.objects.all().order_by("start"))}
+        cache.set(PERIODS_KEY, periods, None)
+    return periods
+
+
+def invalidate_periods() -> None:
+    cache.delete(PERIODS_KEY)
+
+
+def get_server(teaching_name: str) -> str:
+    servers = [s["server"] for s in settings.SYNC_FDB_SERVER if s["teaching_name"] == teaching_name]
+    return servers[0] if servers else None
+
+
+def _is_alive(cursor) -> bool:
+    try:
+        cursor.execute("SELECT 1 FROM RDB$DATABASE")
+        cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def _drop(cursor) -> None:
+    try:
+        cursor.connection.rollback()
+        cursor.connection.close()
+    except Exception:
+        pass
+
+
+def _acquire(server: str):
+    """A cursor from the pool, or a new one if the pool is empty or its connection is stale."""
+    from libreschoolfdb import absences
+
+    with _pool_lock:
+        idle = _pool.setdefault(server, [])
+        cursor = idle.pop() if idle else None
+    if cursor is not None and not _is_alive(cursor):
+        # The server could have closed an idle connection, a new one is opened once.
+        _drop(cursor)
+        cursor = None
+    if cursor is None:
+        cursor = absences._get_absence_cursor(fdb_server=server)
+    return cursor
+
+
+def _release(server: str, cursor) -> None:
+    with _pool_lock:
+        idle = _pool.setdefault(server, [])
+        if len(idle) < POOL_SIZE:
+            idle.append(cursor)
+            return
+    cursor.connection.close()
+
+
+@contextmanager
+def proeco_cursor(server: str):
+    """A cursor to a ProEco database, from a pool of open connections.
+
+    Writes are committed when leaving the context, the connection is then returned to the
+    pool. It is dropped on errors.
+    """
+    cursor = _acquire(server)
+    try:
+        yield cursor
+        cursor.connection.commit()
+    except Exception:
+        _drop(cursor)
+        raise
+    _release(server, cursor)
+
+
+def _write_absences(cursor, absences: list) -> list:
+    from libreschoolfdb import writer
+
+    periods = get_periods()
+    written = []
+    for absence in absences:
+        if writer.set_student_absence(
+            matricule=absence["student"].matricule,
+            day=absence["date_absence"],
+            period=periods[absence["period"].id][0],
+            is_absent=absence.get("is_absent", False),
+            cur=cursor,
+            commit=False,
+        ):
+            written.append(absence)
+    return written
+
+
+def write_absences(server: str, absences: list) -> list:
+    """Write absences to ProEco in one transaction.
+
+    :param absences: Validated absences (student, date_absence, period and is_absent).
+    :return: The absences ProEco accepted.
+    """
+    with proeco_cursor(server) as cursor:
+        return _write_absences(cursor, absences)
+
+
+class ProEcoWrites:
+    """Writes to ProEco databases, committed or rolled back together (see atomic_with_proeco)."""
+
+    def __init__(self) -> None:
+        self.cursors = {}
+
+    def write_absences(self, server: str, absences: list) -> list:
+        """Same as write_absences, without committing.
+
+        :return: The absences ProEco accepted.
+        """
+        if server not in self.cursors:
+            self.cursors[server] = _acquire(server)
+        return _write_absences(self.cursors[server], absences)
+
+    def commit(self) -> None:
+        for server, cursor in self.cursors.items():
+            cursor.connection.commit()
+            _release(server, cursor)
+        self.cursors = {}
+
+    def rollback(self) -> None:
+        for cursor in self.cursors.values():
+            _drop(cursor)
+        self.cursors = {}
+
+
+@contextmanager
+def atomic_with_proeco():
+    """An atomic block whose ProEco writes are only committed once the database's commit is.
+
+    If the block raises, ProEco writes are rolled back.
+    """
+    proeco = ProEcoWrites()
+    try:
+        with transaction.atomic():
+            yield proeco
+            transaction.on_commit(proeco.commit)
+    except Exception:
+        proeco.rollback()
+        raise
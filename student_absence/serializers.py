@@ -17,12 +17,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.conf import settings
-
 from rest_framework import serializers
 
 from core.serializers import StudentSerializer, StudentModel
 from . import models
+from .proeco import get_server, write_absences
 
 
 class StudentAbsenceSettingsSerializer(serializers.ModelSerializer):
@@ -49,6 +48,30 @@ class PeriodSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class PreloadedRelatedField(serializers.Field):
+    """Related object resolved from the objects given in the serializer's context.
+
+    Validating many rows then doesn't query each row's relations.
+    """
+
+    default_error_messages = {
+        "does_not_exist": 'Invalid pk "{pk_value}" - object does not exist.',
+    }
+
+    def __init__(self, context_key: str, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.context[self.context_key][int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail("does_not_exist", pk_value=data)
+
+    def to_representation(self, value):
+        return value.pk
+
+
 class StudentAbsenceSerializer(serializers.ModelSerializer):
     # In order to write with the id and read the entire object, it uses two fields field + field_id.
     student = StudentSerializer(read_only=True)
@@ -78,22 +101,21 @@ class StudentAbsenceSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def sync_proeco(absence: models.StudentAbsenceModel, is_absent):
-        from libreschoolfdb import writer
-
-        server = [
-            s["server"]
-            for s in settings.SYNC_FDB_SERVER
-            if s["teaching_name"] == absence.student.teaching.name
-        ]
-        if len(server) != 0:
-            periods = models.PeriodModel.objects.all().order_by("start")
-            period = [i for i, p in enumerate(periods) if p.id == absence.period.id][0]
-
-            return writer.set_student_absence(
-                matricule=absence.student.matricule,
-                day=absence.date_absence,
-                period=period,
-                is_absent=is_absent,
-                fdb_server=server[0],
-            )
+        server = get_server(absence.student.teaching.name)
+        if server:
+            absence_data = {
+                "student": absence.student,
+                "date_absence": absence.date_absence,
+                "period": absence.period,
+                "is_absent": is_absent,
+            }
+            return len(write_absences(server, [absence_data])) > 0
         return False
+
+
+class StudentAbsenceBulkSerializer(StudentAbsenceSerializer):
+    """Validate a whole roll, students and periods are given by the view's context."""
+
+    id = serializers.IntegerField(required=False)
+    student_id = PreloadedRelatedField("students", source="student")
+    period = PreloadedRelatedField("periods", required=False, allow_null=True)
@@ -1,3 +1,149 @@
-from django.test import TestCase
+import sys
+from datetime import date, time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+
+from rest_framework.test import APIClient
+
+from core.models import StudentModel
+from core.settings_registry import settings_registry
+
+from . import proeco
+from .models import PeriodModel, StudentAbsenceModel
+from .views import get_settings
+
+
+class StudentAbsenceBulkTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(username="admin"))
+        self.period = PeriodModel.objects.create(start=time(8, 15), end=time(9, 5), name="P1")
+        self.students = list(StudentModel.objects.order_by("matricule"))
+
+    def get_roll(self, students, day) -> list:
+        return [
+            {
+                "student_id": s.matricule,
+                "date_absence": day.isoformat(),
+                "period": self.period.id,
+                "is_absent": i % 2 == 0,
+            }
+            for i, s in enumerate(students)
+        ]
+
+    def post(self, rows):
+        return self.client.post(
+            "/student_absence/api/student_absence/bulk/?forceAllAccess=true", rows, format="json"
+        )
+
+    def test_constant_queries(self):
+        # Warm up the settings and the periods.
+        self.post(self.get_roll(self.students[:1], date(2021, 9, 1)))
+        # Students, then the insert in its transaction.
+        with self.assertNumQueries(4):
+            self.post(self.get_roll(self.students[:2], date(2021, 9, 2)))
+        with self.assertNumQueries(4):
+            response = self.post(self.get_roll(self.students[:30], date(2021, 9, 3)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 30)
+        absence = StudentAbsenceModel.objects.filter(date_absence=date(2021, 9, 3)).first()
+        self.assertEqual(absence.username, "admin")
+
+    def test_update(self):
+        response = self.post(self.get_roll(self.students[:3], date(2021, 9, 1)))
+        rows = response.json()
+        for row in rows:
+            row["is_absent"] = True
+        rows.append(self.get_roll(self.students[3:4], date(2021, 9, 1))[0])
+        response = self.post(rows)
+        self.assertEqual(response.status_code, 201)
+        absences = StudentAbsenceModel.objects.filter(date_absence=date(2021, 9, 1))
+        self.assertEqual(absences.count(), 4)
+        self.assertFalse(absences.filter(is_absent=False).exists())
+
+    def test_invalid(self):
+        rows = self.get_roll(self.students[:2], date(2021, 9, 1))
+        rows[1]["student_id"] = 123456789
+        response = self.post(rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("student_id", response.json()[1])
+        self.assertFalse(StudentAbsenceModel.objects.exists())
+
+    @override_settings(SYNC_FDB_SERVER=[])
+    def test_proeco_without_server(self):
+        absence_settings = get_settings()
+        absence_settings.sync_with_proeco = True
+        absence_settings.save()
+        settings_registry.clear()
+        response = self.post(self.get_roll(self.students[:2], date(2021, 9, 1)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.students[0].matricule), response.json()["student_id"][0])
+        self.assertFalse(StudentAbsenceModel.objects.exists())
+
+    def enable_proeco(self):
+        absence_settings = get_settings()
+        absence_settings.sync_with_proeco = True
+        absence_settings.save()
+        settings_registry.clear()
+        teachings = {s.teaching.name for s in self.students}
+        servers = [{"teaching_name": t, "server": "fdb"} for t in teachings]
+        self.enterContext(override_settings(SYNC_FDB_SERVER=servers))
+        self.enterContext(mock.patch.dict(proeco._pool, clear=True))
+        self.fdb = mock.MagicMock()
+        self.fdb.writer.set_student_absence.return_value = True
+        self.enterContext(
+            mock.patch.dict(
+                sys.modules,
+                {
+                    "libreschoolfdb": self.fdb,
+                    "libreschoolfdb.absences": self.fdb.absences,
+                    "libreschoolfdb.writer": self.fdb.writer,
+                },
+            )
+        )
+        return self.fdb.absences._get_absence_cursor.return_value
+
+    def test_proeco_committed_after_save(self):
+        cursor = self.enable_proeco()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post(self.get_roll(self.students[:2], date(2021, 9, 1)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.fdb.writer.set_student_absence.call_count, 2)
+        # Not committed before the database is.
+        cursor.connection.commit.assert_not_called()
+        for callback in callbacks:
+            callback()
+        cursor.connection.commit.assert_called_once()
+        self.assertEqual(proeco._pool["fdb"], [cursor])
+
+    def test_proeco_rolled_back(self):
+        cursor = self.enable_proeco()
+        with mock.patch.object(
+            StudentAbsenceModel.objects, "bulk_create", side_effect=IntegrityError
+        ), self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError):
+                self.post(self.get_roll(self.students[:2], date(2021, 9, 1)))
+        cursor.connection.commit.assert_not_called()
+        cursor.connection.rollback.assert_called_once()
+        self.assertEqual(proeco._pool["fdb"], [])
+
+    def test_proeco_stale_connection(self):
+        cursor = self.enable_proeco()
+        stale = mock.MagicMock()
+        stale.execute.side_effect = Exception("connection shutdown")
+        proeco._pool["fdb"] = [stale]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post(self.get_roll(self.students[:2], date(2021, 9, 1)))
+        self.assertEqual(response.status_code, 201)
+        stale.connection.close.assert_called_once()
+        self.fdb.absences._get_absence_cursor.assert_called_once_with(fdb_server="fdb")
+        cursor.connection.commit.assert_called_once()
+        self.assertEqual(proeco._pool["fdb"], [cursor])
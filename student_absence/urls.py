@@ -31,6 +31,11 @@ urlpatterns = [
     path("", views.StudentAbsenceView.as_view(), name="student_absence"),
     path("api/absence_count/", views.AbsenceCountAPI.as_view(), name="absence_count"),
     path("api/students_classes/", SearchPeopleAPI.as_view()),
+    path(
+        "api/student_absence/bulk/",
+        views.StudentAbsenceViewSet.as_view({"post": "bulk"}),
+        name="student_absence_bulk",
+    ),
 ]
 
 router = DefaultRouter()
@@ -18,7 +18,9 @@
 # along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+from collections import defaultdict
 
+from django.db import transaction
 from django.db.models import (
     IntegerField,
     Sum,
@@ -40,6 +42,7 @@ from django.utils import timezone
 from django_filters import rest_framework as filters
 
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
@@ -49,6 +52,7 @@ from rest_framework.filters import OrderingFilter
 from core.utilities import get_menu, get_scholar_year
 from core.people import get_classes
 from core.models import ResponsibleModel, StudentModel
+from core.serializers import StudentSerializer
 from core.views import BaseFilters, PageNumberSizePagination, get_app_settings, get_core_settings
 
 from .models import (
@@ -58,9 +62,11 @@ from .models import (
     ClasseNoteModel,
     PeriodModel,
 )
+from .proeco import atomic_with_proeco, get_periods, get_server
 from .serializers import (
     StudentAbsenceSettingsSerializer,
     StudentAbsenceSerializer,
+    StudentAbsenceBulkSerializer,
     JustificationSerializer,
     ClasseNoteSerializer,
     PeriodSerializer,
@@ -170,7 +176,6 @@ class StudentAbsenceViewSet(ModelViewSet):
         "student__first_name",
         "period__start",
     ]
-    cursor = None
 
     def get_queryset(self):
         filtering = get_settings().filter_students_for_educ
@@ -185,61 +190,108 @@ class StudentAbsenceViewSet(ModelViewSet):
         return self.queryset.filter(student__classe__in=classes)
 
     def create(self, request, *args, **kwargs):
-        if isinstance(request.data, list) and len(request.data) == 0:
-            return Response(status=status.HTTP_201_CREATED)
-
-        if get_settings().sync_with_proeco:
-            from libreschoolfdb import absences
-
-            first_absence = request.data[0] if isinstance(request.data, list) else request.data
-            teaching_name = StudentModel.objects.get(
-                matricule=first_absence.get("student_id")
-            ).teaching.name
-
-            server = [
-                s["server"] for s in settings.SYNC_FDB_SERVER if s["teaching_name"] == teaching_name
-            ]
-            if len(server) == 0:
-                raise
-            self.cursor = absences._get_absence_cursor(fdb_server=server[0])
-
-        # if isinstance(request.data, list) and len(request.data) > 0:
-        absences_done = []
-        for absence in request.data:
-            serializer = self.get_serializer(data=absence)
-            serializer.is_valid(raise_exception=True)
+        return self.bulk(request, *args, **kwargs)
+
+    def bulk(self, request, *args, **kwargs):
+        """Save the absences of a roll at once, rows with an id update an absence.
+
+        Queries don't depend on the number of rows.
+        """
+        rows = request.data if isinstance(request.data, list) else [request.data]
+        if len(rows) == 0:
+            return Response([], status=status.HTTP_201_CREATED)
+
+        matricules = set()
+        for row in rows:
+            try:
+                matricules.add(int(row.get("student_id")))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        context = self.get_serializer_context()
+        context["students"] = StudentSerializer.setup_eager_loading(
+            StudentModel.objects.all()
+        ).in_bulk(matricules)
+        context["periods"] = {pk: period for pk, (_, period) in get_periods().items()}
+        serializer = StudentAbsenceBulkSerializer(data=rows, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data
+
+        existing = self.get_queryset().in_bulk([row["id"] for row in rows if "id" in row])
+        if any("id" in row and row["id"] not in existing for row in rows):
+            raise NotFound()
+
+        # ProEco writes are only committed once the absences are saved.
+        with atomic_with_proeco() as proeco:
             if get_settings().sync_with_proeco:
-                if not self.sync_proeco(serializer.validated_data):
-                    continue
-
-            # Save object and add user/username.
-            abs_object = serializer.save()
-            abs_object.user = request.user
-            abs_object.username = request.user.username
-            abs_object.save()
-
-            absences_done.append(serializer.data)
-        if get_settings().sync_with_proeco:
-            self.cursor.connection.commit()
-            self.cursor.connection.close()
-        return Response(absences_done, status=status.HTTP_201_CREATED)
-
-    def sync_proeco(self, data: dict):
-        from libreschoolfdb import writer
-
-        if self.cursor:
-            periods = PeriodModel.objects.all().order_by("start")
-            period = [i for i, p in enumerate(periods) if p.id == data.get("period", None).id][0]
-
-            return writer.set_student_absence(
-                matricule=data.get("student").matricule,
-                day=data.get("date_absence"),
-                period=period,
-                is_absent=data.get("is_absent", False),
-                cur=self.cursor,
-                commit=False,
+                rows = self.sync_proeco(rows, proeco)
+
+            now = timezone.now()
+            to_create, to_update = [], []
+            for row in rows:
+                absence = existing.get(row.pop("id", None))
+                if absence:
+                    for field, value in row.items():
+                        setattr(absence, field, value)
+                    absence.datetime_update = now
+                    to_update.append(absence)
+                else:
+                    absence = StudentAbsenceModel(
+                        **row, user=request.user, username=request.user.username
+                    )
+                    to_create.append(absence)
+
+            StudentAbsenceModel.objects.bulk_create(to_create)
+            StudentAbsenceModel.objects.bulk_update(
+                to_update,
+                [
+                    "student",
+                    "date_absence",
+                    "period",
+                    "is_absent",
+                    "is_processed",
+                    "datetime_update",
+                ],
             )
-        return False
+            if "student_absence_teacher" in settings.INSTALLED_APPS:
+                # Bulk queries do not send signals, cached overviews are invalidated here.
+                from student_absence_teacher.overview import invalidate_overview
+
+                dates = {a.date_absence for a in to_create + to_update}
+                transaction.on_commit(lambda: [invalidate_overview(d) for d in dates])
+
+        return Response(
+            StudentAbsenceSerializer(to_create + to_update, many=True).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    def sync_proeco(self, rows: list, proeco) -> list:
+        """Write the absences to the ProEco database of their teaching.
+
+        :return: The absences ProEco accepted.
+        """
+        by_server = defaultdict(list)
+        without_server = set()
+        for row in rows:
+            server = get_server(row["student"].teaching.name)
+            if server:
+                by_server[server].append(row)
+            else:
+                without_server.add(row["student"].matricule)
+        if without_server:
+            # Nothing is written, the roll must not be partially saved.
+            raise ValidationError(
+                {
+                    "student_id": [
+                        "Pas de serveur ProEco pour l'enseignement de: %s"
+                        % ", ".join(map(str, sorted(without_server)))
+                    ]
+                }
+            )
+
+        written = []
+        for server, server_rows in by_server.items():
+            written += proeco.write_absences(server, server_rows)
+        return written
 
 
 if "proeco" in settings.INSTALLED_APPS:
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class StudentAbsenceTeacherConfig(AppConfig):
     name = "student_absence_teacher"
+
+    def ready(self):
+        from . import signals
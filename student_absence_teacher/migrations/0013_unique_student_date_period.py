@@ -0,0 +1,44 @@
+# Generated by Django 4.2 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    StudentAbsenceTeacherModel = apps.get_model(
+        "student_absence_teacher", "StudentAbsenceTeacherModel"
+    )
+    duplicates = (
+        StudentAbsenceTeacherModel.objects.filter(period__isnull=False)
+        .values("student", "date_absence", "period")
+        .annotate(count=models.Count("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        rows = StudentAbsenceTeacherModel.objects.filter(
+            student=duplicate["student"],
+            date_absence=duplicate["date_absence"],
+            period=duplicate["period"],
+        )
+        # Keep an absence or a lateness over a presence, then the last updated row.
+        keep = max(
+            rows.values_list("id", "status", "datetime_update"),
+            key=lambda r: (r[1] != "presence", r[2]),
+        )
+        rows.exclude(id=keep[0]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("student_absence_teacher", "0012_periodmodel_day_of_week"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="studentabsenceteachermodel",
+            constraint=models.UniqueConstraint(
+                fields=("student", "date_absence", "period"), name="unique_student_date_period"
+            ),
+        ),
+    ]
@@ -88,5 +88,14 @@ class StudentAbsenceTeacherModel(models.Model):
         "Date et heure de mise à jour de l'absence", auto_now=True
     )
 
+    class Meta:
+        constraints = [
+            # One status by student and period, roll calls update it.
+            models.UniqueConstraint(
+                fields=["student", "date_absence", "period"],
+                name="unique_student_date_period",
+            )
+        ]
+
     def __str__(self):
         return f"{self.date_absence} ({self.period.name}): {self.student} ({self.status})"
@@ -0,0 +1,183 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from core.models import ClasseModel
+
+from .models import PeriodModel, StudentAbsenceTeacherModel
+
+# Counts of a date are invalidated by absences' changes, the timeout only bounds the
+# staleness due to classes and periods changes. Versions never expire.
+OVERVIEW_TIMEOUT = 60 * 10
+# -1 means that nobody took attendances on the period.
+NOT_TAKEN = -1
+
+
+def _version_key(date: datetime.date) -> str:
+    return "student_absence_teacher_overview_version_%s" % date.isoformat()
+
+
+def _get_version(date: datetime.date):
+    version = cache.get(_version_key(date))
+    if version is None:
+        # Start from a timestamp, so that a lost version never matches an older one.
+        cache.add(_version_key(date), time.time_ns(), None)
+        version = cache.get(_version_key(date))
+    return version
+
+
+def invalidate_overview(date: datetime.date) -> None:
+    """Invalidate the cached overviews of a date."""
+    try:
+        cache.incr(_version_key(date))
+    except ValueError:
+        cache.set(_version_key(date), time.time_ns(), None)
+
+
+def _overlaps(period, other) -> bool:
+    return period.start < other.end and period.end > other.start
+
+
+def _teacher_counts(classe_ids, date, teacher_periods, educator_periods) -> dict:
+    # Count absences (without lateness) for each classe and period.
+    absences = (
+        StudentAbsenceTeacherModel.objects.filter(date_absence=date, student__classe__in=classe_ids)
+        .exclude(status=StudentAbsenceTeacherModel.LATENESS)
+        .values_list("student__classe", "period")
+        .annotate(
+            absent=Count("id", filter=Q(status=StudentAbsenceTeacherModel.ABSENCE)),
+        )
+    )
+    teacher_counts = {(classe, period): absent for classe, period, absent in absences}
+
+    not_teacher_counts = {}
+    if educator_periods is not None:
+        not_teacher_counts = _educator_absence_counts(classe_ids, date)
+
+    counts = {}
+    for classe in classe_ids:
+        for period in teacher_periods:
+            count = {}
+            if educator_periods is not None:
+                # Educators' periods overlapping the teachers' one.
+                overlapping = [
+                    not_teacher_counts[(classe, p.id)]
+                    for p in educator_periods
+                    if (classe, p.id) in not_teacher_counts and _overlaps(p, period)
+                ]
+                count["not_teacher_count"] = sum(overlapping) if overlapping else NOT_TAKEN
+            count["teacher_count"] = teacher_counts.get((classe, period.id), NOT_TAKEN)
+            counts[(classe, period.id)] = count
+    return counts
+
+
+def _educator_absence_counts(classe_ids, date) -> dict:
+    from student_absence.models import StudentAbsenceModel
+
+    absences = (
+        StudentAbsenceModel.objects.filter(date_absence=date, student__classe__in=classe_ids)
+        .values_list("student__classe", "period")
+        .annotate(absent=Count("id", filter=Q(is_absent=True)))
+    )
+    return {(classe, period): absent for classe, period, absent in absences}
+
+
+def _educator_counts(classe_ids, date, educator_periods, teacher_periods) -> dict:
+    not_teacher_counts = _educator_absence_counts(classe_ids, date)
+
+    # Absent students are counted once by period, even with several absences.
+    attendances = (
+        StudentAbsenceTeacherModel.objects.filter(date_absence=date, student__classe__in=classe_ids)
+        .values_list("student__classe", "period", "student", "status")
+        .distinct()
+    )
+    taken = set()
+    absent_students = defaultdict(set)
+    for classe, period, student, status in attendances:
+        taken.add((classe, period))
+        if status == StudentAbsenceTeacherModel.ABSENCE:
+            absent_students[(classe, period)].add(student)
+
+    counts = {}
+    for classe in classe_ids:
+        for period in educator_periods:
+            # Teachers' periods overlapping the educators' one.
+            overlapping = [
+                p.id for p in teacher_periods if (classe, p.id) in taken and _overlaps(p, period)
+            ]
+            absents = set().union(*(absent_students[(classe, p)] for p in overlapping))
+            counts[(classe, period.id)] = {
+                "teacher_count": len(absents) if overlapping else NOT_TAKEN,
+                "not_teacher_count": not_teacher_counts.get((classe, period.id), NOT_TAKEN),
+            }
+    return counts
+
+
+def get_overview(date: datetime.date, point_of_view: str, teachings) -> list:
+    """Count absences of a date by classe and by period, from teachers' or educators' point of view.
+
+    Each classe of the teachings gives a dict with the classe and, for each period, the number
+    of absent students according to teachers (teacher_count) and to educators
+    (not_teacher_count). Counts are cached until the date's absences change.
+    """
+    teaching_ids = sorted(t.id for t in teachings)
+    key = "student_absence_teacher_overview_%s_%s_%s_%s" % (
+        point_of_view,
+        date.isoformat(),
+        "-".join(map(str, teaching_ids)),
+        _get_version(date),
+    )
+    overview = cache.get(key)
+    if overview is not None:
+        return overview
+
+    classes = list(ClasseModel.objects.filter(teaching__in=teaching_ids).order_by("year", "letter"))
+    classe_ids = [c.id for c in classes]
+    teacher_periods = list(PeriodModel.objects.order_by("start"))
+    educator_periods = None
+    if "student_absence" in settings.INSTALLED_APPS:
+        from student_absence.models import PeriodModel as PeriodModelEducator
+
+        educator_periods = list(PeriodModelEducator.objects.order_by("start"))
+
+    if point_of_view == "teacher":
+        periods = teacher_periods
+        counts = _teacher_counts(classe_ids, date, teacher_periods, educator_periods)
+    elif point_of_view == "educator":
+        periods = educator_periods
+        counts = _educator_counts(classe_ids, date, educator_periods, teacher_periods)
+    else:
+        raise ValueError("Unknown point of view: %s" % point_of_view)
+
+    overview = []
+    for classe in classes:
+        classe_counts = {"classe": classe.compact_str, "classe__id": classe.id}
+        for period in periods:
+            classe_counts[f"period-{period.id}"] = counts[(classe.id, period.id)]
+        overview.append(classe_counts)
+
+    cache.set(key, overview, OVERVIEW_TIMEOUT)
+    return overview
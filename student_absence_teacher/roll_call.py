@@ -0,0 +1,121 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import StudentAbsenceTeacherModel
+from .overview import invalidate_overview
+
+
+def _get_latenesses(students, date: datetime.date, periods) -> dict:
+    """Comments of the latenesses recorded at the desk, by student and period."""
+    if "lateness" not in settings.INSTALLED_APPS:
+        return {}
+
+    from lateness.models import LatenessModel
+
+    latenesses = LatenessModel.objects.filter(
+        student__in=students, datetime_creation__date=date
+    ).values_list("student", "datetime_creation", "justified")
+    comments = {}
+    for student, datetime_creation, justified in latenesses:
+        time = timezone.localtime(datetime_creation).time()
+        for period in periods:
+            if period.start < time <= period.end:
+                comments[(student, period.id)] = (
+                    f"Retard à {time.strftime('%H:%M')} {'(justifié)' if justified else ''}"
+                )
+    return comments
+
+
+def save_roll_call(
+    date_absence: datetime.date, periods: list, statuses: list, user: User, given_course=None
+) -> list:
+    """Save the statuses of a roll call for each of its periods.
+
+    Present students that were late at the desk are kept late. Changed statuses are upserted
+    at once and returned with their previous status (None if it is new).
+    """
+    students = [s["student"] for s in statuses]
+    existing = {
+        (absence.student_id, absence.period_id): absence
+        for absence in StudentAbsenceTeacherModel.objects.filter(
+            date_absence=date_absence, period__in=periods, student__in=students
+        )
+    }
+    latenesses = _get_latenesses(students, date_absence, periods)
+
+    given_course_id = given_course.id if given_course else None
+    absences = []
+    diff = []
+    for student_status in statuses:
+        student = student_status["student"]
+        for period in periods:
+            status = student_status["status"]
+            comment = student_status["comment"]
+            key = (student.pk, period.id)
+            if key in latenesses and status in [
+                StudentAbsenceTeacherModel.PRESENCE,
+                StudentAbsenceTeacherModel.LATENESS,
+            ]:
+                status = StudentAbsenceTeacherModel.LATENESS
+                comment = comment or latenesses[key]
+
+            previous = existing.get(key)
+            if previous and (previous.status, previous.comment, previous.given_course_id) == (
+                status,
+                comment,
+                given_course_id,
+            ):
+                continue
+
+            absences.append(
+                StudentAbsenceTeacherModel(
+                    student=student,
+                    date_absence=date_absence,
+                    period=period,
+                    status=status,
+                    comment=comment,
+                    given_course=given_course,
+                    user=user,
+                )
+            )
+            diff.append(
+                {
+                    "student_id": student.pk,
+                    "period_id": period.id,
+                    "status": status,
+                    "previous_status": previous.status if previous else None,
+                }
+            )
+
+    if absences:
+        StudentAbsenceTeacherModel.objects.bulk_create(
+            absences,
+            update_conflicts=True,
+            unique_fields=["student", "date_absence", "period"],
+            update_fields=["status", "comment", "given_course", "user", "datetime_update"],
+        )
+        transaction.on_commit(lambda: invalidate_overview(date_absence))
+    return diff
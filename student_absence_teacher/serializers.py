@@ -20,6 +20,7 @@
 from django.conf import settings
 
 from rest_framework import serializers
+from rest_framework.validators import UniqueTogetherValidator
 
 from core.serializers import StudentSerializer, GivenCourseSerializer
 from core.models import StudentModel, GivenCourseModel
@@ -71,3 +72,55 @@ class StudentAbsenceTeacherSerializer(serializers.ModelSerializer):
             "datetime_update",
         )
         read_only_fields = ("user",)
+        # DRF does not validate the model's UniqueConstraint, roll calls update it instead.
+        validators = [
+            UniqueTogetherValidator(
+                queryset=StudentAbsenceTeacherModel.objects.all(),
+                fields=["student_id", "date_absence", "period_id"],
+            )
+        ]
+
+
+class RollCallStatusSerializer(serializers.Serializer):
+    student_id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=StudentAbsenceTeacherModel.STATUS_CHOICES)
+    comment = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class RollCallSerializer(serializers.Serializer):
+    """Validate a roll call sheet, periods and students are each loaded with one query."""
+
+    date_absence = serializers.DateField()
+    period_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    given_course_id = serializers.PrimaryKeyRelatedField(
+        queryset=GivenCourseModel.objects.all(),
+        source="given_course",
+        required=False,
+        allow_null=True,
+    )
+    statuses = RollCallStatusSerializer(many=True)
+
+    def validate_period_ids(self, value):
+        period_ids = list(dict.fromkeys(value))
+        periods = PeriodModel.objects.in_bulk(period_ids)
+        missing = [pk for pk in period_ids if pk not in periods]
+        if missing:
+            raise serializers.ValidationError("Unknown periods: %s" % missing)
+        return [periods[pk] for pk in period_ids]
+
+    def validate_statuses(self, value):
+        matricules = [s["student_id"] for s in value]
+        if len(set(matricules)) != len(matricules):
+            raise serializers.ValidationError("A student has several statuses.")
+        students = StudentModel.objects.in_bulk(matricules)
+        missing = [m for m in matricules if m not in students]
+        if missing:
+            raise serializers.ValidationError("Unknown students: %s" % missing)
+        return [
+            {"student": students[s["student_id"]], "status": s["status"], "comment": s["comment"]}
+            for s in value
+        ]
+
+    def validate(self, data):
+        data["periods"] = data.pop("period_ids")
+        return data
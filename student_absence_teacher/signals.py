@@ -0,0 +1,39 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import StudentAbsenceTeacherModel
+from .overview import invalidate_overview
+
+
+@receiver([post_save, post_delete], sender=StudentAbsenceTeacherModel)
+def absence_changed(sender, instance, **kwargs):
+    date = instance.date_absence
+    transaction.on_commit(lambda: invalidate_overview(date))
+
+
+if "student_absence" in settings.INSTALLED_APPS:
+    from student_absence.models import StudentAbsenceModel
+
+    post_save.connect(absence_changed, sender=StudentAbsenceModel)
+    post_delete.connect(absence_changed, sender=StudentAbsenceModel)
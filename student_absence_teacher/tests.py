@@ -1,3 +1,249 @@
+# This file is part of HappySchool.
+#
+# HappySchool is the legal property of its developers, whose names
+# can be found in the AUTHORS file distributed with this source
+# distribution.
+#
+# HappySchool is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HappySchool is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with HappySchool.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from core.models import ClasseModel, StudentModel, TeachingModel
+from core.settings_registry import settings_registry
+from lateness.models import LatenessModel
+from student_absence.models import StudentAbsenceModel, PeriodModel as PeriodModelEducator
+
+from .models import StudentAbsenceTeacherModel, StudentAbsenceTeacherSettingsModel, PeriodModel
+from .overview import get_overview
+
+
+class OverviewTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        self.date = datetime.date(2023, 9, 4)
+        self.teachings = TeachingModel.objects.all()
+        settings = StudentAbsenceTeacherSettingsModel.objects.create()
+        settings.teachings.set(self.teachings)
+
+        self.user = User.objects.get(username="director")
+        self.classe, self.other_classe = ClasseModel.objects.filter(
+            studentmodel__isnull=False
+        ).distinct()[:2]
+        self.student, self.other_student = self.classe.studentmodel_set.all()[:2]
+        self.first_period = PeriodModel.objects.create(
+            start=datetime.time(8, 0), end=datetime.time(9, 0), name="1"
+        )
+        self.second_period = PeriodModel.objects.create(
+            start=datetime.time(9, 0), end=datetime.time(10, 0), name="2"
+        )
+        self.morning = PeriodModelEducator.objects.create(
+            start=datetime.time(8, 0), end=datetime.time(10, 0), name="Matin"
+        )
+
+        for student, period, status in [
+            (self.student, self.first_period, StudentAbsenceTeacherModel.ABSENCE),
+            (self.other_student, self.first_period, StudentAbsenceTeacherModel.PRESENCE),
+            (self.other_student, self.second_period, StudentAbsenceTeacherModel.LATENESS),
+        ]:
+            StudentAbsenceTeacherModel.objects.create(
+                student=student,
+                date_absence=self.date,
+                period=period,
+                status=status,
+                user=self.user,
+            )
+        StudentAbsenceModel.objects.create(
+            student=self.student, date_absence=self.date, period=self.morning, is_absent=True
+        )
+
+    def get_classe_counts(self, point_of_view, classe):
+        overview = get_overview(self.date, point_of_view, self.teachings)
+        return next(c for c in overview if c["classe__id"] == classe.id)
+
+    def test_teacher_point_of_view(self):
+        counts = self.get_classe_counts("teacher", self.classe)
+        self.assertEqual(
+            counts[f"period-{self.first_period.id}"], {"teacher_count": 1, "not_teacher_count": 1}
+        )
+        # Only lateness, attendances were not taken.
+        self.assertEqual(
+            counts[f"period-{self.second_period.id}"],
+            {"teacher_count": -1, "not_teacher_count": 1},
+        )
+
+        counts = self.get_classe_counts("teacher", self.other_classe)
+        self.assertEqual(
+            counts[f"period-{self.first_period.id}"],
+            {"teacher_count": -1, "not_teacher_count": -1},
+        )
+
+    def test_educator_point_of_view(self):
+        counts = self.get_classe_counts("educator", self.classe)
+        self.assertEqual(
+            counts[f"period-{self.morning.id}"], {"teacher_count": 1, "not_teacher_count": 1}
+        )
+        counts = self.get_classe_counts("educator", self.other_classe)
+        self.assertEqual(
+            counts[f"period-{self.morning.id}"], {"teacher_count": -1, "not_teacher_count": -1}
+        )
+
+    def test_cache(self):
+        # Classes, periods of teachers and educators, and absences.
+        with self.assertNumQueries(5):
+            get_overview(self.date, "teacher", self.teachings)
+        with self.assertNumQueries(0):
+            get_overview(self.date, "teacher", self.teachings)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            StudentAbsenceTeacherModel.objects.create(
+                student=self.student,
+                date_absence=self.date,
+                period=self.second_period,
+                status=StudentAbsenceTeacherModel.ABSENCE,
+                user=self.user,
+            )
+        counts = self.get_classe_counts("teacher", self.classe)
+        self.assertEqual(counts[f"period-{self.second_period.id}"]["teacher_count"], 1)
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get(
+            "/student_absence_teacher/api/count_absence/%s/teacher/allclass/" % self.date
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class RollCallTest(TestCase):
+    fixtures = ["base_random_people_auth.json", "base_random_people_core"]
+    url = "/student_absence_teacher/api/absence/roll_call/"
+
+    def setUp(self):
+        cache.clear()
+        settings_registry.clear()
+        self.date = datetime.date(2023, 9, 4)
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(username="admin"))
+        self.first_period = PeriodModel.objects.create(
+            start=datetime.time(8, 0), end=datetime.time(9, 0), name="1"
+        )
+        self.second_period = PeriodModel.objects.create(
+            start=datetime.time(9, 0), end=datetime.time(10, 0), name="2"
+        )
+
+    def roll_call(self, students, status=StudentAbsenceTeacherModel.PRESENCE):
+        data = {
+            "date_absence": self.date.isoformat(),
+            "period_ids": [self.first_period.id, self.second_period.id],
+            "statuses": [{"student_id": s.matricule, "status": status} for s in students],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, data, format="json")
+
+    def test_queries(self):
+        students = list(StudentModel.objects.order_by("matricule")[:30])
+        for roll in [students[:2], students[2:]]:
+            # Periods, students, existing statuses, latenesses and the upsert.
+            with self.assertNumQueries(5):
+                response = self.roll_call(roll, StudentAbsenceTeacherModel.ABSENCE)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), len(roll) * 2)
+
+    def test_diff(self):
+        student, other_student = StudentModel.objects.order_by("matricule")[:2]
+        response = self.roll_call([student, other_student])
+        self.assertEqual(len(response.json()), 4)
+        self.assertEqual(response.json()[0]["previous_status"], None)
+
+        # Unchanged statuses are neither written nor returned.
+        response = self.client.post(
+            self.url,
+            {
+                "date_absence": self.date.isoformat(),
+                "period_ids": [self.first_period.id, self.second_period.id],
+                "statuses": [
+                    {"student_id": student.matricule, "status": "absence"},
+                    {"student_id": other_student.matricule, "status": "presence"},
+                ],
+            },
+            format="json",
+        )
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "student_id": student.matricule,
+                    "period_id": period.id,
+                    "status": "absence",
+                    "previous_status": "presence",
+                }
+                for period in [self.first_period, self.second_period]
+            ],
+        )
+        self.assertEqual(
+            StudentAbsenceTeacherModel.objects.filter(date_absence=self.date).count(), 4
+        )
+
+    def test_lateness(self):
+        student = StudentModel.objects.order_by("matricule").first()
+        lateness = LatenessModel.objects.create(student=student)
+        lateness_time = timezone.make_aware(
+            datetime.datetime.combine(self.date, datetime.time(9, 20))
+        )
+        LatenessModel.objects.filter(id=lateness.id).update(datetime_creation=lateness_time)
+
+        response = self.roll_call([student])
+        statuses = {d["period_id"]: d["status"] for d in response.json()}
+        self.assertEqual(
+            statuses,
+            {
+                self.first_period.id: StudentAbsenceTeacherModel.PRESENCE,
+                self.second_period.id: StudentAbsenceTeacherModel.LATENESS,
+            },
+        )
+        absence = StudentAbsenceTeacherModel.objects.get(student=student, period=self.second_period)
+        self.assertTrue(absence.comment.startswith("Retard à 09:20"))
+
+    def test_invalid_student(self):
+        response = self.client.post(
+            self.url,
+            {
+                "date_absence": self.date.isoformat(),
+                "period_ids": [self.first_period.id],
+                "statuses": [{"student_id": 0, "status": "absence"}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    def test_duplicated_absence(self):
+        student = StudentModel.objects.order_by("matricule").first()
+        data = {
+            "student_id": student.matricule,
+            "date_absence": self.date.isoformat(),
+            "period_id": self.first_period.id,
+            "status": StudentAbsenceTeacherModel.ABSENCE,
+        }
+        url = "/student_absence_teacher/api/absence/"
+        self.assertEqual(self.client.post(url, data, format="json").status_code, 201)
+        self.assertEqual(self.client.post(url, data, format="json").status_code, 400)
@@ -29,6 +29,10 @@ urlpatterns = [
     path("", views.StudentAbsenceTeacherView.as_view(), name="student_absence_teacher"),
     path("export/<document>/<date_from>/<date_to>/", views.ExportAbsencesAPI.as_view()),
     path("api/count_absence/<date>/<point_of_view>/<class_list>/", views.OverviewAPI.as_view()),
+    path(
+        "api/absence/roll_call/",
+        views.StudentAbsenceTeacherViewSet.as_view({"post": "roll_call"}),
+    ),
 ]
 
 router = DefaultRouter()
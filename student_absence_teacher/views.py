@@ -25,7 +25,7 @@ from itertools import groupby
 from weasyprint import HTML
 
 from django.template.loader import get_template
-from django.db.models import Count, ObjectDoesNotExist
+from django.db.models import ObjectDoesNotExist
 from django.conf import settings
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
@@ -39,11 +39,13 @@ from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
 from rest_framework.filters import OrderingFilter
 
-from core.models import ClasseModel, StudentModel, ResponsibleModel
+from core.models import StudentModel, ResponsibleModel
 from core.utilities import get_menu, get_scholar_year
 from core.people import get_classes
-from core.views import BaseFilters, PageNumberSizePagination
+from core.views import BaseFilters, PageNumberSizePagination, get_app_settings
 
+from .overview import get_overview
+from .roll_call import save_roll_call
 from .models import (
     StudentAbsenceTeacherSettingsModel,
     StudentAbsenceTeacherModel,
@@ -54,6 +56,7 @@ from .serializers import (
     StudentAbsenceTeacherSettingsSerializer,
     PeriodSerializer,
     StudentAbsenceTeacherSerializer,
+    RollCallSerializer,
 )
 
 
@@ -69,12 +72,7 @@ def get_menu_entry(active_app: str, request) -> dict:
 
 
 def get_settings():
-    settings_student_absence = StudentAbsenceTeacherSettingsModel.objects.first()
-    if not settings_student_absence:
-        # Create default settings.
-        settings_student_absence = StudentAbsenceTeacherSettingsModel.objects.create().save()
-
-    return settings_student_absence
+    return get_app_settings(StudentAbsenceTeacherSettingsModel)
 
 
 class StudentAbsenceTeacherView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
@@ -151,6 +149,12 @@ class StudentAbsenceTeacherViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def roll_call(self, request, *args, **kwargs):
+        """Save a whole roll call and return the changed statuses."""
+        serializer = RollCallSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(save_roll_call(user=request.user, **serializer.validated_data))
+
 
 class PeriodViewSet(ReadOnlyModelViewSet):
     queryset = PeriodModel.objects.all().order_by("start")
@@ -160,121 +164,26 @@ class PeriodViewSet(ReadOnlyModelViewSet):
 class OverviewAPI(APIView):
     permission_classes = [IsAuthenticated]
 
-    def _extract_count_from_educator(self, classe, absences, periods, date):
-        counts = {"classe": classe.compact_str, "classe__id": classe.id}
-
-        teacher_abs = StudentAbsenceTeacherModel.objects.filter(
-            student__classe=classe,
-            date_absence=date,
-        )
-        for period in periods:
-            teacher_abs_period = teacher_abs.filter(
-                period__start__lt=period.end, period__end__gt=period.start
-            )
-            # If teacher count is -1, it means that the teacher didn't take attendences.
-            if teacher_abs_period.count() > 0:
-                teacher_count = (
-                    teacher_abs_period.filter(status=StudentAbsenceTeacherModel.ABSENCE)
-                    .distinct("student")
-                    .count()
-                )
-            else:
-                teacher_count = -1
-            counts[f"period-{period.id}"] = {"teacher_count": teacher_count}
-            # Hu?
-            counts[f"period-{period.id}"]["not_teacher_count"] = next(
-                (x["id__count"] for x in absences if x["period"] == period.id and x["is_absent"]),
-                next((0 for y in absences if y["period"] == period.id), -1),
-            )
-        return counts
-
-    def _extract_count_from_teacher(self, classe, absences, periods, date):
-        counts = {"classe": classe.compact_str, "classe__id": classe.id}
-
-        use_student_absence = "student_absence" in settings.INSTALLED_APPS
-        if use_student_absence:
-            from student_absence.models import StudentAbsenceModel
-        not_teacher_abs = StudentAbsenceModel.objects.filter(
-            student__classe=classe, date_absence=date
-        )
-
-        for period in periods:
-            if use_student_absence:
-                not_teacher_period = not_teacher_abs.filter(
-                    period__start__lt=period.end, period__end__gt=period.start
-                )
-                if not_teacher_period.count() > 0:
-                    not_teacher_count = not_teacher_period.filter(is_absent=True).count()
-                else:
-                    not_teacher_count = -1
-                counts[f"period-{period.id}"] = {"not_teacher_count": not_teacher_count}
-            counts[f"period-{period.id}"]["teacher_count"] = next(
-                (
-                    x["id__count"]
-                    for x in absences
-                    if x["period"] == period.id
-                    and x["status"] == StudentAbsenceTeacherModel.ABSENCE
-                ),
-                next((0 for y in absences if y["period"] == period.id), -1),
-            )
-
-        return counts
-
     def get(self, request, date, point_of_view, class_list="allclass", format=None):
         date = datetime.date.fromisoformat(date)
-        classes = ClasseModel.objects.order_by("year", "letter").filter(
-            teaching__in=get_settings().teachings.all()
-        )
-        if class_list == "ownclass":
-            classes = get_classes(
-                teaching=get_settings().teachings.all(),
-                check_access=True,
-                user=request.user,
-                tenure_class_only=False,
-                educ_by_years="both",
-            ).order_by("year", "letter")
-
-        if point_of_view == "teacher":
-            periods = PeriodModel.objects.order_by("start")
-            count_by_classe_by_period = [
-                self._extract_count_from_teacher(
-                    c,
-                    StudentAbsenceTeacherModel.objects.exclude(  ## Exclude only LATENESS ????
-                        status=StudentAbsenceTeacherModel.LATENESS
-                    )
-                    .filter(date_absence=date, student__classe=c)
-                    .values("period", "status")
-                    .annotate(Count("id")),
-                    periods,
-                    date,
-                )
-                for c in classes
-            ]
-
-            return Response(json.dumps(count_by_classe_by_period))
-        elif point_of_view == "educator":
-            if "student_absence" not in settings.INSTALLED_APPS:
-                return Response(json.dumps({}))
+        if point_of_view == "educator" and "student_absence" not in settings.INSTALLED_APPS:
+            return Response(json.dumps({}))
 
-            from student_absence.models import (
-                StudentAbsenceModel,
-                PeriodModel as PeriodModelEducator,
+        teachings = get_settings().teachings.all()
+        overview = get_overview(date, point_of_view, teachings)
+        if class_list == "ownclass":
+            classe_ids = set(
+                get_classes(
+                    teaching=teachings,
+                    check_access=True,
+                    user=request.user,
+                    tenure_class_only=False,
+                    educ_by_years="both",
+                ).values_list("id", flat=True)
             )
+            overview = [c for c in overview if c["classe__id"] in classe_ids]
 
-            periods = PeriodModelEducator.objects.order_by("start")
-            count_by_classe_by_period = [
-                self._extract_count_from_educator(
-                    c,
-                    StudentAbsenceModel.objects.filter(date_absence=date, student__classe=c)
-                    .values("period", "is_absent")
-                    .annotate(Count("id")),
-                    periods,
-                    date,
-                )
-                for c in classes
-            ]
-
-            return Response(json.dumps(count_by_classe_by_period))
+        return Response(json.dumps(overview))
 
 
 class ExportAbsencesAPI(APIView):